@@ -0,0 +1,213 @@
+"""
+Benchmark del camino /question: síncrono (antes) vs asíncrono (answer_question_async),
+y /questions/batch (answer_questions_batch) contra las mismas preguntas una por una.
+
+Usa proveedores stub locales (embedding + chat con latencia simulada), así que
+no necesita claves ni red. Ejemplo:
+
+    python scripts/bench_async_question.py --requests 64 --concurrency 1 4 16 64
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.modelClientFactory import ModelClientFactory  # noqa: E402
+from src.services.rag_service import RAGService  # noqa: E402
+
+
+def _latency(rng: random.Random, median_ms: float) -> float:
+    """Latencia log-normal alrededor de la mediana (cola derecha como una API real)"""
+    return rng.lognormvariate(0, 0.35) * median_ms / 1000
+
+
+class StubEmbeddingService:
+    """Imita EmbeddingServiceChroma: embedding remoto + búsqueda local"""
+
+    def __init__(self, embed_ms: float, search_ms: float, seed: int = 0):
+        self.embed_ms = embed_ms
+        self.search_ms = search_ms
+        self.rng = random.Random(seed)
+        self.index_version = 1
+
+    def _results(self, n_results: int, include_embeddings: bool = False) -> dict:
+        results = {
+            "ids": [[f"chunk_{i}" for i in range(n_results)]],
+            "documents": [[f"Fragmento {i} sobre inteligencia artificial." for i in range(n_results)]],
+            "metadatas": [[{"source": f"doc_{i}.pdf", "page": i} for i in range(n_results)]],
+        }
+        if include_embeddings:
+            results["embeddings"] = [[[self.rng.random() for _ in range(8)] for _ in range(n_results)]]
+        return results
+
+    def search(self, embedding, n_results: int = 5, query_text: str = None, include_embeddings: bool = False):
+        time.sleep(self.search_ms / 1000)
+        return self._results(n_results, include_embeddings)
+
+    def embed_query(self, text: str):
+        time.sleep(_latency(self.rng, self.embed_ms))
+        return [self.rng.random() for _ in range(8)]
+
+    async def aembed_query(self, text: str):
+        await asyncio.sleep(_latency(self.rng, self.embed_ms))
+        return [self.rng.random() for _ in range(8)]
+
+    async def aembed_queries(self, texts: list):
+        # Una sola llamada para todo el lote
+        await asyncio.sleep(_latency(self.rng, self.embed_ms))
+        return [[self.rng.random() for _ in range(8)] for _ in texts]
+
+    def search_many(self, embeddings: list, n_results: int = 5, query_texts: list = None,
+                    include_embeddings: bool = False):
+        time.sleep(self.search_ms / 1000)
+        return [self._results(n_results, include_embeddings) for _ in embeddings]
+
+    def query(self, text: str, n_results: int = 5):
+        return self.search(self.embed_query(text), n_results)
+
+    async def aquery(self, text: str, n_results: int = 5):
+        embedding = await self.aembed_query(text)
+        return await asyncio.to_thread(self.search, embedding, n_results)
+
+
+class _StubCompletions:
+    def __init__(self, chat_ms: float, rng: random.Random, is_async: bool):
+        self.chat_ms = chat_ms
+        self.rng = rng
+        self.is_async = is_async
+
+    @staticmethod
+    def _completion():
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="Respuesta stub."))],
+            usage=SimpleNamespace(prompt_tokens=380, completion_tokens=40, total_tokens=420),
+        )
+
+    def create(self, **kwargs):
+        delay = _latency(self.rng, self.chat_ms)
+        if self.is_async:
+            async def _acreate():
+                await asyncio.sleep(delay)
+                return self._completion()
+            return _acreate()
+        time.sleep(delay)
+        return self._completion()
+
+
+class StubClientFactory(ModelClientFactory):
+    """ModelClientFactory (con su ruteo, fallback y circuit breaker) sobre clientes Groq/OpenAI stub"""
+
+    def __init__(self, chat_ms: float, seed: int = 0):
+        super().__init__()
+        rng = random.Random(seed)
+        self._sync = SimpleNamespace(chat=SimpleNamespace(completions=_StubCompletions(chat_ms, rng, False)))
+        self._async = SimpleNamespace(chat=SimpleNamespace(completions=_StubCompletions(chat_ms, rng, True)))
+
+    def get_client(self, provider: str):
+        return self._sync
+
+    def get_async_client(self, provider: str):
+        return self._async
+
+    def is_configured(self, provider: str) -> bool:
+        return True
+
+
+def build_service(args, max_concurrent: int) -> RAGService:
+    service = RAGService(
+        embedding_service=StubEmbeddingService(args.embed_ms, args.search_ms),
+        client_factory=StubClientFactory(args.chat_ms),
+    )
+    service.max_concurrent_questions = max_concurrent
+    # Se mide el pipeline completo: sin caché de respuestas ni coalescing de preguntas idénticas
+    service.answer_cache = None
+    service.single_flight = None
+    service.initialized = True
+    return service
+
+
+async def run_sync_baseline(service: RAGService, n_requests: int) -> float:
+    """Comportamiento anterior: endpoint async que llama al método síncrono"""
+    async def handler():
+        return service.answer_question("¿Qué es la IA?", "groq", 3, "breve")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handler() for _ in range(n_requests)))
+    return time.perf_counter() - start
+
+
+async def run_async(service: RAGService, n_requests: int, concurrency: int) -> float:
+    """Clientes concurrentes contra answer_question_async"""
+    queue = asyncio.Queue()
+    for _ in range(n_requests):
+        queue.put_nowait(None)
+
+    async def client():
+        while not queue.empty():
+            queue.get_nowait()
+            await service.answer_question_async("¿Qué es la IA?", "groq", 3, "breve")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def run_sequential(service: RAGService, n_requests: int) -> float:
+    """Un cliente que manda las preguntas de a una (como un script de evaluación)"""
+    start = time.perf_counter()
+    for i in range(n_requests):
+        await service.answer_question_async(f"Pregunta {i}", "groq", 3, "breve")
+    return time.perf_counter() - start
+
+
+async def run_batch(service: RAGService, n_requests: int) -> float:
+    """Las mismas preguntas en una sola llamada a answer_questions_batch"""
+    questions = [
+        {"question": f"Pregunta {i}", "provider": "groq", "top_k": 3, "mode": "breve"}
+        for i in range(n_requests)
+    ]
+    start = time.perf_counter()
+    responses = await service.answer_questions_batch(questions)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for response in responses if response.get("error"))
+    if failed:
+        print(f"⚠️ {failed} preguntas del lote fallaron")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--max-concurrent", type=int, default=64, help="MAX_CONCURRENT_QUESTIONS del servicio")
+    parser.add_argument("--embed-ms", type=float, default=60.0)
+    parser.add_argument("--search-ms", type=float, default=5.0)
+    parser.add_argument("--chat-ms", type=float, default=800.0)
+    parser.add_argument("--batch-size", type=int, default=60, help="Preguntas del lote para /questions/batch")
+    parser.add_argument("--batch-concurrency", type=int, default=8, help="Generaciones simultáneas por proveedor")
+    args = parser.parse_args()
+
+    print(f"{'modo':<22}{'concurrencia':>14}{'tiempo (s)':>12}{'req/s':>10}")
+    elapsed = asyncio.run(run_sync_baseline(build_service(args, args.max_concurrent), args.requests))
+    print(f"{'sync (antes)':<22}{'-':>14}{elapsed:>12.2f}{args.requests / elapsed:>10.2f}")
+
+    for concurrency in args.concurrency:
+        service = build_service(args, args.max_concurrent)
+        elapsed = asyncio.run(run_async(service, args.requests, concurrency))
+        print(f"{'async':<22}{concurrency:>14}{elapsed:>12.2f}{args.requests / elapsed:>10.2f}")
+
+    elapsed = asyncio.run(run_sequential(build_service(args, args.max_concurrent), args.batch_size))
+    print(f"{'secuencial /question':<22}{1:>14}{elapsed:>12.2f}{args.batch_size / elapsed:>10.2f}")
+    service = build_service(args, args.max_concurrent)
+    service.provider_concurrency = {"openai": args.batch_concurrency, "groq": args.batch_concurrency}
+    elapsed = asyncio.run(run_batch(service, args.batch_size))
+    print(f"{'/questions/batch':<22}{args.batch_concurrency:>14}{elapsed:>12.2f}{args.batch_size / elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
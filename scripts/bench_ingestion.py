@@ -0,0 +1,88 @@
+"""
+Benchmark de la ingesta de PDFs: parseo + chunking con 1 vs N procesos.
+
+Genera un corpus sintético de PDFs con PyMuPDF y mide páginas/s y chunks/s del
+pipeline iter_pdf_docs (los chunks se agrupan en lotes como en RAGService.sync_folder).
+Ejemplo:
+
+    python scripts/bench_ingestion.py --pdfs 40 --pages 20 --workers 1 2 4
+"""
+import argparse
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.pdf_service import iter_pdf_docs  # noqa: E402
+
+PARAGRAPH = (
+    "La inteligencia artificial estudia agentes que perciben su entorno y actúan para "
+    "maximizar sus objetivos. El aprendizaje automático permite que estos agentes mejoren "
+    "con la experiencia a partir de datos. "
+)
+
+
+def build_corpus(folder: Path, n_pdfs: int, pages: int) -> list:
+    paths = []
+    for i in range(n_pdfs):
+        doc = fitz.open()
+        for page_number in range(pages):
+            page = doc.new_page()
+            text = f"Documento {i}, página {page_number}. " + PARAGRAPH * 12
+            page.insert_textbox(fitz.Rect(40, 40, 560, 800), text, fontsize=9)
+        path = folder / f"sintetico_{i:03d}.pdf"
+        doc.save(path)
+        paths.append(path)
+    return paths
+
+
+def run(paths: list, workers: int, batch_size: int) -> dict:
+    start = time.perf_counter()
+    pages = chunks = batches = 0
+    batch = []
+    for result in iter_pdf_docs(paths, workers=workers):
+        pages += result.get("pages", 0)
+        for doc in result.get("docs", []):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                chunks += len(batch)
+                batches += 1
+                batch = []
+    chunks += len(batch)
+    batches += 1 if batch else 0
+    elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "pages": pages, "chunks": chunks, "batches": batches}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Generando {args.pdfs} PDFs de {args.pages} páginas...")
+        paths = build_corpus(Path(tmp), args.pdfs, args.pages)
+
+        print(f"{'workers':>8}{'tiempo (s)':>12}{'páginas/s':>12}{'chunks/s':>12}{'lotes':>8}")
+        for workers in args.workers:
+            result = run(paths, workers, args.batch_size)
+            print(f"{workers:>8}{result['elapsed']:>12.2f}"
+                  f"{result['pages'] / result['elapsed']:>12.1f}"
+                  f"{result['chunks'] / result['elapsed']:>12.1f}{result['batches']:>8}")
+
+        # ru_maxrss está en KB en Linux
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        print(f"Memoria pico: proceso principal {own:.0f} MB, workers {children:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Benchmark offline de calidad de recuperación y latencia por etapa con las preguntas gold.
+
+Para cada combinación de chunk_size / chunk_overlap indexa los PDFs de data/ con un
+embedder local determinista (hashing de términos, sin red ni modelos descargados), pasa
+cada pregunta gold por EmbeddingServiceChroma (embed_query + search, lo mismo que query)
+y para cada top_k reporta:
+- recall@k (fracción de páginas relevantes recuperadas) y hit@k (al menos una)
+- MRR del primer chunk de una página relevante
+- tokens del contexto que se armaría con esos chunks (build_context, sin presupuesto)
+- latencia p50 de cada etapa: embedding, búsqueda y armado del contexto
+
+Las páginas relevantes salen de --labels (CSV con columnas Pregunta, source, pagina; la
+página empieza en 1 como en un visor de PDF). Si no hay etiquetas se generan etiquetas
+"silver": las páginas con mayor BM25 contra la pregunta + la respuesta esperada de
+--gold-csv. Son una aproximación léxica: --write-labels las guarda para revisarlas a mano.
+
+Al final recomienda la configuración con menos tokens de contexto que alcanza
+--target-recall. Ejemplo:
+
+    python scripts/bench_retrieval.py --chunk-sizes 300 500 800 --overlaps 50 100 --top-k 3 5 8
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+# Solo el embedder local del benchmark: sin OpenAI ni sentence-transformers ni caché en disco
+os.environ["USE_OPENAI_EMBEDDINGS"] = "false"
+os.environ["EMBEDDER_ENABLED"] = "false"
+os.environ["EMBEDDING_CACHE_PERSIST"] = "false"
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import fitz  # PyMuPDF  # noqa: E402
+
+from src.services.embedding_service_chroma import EmbeddingServiceChroma  # noqa: E402
+from src.services.lexical_index import BM25Index, tokenize  # noqa: E402
+from src.services.pdf_service import load_pdf_docs  # noqa: E402
+from src.services.rag_service import MMR_LAMBDA, RERANK_FETCH_FACTOR, build_context  # noqa: E402
+from src.services.reranking import rerank_results  # noqa: E402
+
+
+class HashingEmbedder:
+    """
+    Embedder determinista con la interfaz de SentenceTransformer.encode: cada término
+    (tokenize de BM25) y su prefijo de 5 letras suman log(1 + tf) con signo en una dimensión
+    elegida por hash. Captura solapamiento léxico, no semántica: sirve para comparar
+    configuraciones de chunking entre sí, no para estimar la calidad absoluta de OpenAI.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _features(self, text: str) -> Counter:
+        features = Counter()
+        for token in tokenize(text):
+            features[token] += 1
+            if len(token) > 5:
+                features[token[:5] + "*"] += 1
+        return features
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, freq in self._features(text).items():
+            value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[value % self.dim] += (1.0 if value >> 63 else -1.0) * (1 + math.log(freq))
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0
+            return vector
+        return vector / norm
+
+    def encode(self, texts, batch_size: int = 64, convert_to_numpy: bool = True, **kwargs):
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+
+def load_gold(path: Path) -> list:
+    """[(pregunta, respuesta esperada o "")] del CSV gold"""
+    with open(path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    return [
+        (row["Pregunta"].strip(), (row.get("respuesta esperada") or "").strip())
+        for row in rows if row.get("Pregunta", "").strip()
+    ]
+
+
+def load_labels(path: Path) -> dict:
+    """{pregunta: {(archivo, página base 0)}} desde el CSV de etiquetas"""
+    labels = {}
+    with open(path, encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            key = (Path(row["source"]).name, int(row["pagina"]) - 1)
+            labels.setdefault(row["Pregunta"].strip(), set()).add(key)
+    return labels
+
+
+def silver_labels(pdf_paths: list, gold: list, min_ratio: float = 0.8) -> dict:
+    """Páginas con BM25 >= min_ratio * el mejor score para pregunta + respuesta esperada"""
+    index = BM25Index()
+    for pdf_path in pdf_paths:
+        with fitz.open(pdf_path) as doc:
+            for page_number, page in enumerate(doc):
+                index.add([f"{pdf_path.name}\x00{page_number}"], [page.get_text()])
+    labels = {}
+    for question, expected in gold:
+        ranked = index.search(f"{question} {expected}", n_results=10)
+        if not ranked:
+            continue
+        best = ranked[0][1]
+        labels[question] = {
+            (name, int(page)) for name, page in
+            (page_id.split("\x00") for page_id, score in ranked if score >= min_ratio * best)
+        }
+    return labels
+
+
+def write_labels(path: Path, labels: dict):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Pregunta", "source", "pagina"])
+        for question, pages in labels.items():
+            for name, page in sorted(pages):
+                writer.writerow([question, name, page + 1])
+
+
+def build_service(pdf_paths: list, chunk_size: int, chunk_overlap: int, embedder, backend: str,
+                  persist_dir: Path) -> tuple:
+    service = EmbeddingServiceChroma(persist_dir=str(persist_dir), persistent=False, vector_backend=backend)
+    service.embedder = embedder
+    service.embedding_executor.embedder = embedder
+    service.reset_collection()
+    start = time.perf_counter()
+    docs = []
+    for pdf_path in pdf_paths:
+        docs.extend(load_pdf_docs(pdf_path, chunk_size=chunk_size, chunk_overlap=chunk_overlap)["docs"])
+    service.add_documents(docs, persist=False)
+    return service, len(docs), time.perf_counter() - start
+
+
+def evaluate(service, labels: dict, top_ks: list, rerank: bool) -> dict:
+    """Métricas por top_k: recall, hit, MRR, tokens de contexto y latencias por etapa"""
+    stats = {k: {"recall": [], "hit": [], "rr": [], "tokens": [], "search_ms": [], "context_ms": []}
+             for k in top_ks}
+    embed_ms = []
+    for question, relevant in labels.items():
+        start = time.perf_counter()
+        embedding = service.embed_query(question)
+        embed_ms.append((time.perf_counter() - start) * 1000)
+
+        for k in top_ks:
+            start = time.perf_counter()
+            if rerank:
+                results = service.search(embedding, n_results=k * RERANK_FETCH_FACTOR, query_text=question,
+                                         include_embeddings=True)
+                results = rerank_results(results, embedding, k, MMR_LAMBDA)
+            else:
+                results = service.search(embedding, n_results=k, query_text=question)
+            search_ms = (time.perf_counter() - start) * 1000
+
+            texts = results.get("documents", [[]])[0]
+            metadatas = results.get("metadatas", [[]])[0]
+            start = time.perf_counter()
+            _, tokens, _ = build_context(texts, metadatas)
+            context_ms = (time.perf_counter() - start) * 1000
+
+            pages = [(Path(m.get("source", "")).name, m.get("page")) for m in metadatas]
+            ranks = [rank for rank, page in enumerate(pages, start=1) if page in relevant]
+            row = stats[k]
+            row["recall"].append(len(relevant & set(pages)) / len(relevant))
+            row["hit"].append(1.0 if ranks else 0.0)
+            row["rr"].append(1.0 / ranks[0] if ranks else 0.0)
+            row["tokens"].append(tokens)
+            row["search_ms"].append(search_ms)
+            row["context_ms"].append(context_ms)
+
+    return {
+        k: {
+            "recall": float(np.mean(row["recall"])),
+            "hit": float(np.mean(row["hit"])),
+            "mrr": float(np.mean(row["rr"])),
+            "context_tokens": float(np.mean(row["tokens"])),
+            "embed_ms_p50": float(np.percentile(embed_ms, 50)),
+            "search_ms_p50": float(np.percentile(row["search_ms"], 50)),
+            "context_ms_p50": float(np.percentile(row["context_ms"], 50)),
+        }
+        for k, row in stats.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", type=Path, default=REPO_ROOT / "data")
+    parser.add_argument("--gold-csv", type=Path, default=REPO_ROOT / "preguntas_gold_con_respuestas_openai.csv",
+                        help="preguntas gold (con 'respuesta esperada' si existe, para las etiquetas silver)")
+    parser.add_argument("--labels", type=Path, default=None, help="CSV Pregunta, source, pagina (base 1)")
+    parser.add_argument("--write-labels", type=Path, default=None, help="guarda las etiquetas usadas")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[300, 500, 800])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[50, 100])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--rerank", action="store_true", help="aplica MMR + fusión de solapados como RAGService")
+    parser.add_argument("--backend", default="numpy", choices=("chroma", "numpy"))
+    parser.add_argument("--dim", type=int, default=512, help="dimensión del embedder de hashing")
+    parser.add_argument("--target-recall", type=float, default=0.8)
+    parser.add_argument("--report", type=Path, default=None, help="resultados en JSON")
+    args = parser.parse_args()
+
+    pdf_paths = sorted(args.data_dir.glob("*.pdf"))
+    if not pdf_paths:
+        parser.error(f"No hay PDFs en {args.data_dir}")
+
+    gold = load_gold(args.gold_csv)
+    if args.labels:
+        labels = load_labels(args.labels)
+        print(f"🏷️ {len(labels)} preguntas con etiquetas de {args.labels}")
+    else:
+        labels = silver_labels(pdf_paths, gold)
+        with_expected = sum(bool(expected) for _, expected in gold)
+        print(f"🏷️ Etiquetas silver (BM25 sobre páginas) para {len(labels)} preguntas "
+              f"({with_expected} con respuesta esperada)")
+    if args.write_labels:
+        write_labels(args.write_labels, labels)
+        print(f"💾 Etiquetas guardadas en {args.write_labels}")
+
+    embedder = HashingEmbedder(args.dim)
+    rows = []
+    print(f"\n{'chunk':>6}{'overlap':>8}{'chunks':>8}{'index s':>9}{'top_k':>6}{'recall':>8}{'hit':>7}"
+          f"{'MRR':>7}{'ctx tok':>9}{'embed ms':>10}{'search ms':>11}{'ctx ms':>8}")
+    for chunk_size in args.chunk_sizes:
+        for overlap in args.overlaps:
+            if overlap >= chunk_size:
+                continue
+            with tempfile.TemporaryDirectory() as tmp:
+                service, n_chunks, index_sec = build_service(
+                    pdf_paths, chunk_size, overlap, embedder, args.backend, Path(tmp))
+                metrics = evaluate(service, labels, args.top_k, args.rerank)
+                service.reset_collection()
+            for k, m in metrics.items():
+                rows.append({"chunk_size": chunk_size, "chunk_overlap": overlap, "chunks": n_chunks,
+                             "index_sec": index_sec, "top_k": k, **m})
+                print(f"{chunk_size:>6}{overlap:>8}{n_chunks:>8}{index_sec:>9.2f}{k:>6}{m['recall']:>8.3f}"
+                      f"{m['hit']:>7.3f}{m['mrr']:>7.3f}{m['context_tokens']:>9.0f}{m['embed_ms_p50']:>10.2f}"
+                      f"{m['search_ms_p50']:>11.2f}{m['context_ms_p50']:>8.2f}")
+
+    eligible = [row for row in rows if row["recall"] >= args.target_recall]
+    if eligible:
+        best = min(eligible, key=lambda row: row["context_tokens"])
+        print(f"\n✅ Menos tokens con recall >= {args.target_recall}: chunk_size={best['chunk_size']} "
+              f"chunk_overlap={best['chunk_overlap']} top_k={best['top_k']} "
+              f"(recall {best['recall']:.3f}, {best['context_tokens']:.0f} tokens de contexto)")
+    else:
+        best = max(rows, key=lambda row: row["recall"]) if rows else None
+        print(f"\n⚠️ Ninguna configuración alcanza recall {args.target_recall}")
+
+    if args.report:
+        args.report.write_text(json.dumps({
+            "config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+            "labels": "manual" if args.labels else "silver",
+            "rows": rows,
+            "best": best,
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"💾 Reporte guardado en {args.report}")
+
+
+if __name__ == "__main__":
+    main()
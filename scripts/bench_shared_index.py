@@ -0,0 +1,182 @@
+"""
+Benchmark del índice compartido: memoria por worker según el tamaño del corpus.
+
+Para cada tamaño genera un corpus sintético (vectores agrupados en clusters y textos de
+~150 palabras) y levanta --workers procesos a la vez con el servicio de embeddings en uno
+de dos modos:
+- private: cada worker carga el artefacto en su propia colección de ChromaDB en memoria
+  y arma su BM25 (lo que hacía cada worker de uvicorn antes de INDEX_ROLE)
+- shared: un builder publica la generación una vez y cada worker la adopta con
+  INDEX_ROLE=reader (vectores, normas, textos y BM25 con mmap)
+
+Cada worker hace búsquedas híbridas y reporta su memoria según /proc/self/smaps_rollup:
+la privada (USS, no se comparte con nadie) y la proporcional (PSS, las páginas compartidas
+divididas entre los procesos que las usan). Se informa lo que creció desde antes de cargar
+el índice. Ejemplo:
+
+    python scripts/bench_shared_index.py --sizes 2000 10000 40000 --workers 4 --report compartido.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+MODES = ("private", "shared")
+WORDS = ("algoritmo busqueda binaria arbol grafo ordenamiento pila cola tabla hash memoria proceso hilo red "
+         "neuronal aprendizaje agente entorno heuristica costo camino estado objetivo dato modelo capa "
+         "funcion error gradiente matriz vector clase regresion arbol decision probabilidad").split()
+
+
+def memory_mb() -> dict:
+    """USS y PSS del proceso en MB (Linux)"""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(":") in ("Pss", "Private_Clean", "Private_Dirty"):
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"uss": values["Private_Clean"] + values["Private_Dirty"], "pss": values["Pss"]}
+
+
+def make_corpus(size: int, dim: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(8, size // 200), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size)] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    words = np.asarray(WORDS)
+    texts = [" ".join(words[rng.integers(0, len(words), 150)]) + f" documento{i}" for i in range(size)]
+    ids = [f"chunk-{i}" for i in range(size)]
+    metadatas = [{"source": f"doc{i // 50}.pdf", "page": i % 50} for i in range(size)]
+    return ids, texts, metadatas, vectors
+
+
+def run_worker(mode: str, workdir: Path, queries: int):
+    """Proceso hijo: carga el índice, busca, reporta su memoria y espera a que lo liberen"""
+    from src.services.embedding_service_chroma import EmbeddingServiceChroma
+    from src.services.shared_index import SharedIndex
+
+    if mode == "private":
+        import chromadb  # noqa: F401  (el import no es memoria del índice)
+    before = memory_mb()
+    start = time.perf_counter()
+    if mode == "shared":
+        service = EmbeddingServiceChroma(persist_dir=str(workdir / f"reader_{os.getpid()}"), role="reader",
+                                         shared_index=SharedIndex(workdir / "shared"))
+        service.attach_shared_index()
+    else:
+        service = EmbeddingServiceChroma(persist_dir=str(workdir / "private"), persistent=False,
+                                         vector_backend="chroma", role="standalone")
+    load_sec = time.perf_counter() - start
+
+    rng = np.random.default_rng(os.getpid())
+    dimension = service.vector_store.get(limit=1, include=["embeddings"])["embeddings"][0].shape[0]
+    latencies = []
+    for _ in range(queries):
+        query = rng.standard_normal(dimension).astype(np.float32)
+        text = " ".join(rng.choice(WORDS, 4))
+        query_start = time.perf_counter()
+        service.search(query, 5, query_text=text)
+        latencies.append(time.perf_counter() - query_start)
+    after = memory_mb()
+    print(json.dumps({
+        "load_sec": load_sec,
+        "documents": service.vector_store.count(),
+        "uss_mb": after["uss"] - before["uss"],
+        "pss_mb": after["pss"] - before["pss"],
+        "p50_ms": statistics.median(latencies) * 1000,
+    }), flush=True)
+    sys.stdin.read()
+
+
+def read_report(process: subprocess.Popen) -> dict:
+    # El worker escribe en stdout solo su reporte (los logs del servicio van a stderr)
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError(f"El worker terminó sin reportar (código {process.wait()})")
+    return json.loads(line)
+
+
+def measure(mode: str, workdir: Path, workers: int, queries: int) -> list:
+    """Levanta los workers a la vez y junta sus reportes (todos vivos al medir la PSS)"""
+    env = {**os.environ, "PYTHONPATH": str(REPO_ROOT), "OPENAI_API_KEY": "", "EMBEDDER_ENABLED": "false",
+           "EMBEDDING_CACHE_PERSIST": "false", "HYBRID_SEARCH_ENABLED": "true"}
+    processes = [
+        subprocess.Popen([sys.executable, __file__, "--worker", mode, "--workdir", str(workdir),
+                          "--queries", str(queries)],
+                         env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for _ in range(workers)
+    ]
+    try:
+        return [read_report(process) for process in processes]
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 10000, 40000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=50, help="búsquedas híbridas por worker")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--report", type=Path, default=None, help="guarda los resultados en JSON")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.workdir, args.queries)
+        return
+
+    from src.services.embedding_store import save_embedding_artifact
+    from src.services.shared_index import SharedIndex
+
+    results = []
+    print(f"{'modo':<9}{'N':>8}{'publicar s':>12}{'carga s':>10}{'USS MB/worker':>15}"
+          f"{'PSS MB/worker':>15}{'p50 ms':>9}")
+    for size in args.sizes:
+        ids, texts, metadatas, vectors = make_corpus(size, args.dim)
+        with tempfile.TemporaryDirectory(prefix="indice_compartido_") as tmp:
+            workdir = Path(tmp)
+            start = time.perf_counter()
+            SharedIndex(workdir / "shared").publish(ids, texts, metadatas, vectors, None)
+            publish_sec = time.perf_counter() - start
+            save_embedding_artifact(workdir / "private" / "embeddings", ids, texts, metadatas, vectors, None)
+            for mode in args.modes:
+                reports = measure(mode, workdir, args.workers, args.queries)
+                row = {
+                    "mode": mode,
+                    "size": size,
+                    "workers": args.workers,
+                    "publish_sec": publish_sec if mode == "shared" else None,
+                    "load_sec": statistics.median(r["load_sec"] for r in reports),
+                    "uss_mb": statistics.median(r["uss_mb"] for r in reports),
+                    "pss_mb": statistics.median(r["pss_mb"] for r in reports),
+                    "p50_ms": statistics.median(r["p50_ms"] for r in reports),
+                    "documents": reports[0]["documents"],
+                }
+                results.append(row)
+                publish = f"{publish_sec:>12.2f}" if mode == "shared" else f"{'-':>12}"
+                print(f"{mode:<9}{size:>8}{publish}{row['load_sec']:>10.2f}{row['uss_mb']:>15.1f}"
+                      f"{row['pss_mb']:>15.1f}{row['p50_ms']:>9.2f}")
+
+    if args.report:
+        args.report.write_text(json.dumps({"dim": args.dim, "workers": args.workers, "results": results},
+                                          indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\n💾 Reporte en {args.report}")
+
+
+if __name__ == "__main__":
+    main()
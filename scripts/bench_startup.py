@@ -0,0 +1,198 @@
+"""
+Benchmark de arranque de la API: cuánto tarda `import src.main` y, al levantarla con
+uvicorn, cuánto tarda en escuchar (primer 200 de /health) y en estar lista (primer 200
+de /ready, índice cargado).
+
+Cada corrida levanta el stub de proveedores (tests/stub_providers.py) y la API en un
+directorio temporal con un corpus (--data-dir o el sintético de las preguntas gold), así
+que no necesita claves ni red. Se mide:
+- arranque en frío: sin índice, hay que parsear y embeber todos los PDFs
+- arranque en caliente: con CHROMA_PERSISTENT=true, reabre el índice del arranque anterior
+
+Ejemplo:
+
+    python scripts/bench_startup.py --repeats 3 --report startup.json
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "tests"))
+
+from preguntasGold import INPUT_CSV, load_questions, make_corpus  # noqa: E402
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import src.main; print(time.perf_counter() - t)"
+
+
+def free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env: dict, cwd: Path) -> float:
+    """Segundos de `import src.main` en un proceso nuevo"""
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=cwd, env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def heaviest_imports(env: dict, cwd: Path, n: int = 8) -> list:
+    """Paquetes de primer nivel con más tiempo acumulado según python -X importtime"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import src.main"], cwd=cwd, env=env,
+                         capture_output=True, text=True, check=True)
+    totals = {}
+    for line in out.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        # Solo los imports directos de src.main (un nivel de sangría bajo él)
+        if match and len(match.group(2)) == 3:
+            package = match.group(3).split(".")[0]
+            totals[package] = totals.get(package, 0) + int(match.group(1))
+    return sorted(((name, us / 1e6) for name, us in totals.items()), key=lambda item: -item[1])[:n]
+
+
+def wait_status(url: str, process: subprocess.Popen, timeout: float, start: float) -> float:
+    """Segundos (desde start) hasta que url responde 200"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"La API terminó antes de responder {url}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} no respondió 200 en {timeout:.0f}s")
+
+
+def boot(env: dict, workdir: Path, timeout: float) -> dict:
+    """Levanta la API y mide hasta escuchar y hasta estar lista"""
+    port = free_port()
+    log = open(workdir / "api.log", "a")
+    start = time.perf_counter()
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        listen_sec = wait_status(f"http://127.0.0.1:{port}/health", api, timeout, start)
+        ready_sec = wait_status(f"http://127.0.0.1:{port}/ready", api, timeout, start)
+        ready = httpx.get(f"http://127.0.0.1:{port}/ready", timeout=5).json()
+    finally:
+        api.terminate()
+        try:
+            api.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            api.kill()
+    return {
+        "listen_sec": listen_sec,
+        "ready_sec": ready_sec,
+        "warmup_sec": ready.get("warmup_sec"),
+        "total_documents": ready.get("total_documents"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=3, help="corridas de cada medición")
+    parser.add_argument("--data-dir", type=Path, default=None, help="PDFs a indexar (por defecto corpus sintético)")
+    parser.add_argument("--csv", type=Path, default=INPUT_CSV, help="preguntas gold para el corpus sintético")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--report", type=Path, default=None, help="guarda los resultados en JSON")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="arranque_rag_"))
+    stub = None
+    try:
+        data_dir = workdir / "data"
+        if args.data_dir:
+            shutil.copytree(args.data_dir, data_dir)
+        else:
+            data_dir.mkdir()
+            make_corpus(data_dir, load_questions(args.csv))
+
+        stub_port = free_port()
+        stub = subprocess.Popen(
+            [sys.executable, str(REPO_ROOT / "tests" / "stub_providers.py"), "--port", str(stub_port)],
+            stdout=open(workdir / "stub.log", "w"), stderr=subprocess.STDOUT,
+        )
+        wait_status(f"http://127.0.0.1:{stub_port}/stats", stub, 30, time.perf_counter())
+
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(REPO_ROOT),
+            "OPENAI_API_KEY": "stub",
+            "GROQ_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{stub_port}",
+            "EMBEDDER_ENABLED": "false",
+            "EMBEDDING_CACHE_PERSIST": "false",
+            "USAGE_LEDGER_ENABLED": "false",
+        }
+
+        imports = [measure_import(env, workdir) for _ in range(args.repeats)]
+        print(f"📦 import src.main: mediana {statistics.median(imports) * 1000:.0f} ms "
+              f"(min {min(imports) * 1000:.0f}, máx {max(imports) * 1000:.0f})")
+        heaviest = heaviest_imports(env, workdir)
+        print("   más pesados: " + ", ".join(f"{name} {sec * 1000:.0f} ms" for name, sec in heaviest))
+
+        runs = {"cold": [], "warm": []}
+        for i in range(args.repeats):
+            run_env = {
+                **env,
+                "CHROMA_PERSISTENT": "true",
+                "CHROMA_PERSIST_DIR": str(workdir / f"chroma_{i}"),
+                "VECTOR_STORE_DIR": str(workdir / f"vector_store_{i}"),
+            }
+            # En frío indexa todo; en caliente reabre el índice persistente que dejó el anterior
+            runs["cold"].append(boot(run_env, workdir, args.timeout))
+            runs["warm"].append(boot(run_env, workdir, args.timeout))
+
+        print(f"\n{'arranque':<10}{'escucha ms':>12}{'listo ms':>12}{'carga índice ms':>17}{'docs':>8}")
+        summary = {}
+        for kind, results in runs.items():
+            listen = statistics.median(r["listen_sec"] for r in results)
+            ready = statistics.median(r["ready_sec"] for r in results)
+            warmup = statistics.median(r["warmup_sec"] or 0.0 for r in results)
+            documents = results[-1]["total_documents"]
+            summary[kind] = {"listen_sec": listen, "ready_sec": ready, "warmup_sec": warmup,
+                             "total_documents": documents}
+            label = "frío" if kind == "cold" else "caliente"
+            print(f"{label:<10}{listen * 1000:>12.0f}{ready * 1000:>12.0f}{warmup * 1000:>17.0f}{documents:>8}")
+
+        if args.report:
+            report = {
+                "import_sec": imports,
+                "heaviest_imports": heaviest,
+                "runs": runs,
+                "summary": summary,
+            }
+            args.report.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+            print(f"\n💾 Reporte en {args.report}")
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait(timeout=10)
+        if args.keep_workdir:
+            print(f"📁 Directorio de trabajo: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark de los backends vectoriales: ChromaDB vs NumPy float32 vs NumPy int8.
+
+Genera vectores sintéticos normalizados (agrupados en clusters, como los embeddings de un
+corpus real) y mide por backend y tamaño de corpus: tiempo de carga, QPS, latencia p50/p99,
+memoria y recall@k contra la búsqueda exacta. ChromaDB se carga con upserts por lotes; los
+backends NumPy adoptan el artefacto mmap en disco, como al arrancar el servicio. Ejemplo:
+
+    python scripts/bench_vector_backends.py --sizes 5000 20000 --dim 1536 --queries 200
+"""
+import argparse
+import gc
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.embedding_store import load_embedding_artifact, save_embedding_artifact  # noqa: E402
+from src.services.vector_store import ChromaVectorStore, NumpyVectorStore  # noqa: E402
+
+BACKENDS = ("chroma", "numpy", "numpy-int8")
+
+
+def rss_mb() -> float:
+    """Memoria residente actual del proceso (Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * 4096 / 1024 / 1024
+    except OSError:
+        return float("nan")
+
+
+def make_corpus(size: int, dim: int, n_queries: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(8, size // 200), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_labels = rng.integers(0, len(centers), n_queries)
+    queries = centers[query_labels] + 0.6 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> list:
+    truth = []
+    for query in queries:
+        scores = vectors @ query
+        rows = np.argpartition(-scores, k - 1)[:k]
+        truth.append({f"c{row}" for row in rows})
+    return truth
+
+
+def create_backend(name: str):
+    if name == "chroma":
+        import chromadb
+        client = chromadb.Client()
+        collection_name = f"bench_{time.time_ns()}"
+        return ChromaVectorStore(client, collection_name)
+    if name == "numpy":
+        return NumpyVectorStore()
+    return NumpyVectorStore(quantization="int8")
+
+
+def run(name: str, vectors: np.ndarray, queries: np.ndarray, truth: list, k: int, batch_size: int,
+        artifact_dir: Path) -> dict:
+    gc.collect()
+    rss_before = rss_mb()
+    store = create_backend(name)
+
+    start = time.perf_counter()
+    if name == "chroma":
+        ids = [f"c{i}" for i in range(len(vectors))]
+        texts = [f"chunk {i}" for i in range(len(vectors))]
+        metadatas = [{"source": "bench.pdf", "page": i} for i in range(len(vectors))]
+        for offset in range(0, len(vectors), batch_size):
+            end = offset + batch_size
+            store.upsert(ids[offset:end], texts[offset:end], metadatas[offset:end], vectors[offset:end].tolist())
+    else:
+        store.load_artifact(load_embedding_artifact(artifact_dir))
+    build_sec = time.perf_counter() - start
+    memory = rss_mb() - rss_before
+
+    store.query(queries[0].tolist(), k)  # calentamiento
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        embedding = query.tolist()
+        start = time.perf_counter()
+        result = store.query(embedding, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(expected & set(result["ids"][0]))
+
+    latencies = np.asarray(latencies) * 1000
+    stats = {
+        "build_sec": build_sec,
+        "qps": len(queries) / (latencies.sum() / 1000),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "rss_mb": memory,
+        "vectors_mb": (store.memory_bytes() or 0) / 1024 / 1024,
+        "recall": hits / (len(queries) * k),
+    }
+    if name == "chroma":
+        store.reset()
+    del store
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    args = parser.parse_args()
+
+    print(f"{'backend':>12}{'N':>9}{'carga (s)':>11}{'QPS':>9}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'RSS MB':>9}{'vect MB':>9}{'recall@' + str(args.k):>10}")
+    for size in args.sizes:
+        vectors, queries = make_corpus(size, args.dim, args.queries)
+        truth = exact_top_k(vectors, queries, args.k)
+        with tempfile.TemporaryDirectory() as tmp:
+            save_embedding_artifact(
+                Path(tmp), [f"c{i}" for i in range(size)], [f"chunk {i}" for i in range(size)],
+                [{"source": "bench.pdf", "page": i} for i in range(size)], vectors, "bench",
+            )
+            results = {name: run(name, vectors, queries, truth, args.k, args.batch_size, Path(tmp))
+                       for name in args.backends}
+        for name, stats in results.items():
+            print(f"{name:>12}{size:>9}{stats['build_sec']:>11.2f}{stats['qps']:>9.0f}"
+                  f"{stats['p50_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['rss_mb']:>9.0f}"
+                  f"{stats['vectors_mb']:>9.0f}{stats['recall']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
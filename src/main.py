@@ -1,16 +1,16 @@
+import asyncio
 from contextlib import asynccontextmanager
-import csv
-import datetime
+import logging
 import os
 import time
 from datetime import datetime
 import uuid
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, UploadFile, File, HTTPException
-from pydantic import BaseModel
-from typing import List
+from fastapi import FastAPI, Request, Response, UploadFile, File, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Literal, Optional
 from pathlib import Path
-import shutil
+import json
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -18,78 +18,256 @@ load_dotenv()
 from src.models.schemas import (
     QuestionRequest, 
     QuestionResponse, 
-    UploadResponse,
+    BatchQuestionRequest,
+    BatchQuestionResult,
+    BatchQuestionResponse,
+    UsageResponse,
+    JobResponse,
     HealthResponse
 )
-from .services.rag_service import RAGService
-from src.services.pdf_service import prepare_docs_for_chroma
-from src.services.pdf_service import process_pdf_with_langchain
-from starlette.middleware.base import BaseHTTPMiddleware
+from .services.rag_service import RESPONSE_MODES, RAGService
+from .services.http_clients import CLIENTS, HTTP_WARMUP_ENABLED
+from .services.job_queue import IngestionJobQueue
+from .services.llm_scheduler import ProviderOverloaded
+from .services.metrics import HTTP_REQUEST_SECONDS, REGISTRY, configure_logging, request_id_var
+from .services.pricing import price_table
+from .services.shared_index import INDEX_ROLE
+from .services.usage_ledger import USAGE_LEDGER_ENABLED, UsageLedger, usage_record
+
+# Logs con el request ID de cada pedido (LOG_LEVEL=DEBUG muestra además los tiempos por etapa)
+configure_logging(os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
 
 UPLOAD_DIR = Path("data")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Máximo de preguntas por llamada a /questions/batch
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+
 
 
 
 rag_service = RAGService()
+# Las ingestas corren en segundo plano para no bloquear el event loop de /question
+job_queue = IngestionJobQueue()
+# Registro de consumo por pedido: se encola en la respuesta y se escribe por lotes en segundo plano
+usage_ledger = UsageLedger() if USAGE_LEDGER_ENABLED else None
+
+
+def _record_usage(endpoint: str, provider: str, mode: str, top_k: int, consumption: dict = None, error: str = None):
+    if usage_ledger is not None:
+        usage_ledger.record(usage_record(endpoint, provider, mode, top_k, consumption, error))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Código que se ejecuta al INICIAR la app
-    print("Inicializando RAG service...")
+    logger.info("Inicializando RAG service...")
     data_folder = Path("data")         #comentar esta fila y descomentar la siguiente para deploy
     #data_folder = Path("/app/data")
 
-    rag_service.initialize_from_pdfs(data_folder)
-    print(f"RAG inicializado")
+    # El índice se carga en segundo plano: el puerto queda escuchando enseguida (/health)
+    # y /ready informa el avance hasta que termina
+    background = [asyncio.create_task(asyncio.to_thread(rag_service.warm_up, data_folder))]
+    # Conexiones TLS abiertas antes de la primera pregunta
+    if HTTP_WARMUP_ENABLED:
+        background.append(asyncio.create_task(CLIENTS.warm_up()))
+    app.state.warmup_tasks = background
     
     yield  # Aquí la app está corriendo
     
     # Código que se ejecuta al APAGAR la app (cleanup)
-    print("Cerrando RAG service...")
+    logger.info("Cerrando RAG service...")
+    rag_service.close()
+    job_queue.shutdown()
+    if usage_ledger is not None:
+        usage_ledger.close()
+    await CLIENTS.aclose()
 
 app = FastAPI(title="Proyecto1V2", lifespan=lifespan)
 
 
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """
+    Request ID por pedido (X-Request-ID entrante o uno nuevo): queda en los logs de todo
+    lo que se ejecute para ese pedido y vuelve en la respuesta. Mide además la duración
+    del pedido por ruta (la plantilla, p.ej. /jobs/{job_id}, para no crear una serie por ID).
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "sin_ruta"),
+            status=str(status),
+        )
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+
+@app.exception_handler(ProviderOverloaded)
+async def provider_overloaded_handler(request: Request, exc: ProviderOverloaded):
+    """Sin cuota en los proveedores: 503 con Retry-After en lugar de una respuesta de error"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "provider": exc.provider, "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 @app.get("/")
 async def read_root():
     return {"message": "RAG API funcionando en Render"}
 
 
+def _check_mode(mode: Optional[str]):
+    """400 antes de empezar a responder (en /question/stream, antes de mandar los headers)"""
+    if mode not in RESPONSE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode debe ser {' o '.join(RESPONSE_MODES)}")
+
+
 @app.post("/question", response_model=QuestionResponse)
 async def process_question(request: QuestionRequest):
     # Tu lógica aquí
     if not rag_service.initialized:
         raise HTTPException(status_code=503, detail="RAG no está inicializado")
-    response = rag_service.answer_question(request.question, request.model_provider, request.top_k, request.mode)
-    #consumption = response["consumption"]
-    # Extraer datos de consumo
+    _check_mode(request.mode)
+    try:
+        response = await rag_service.answer_question_async(
+            request.question, request.model_provider, request.top_k, request.mode
+        )
+    except ProviderOverloaded as e:
+        _record_usage("question", request.model_provider, request.mode, request.top_k, error=str(e))
+        raise
     consumption = response.get("consumption", {})
-    tokens_used = consumption.get("tokens_used", 0)
-    cost_estimated = consumption.get("cost_estimated", 0.0)
-    latency_sec = consumption.get("latency_sec", 0.0)
-    #log_consumption(session_id=str(uuid.uuid4()), query=request.question, tokens_used=tokens_used, cost_estimated=cost_estimated, latency_sec= round(latency_sec,2))
-    
+    _record_usage("question", request.model_provider, request.mode, request.top_k, consumption, response.get("error"))
+    if consumption:
+        logger.info(
+            f"/question {request.model_provider}: {consumption.get('latency_sec', 0.0):.2f}s, "
+            f"{consumption.get('tokens_used')} tokens, cache_hit={consumption.get('cache_hit')}"
+        )
+
     return QuestionResponse(
         answer=response["answer"],
-        model_provider=request.model_provider,
+        # Con fallback puede haber respondido el otro proveedor
+        model_provider=consumption.get("provider", request.model_provider),
         sources=[src for src in response["sources"]],
         mode=request.mode if hasattr(request, 'mode') else "breve",
-        confidence=0.85
+        confidence=0.85,
+        consumption=consumption or None
     )
 
-from fastapi import UploadFile, File, HTTPException
-from pathlib import Path
+@app.post("/question/stream")
+async def process_question_stream(request: QuestionRequest):
+    """
+    Igual que /question pero como server-sent events: primero las fuentes,
+    luego los tokens a medida que llegan y al final el consumo.
+    """
+    if not rag_service.initialized:
+        raise HTTPException(status_code=503, detail="RAG no está inicializado")
+    _check_mode(request.mode)
+
+    async def event_stream():
+        async for event, data in rag_service.stream_answer(
+            request.question, request.model_provider, request.top_k, request.mode
+        ):
+            if event == "done":
+                _record_usage("question_stream", request.model_provider, request.mode, request.top_k, data)
+            elif event == "error":
+                _record_usage("question_stream", request.model_provider, request.mode, request.top_k,
+                              error=data.get("detail"))
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/questions/batch", response_model=BatchQuestionResponse)
+async def process_questions_batch(request: BatchQuestionRequest):
+    """
+    Varias preguntas en una llamada: un solo embedding para todas, una sola búsqueda
+    multi-consulta y generaciones en paralelo (con límite por proveedor).
+    Los resultados vuelven en el mismo orden; si una pregunta falla, las demás siguen.
+    """
+    if not rag_service.initialized:
+        raise HTTPException(status_code=503, detail="RAG no está inicializado")
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_QUESTIONS} preguntas por lote")
+
+    start_time = time.time()
+    responses = await rag_service.answer_questions_batch([
+        {
+            "question": item.question,
+            "provider": item.model_provider,
+            "top_k": item.top_k or 3,
+            "mode": item.mode or "breve",
+        }
+        for item in request.questions
+    ])
+
+    results = []
+    for index, (item, response) in enumerate(zip(request.questions, responses)):
+        _record_usage("questions_batch", item.model_provider, item.mode or "breve", item.top_k or 3,
+                      response.get("consumption"), response.get("error"))
+        if response.get("error"):
+            results.append(BatchQuestionResult(
+                index=index, status="error", error=response["error"], retry_after=response.get("retry_after")
+            ))
+            continue
+        results.append(BatchQuestionResult(
+            index=index,
+            status="ok",
+            response=QuestionResponse(
+                answer=response["answer"],
+                model_provider=(response.get("consumption") or {}).get("provider", item.model_provider),
+                sources=[src for src in response["sources"]],
+                mode=item.mode or "breve",
+                confidence=0.85,
+                consumption=response.get("consumption") or None,
+            ),
+        ))
+    return BatchQuestionResponse(results=results, latency_sec=time.time() - start_time)
+
+def _job_response(job) -> JobResponse:
+    return JobResponse(**job.to_dict(), status_url=f"/jobs/{job.id}")
 
-@app.post("/upload_pdf")
+
+def _check_ingestion_allowed():
+    # Los workers reader sirven el índice compartido: la ingesta va al proceso builder
+    if INDEX_ROLE == "reader":
+        raise HTTPException(
+            status_code=409,
+            detail="Este worker sirve el índice compartido en solo lectura; la ingesta la atiende el builder (INDEX_ROLE=builder)",
+        )
+
+
+def _index_uploaded_pdf(file_path: Path, progress=None):
+    # Indexación incremental: solo se procesan y embeben los chunks de este PDF
+    # (si reemplaza a uno existente, se eliminan los chunks anteriores)
+    chunks_indexed = rag_service.index_pdf(file_path, progress=progress)
+    rag_service.initialized = True
+    return {"filename": file_path.name, "chunks_indexed": chunks_indexed or 0}
+
+
+@app.post("/upload_pdf", response_model=JobResponse, status_code=202)
 async def upload_pdf(file: UploadFile = File(...)):
+    _check_ingestion_allowed()
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Solo archivos PDF permitidos")
     
-    # Guardar PDF en disco
-    upload_dir = Path("/app/data")
+    # Guardar PDF en disco (misma carpeta que indexa el arranque: data/ == /app/data en Docker)
+    upload_dir = UPLOAD_DIR
     upload_dir.mkdir(exist_ok=True)
     file_path = upload_dir / file.filename
     
@@ -97,38 +275,114 @@ async def upload_pdf(file: UploadFile = File(...)):
     with open(file_path, "wb") as f:
         f.write(content)
     
-    # Procesar PDF (extraer chunks)
-    chunks = process_pdf_with_langchain(file_path)
-    
-    # Preparar chunks para ChromaDB
-    docs = prepare_docs_for_chroma(chunks)
-    
-    # Guardar en ChromaDB
-    rag_service.embedding_service.add_documents(docs)
-    
-    rag_service.initialized = True  # actualizar flag si es necesario
-    
+    # La indexación corre en segundo plano; el progreso se consulta en /jobs/{job_id}
+    job = job_queue.submit("upload_pdf", _index_uploaded_pdf, file_path)
+    return _job_response(job)
+
+
+@app.post("/rebuild_index", response_model=JobResponse, status_code=202)
+async def rebuild_index():
+    """
+    Fuerza la reindexación de todos los PDFs en segundo plano.
+    El índice actual sigue respondiendo preguntas mientras tanto.
+    """
+    _check_ingestion_allowed()
+    job = job_queue.submit("rebuild_index", rag_service.initialize_from_pdfs, UPLOAD_DIR, force=True)
+    return _job_response(job)
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Estado y progreso de un trabajo de ingesta"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return _job_response(job)
+
+
+@app.get("/jobs", response_model=List[JobResponse])
+async def list_jobs():
+    """Trabajos de ingesta recientes"""
+    return [_job_response(job) for job in job_queue.list()]
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Contadores de las cachés (hits/misses)"""
     return {
-        "message": f"Archivo {file.filename} guardado y chunks indexados en ChromaDB",
-        "chunks_indexed": len(docs)
+        # Mientras arranca el servicio de embeddings todavía no existe (y crearlo bloquearía)
+        "embedding_cache": rag_service.embedding_service.embedding_cache.stats() if rag_service.initialized else None,
+        "answer_cache": rag_service.answer_cache.stats() if rag_service.answer_cache else None,
     }
 
 
-@app.post("/rebuild_index")
-async def rebuild_index():
-    """Fuerza reconstrucción completa del índice"""
-    try:
-        data_folder = Path("/app/data")
-        rag_service.initialize_from_pdfs(data_folder, force=True)
-        return {
-            "status": "success",
-            "message": "Índice reconstruido completamente"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/usage", response_model=UsageResponse)
+async def usage(
+    bucket: Literal["minute", "hour", "day"] = "hour",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    by_model: bool = True,
+):
+    """
+    Consumo agregado por intervalo (UTC) y, con by_model, por proveedor y modelo:
+    pedidos, aciertos de caché, errores, tokens de prompt/completion, costo y latencia.
+    since/until: fecha ISO 8601 o timestamp Unix.
+    """
+    if usage_ledger is None:
+        raise HTTPException(status_code=503, detail="El registro de consumo está deshabilitado (USAGE_LEDGER_ENABLED)")
+    rows = await asyncio.to_thread(
+        usage_ledger.rollup, bucket,
+        since.timestamp() if since else None,
+        until.timestamp() if until else None,
+        by_model,
+    )
+    return UsageResponse(
+        bucket=bucket,
+        rows=rows,
+        total_requests=sum(row["requests"] for row in rows),
+        total_cost_usd=round(sum(row["cost_usd"] for row in rows), 6),
+        prices=price_table(),
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Histogramas por etapa y por ruta y contadores de ingesta, en formato Prometheus"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
-# Optional health endpoint
 @app.get("/health")
 async def health():
+    """Liveness: el proceso responde (no depende del índice ni de los proveedores)"""
     return {"status": "ok"}
+
+
+@app.get("/ready", response_model=HealthResponse)
+async def ready(response: Response):
+    """
+    Readiness: 200 cuando el índice está cargado y se pueden responder preguntas, 503 mientras
+    arranca (con el avance de la indexación) o si la carga falló.
+    """
+    warmup = rag_service.warmup
+    started_at = warmup["started_at"]
+    if rag_service.initialized:
+        status = "ready"
+    elif warmup["stage"] == "failed":
+        status = "failed"
+    else:
+        status = "warming_up"
+    if status != "ready":
+        response.status_code = 503
+    return HealthResponse(
+        status=status,
+        rag_initialized=rag_service.initialized,
+        total_documents=rag_service.document_count() if rag_service.initialized else None,
+        warmup_stage=warmup["stage"],
+        warmup_progress=warmup["progress"] or None,
+        warmup_sec=round((warmup["finished_at"] or time.time()) - started_at, 3) if started_at else None,
+        error=warmup["error"],
+        index_role=INDEX_ROLE,
+        index_generation=rag_service.index_generation(),
+        # Estado de cada proveedor LLM: configurado y circuito (closed / open / half_open)
+        providers=rag_service.client_factory.status(),
+    )
@@ -1,7 +1,13 @@
 from .schemas import (
     QuestionRequest,
     QuestionResponse,
+    BatchQuestionRequest,
+    BatchQuestionResult,
+    BatchQuestionResponse,
+    UsageBucket,
+    UsageResponse,
     UploadResponse,
+    JobResponse,
     ChunkInfo,
     SearchResult,
     HealthResponse
@@ -10,7 +16,13 @@ from .schemas import (
 __all__ = [
     "QuestionRequest",
     "QuestionResponse", 
+    "BatchQuestionRequest",
+    "BatchQuestionResult",
+    "BatchQuestionResponse",
+    "UsageBucket",
+    "UsageResponse",
     "UploadResponse",
+    "JobResponse",
     "ChunkInfo",
     "SearchResult",
     "HealthResponse"
@@ -15,6 +15,47 @@ class QuestionResponse(BaseModel):
     sources: List[str] = Field(default=[], description="Fuentes utilizadas")
     mode: str = Field(..., description="Modo de respuesta usado")
     confidence: Optional[float] = Field(None, description="Nivel de confianza (opcional)")
+    consumption: Optional[Dict[str, Any]] = Field(None, description="Consumo: tokens, costo, latencia y uso de caché")
+
+# Modelos para el endpoint /questions/batch
+class BatchQuestionRequest(BaseModel):
+    questions: List[QuestionRequest] = Field(..., description="Preguntas a responder")
+
+
+class BatchQuestionResult(BaseModel):
+    index: int = Field(..., description="Posición de la pregunta en el lote")
+    status: str = Field(..., description="ok o error")
+    response: Optional[QuestionResponse] = Field(None, description="Respuesta (si status es ok)")
+    error: Optional[str] = Field(None, description="Detalle del error (si status es error)")
+    retry_after: Optional[int] = Field(None, description="Segundos a esperar si el proveedor estaba al límite")
+
+
+class BatchQuestionResponse(BaseModel):
+    results: List[BatchQuestionResult] = Field(..., description="Resultados en el mismo orden que las preguntas")
+    latency_sec: float = Field(..., description="Latencia total del lote")
+
+# Modelos para el endpoint /usage (registro de consumo)
+class UsageBucket(BaseModel):
+    start: str = Field(..., description="Inicio del intervalo (ISO 8601, UTC)")
+    provider: Optional[str] = Field(None, description="Proveedor (si se agrupa por modelo)")
+    model: Optional[str] = Field(None, description="Modelo (si se agrupa por modelo)")
+    requests: int = Field(..., description="Pedidos registrados")
+    cache_hits: int = Field(..., description="Pedidos respondidos desde la caché")
+    errors: int = Field(..., description="Pedidos con error")
+    prompt_tokens: int = Field(..., description="Tokens de prompt")
+    completion_tokens: int = Field(..., description="Tokens de completion")
+    tokens_used: int = Field(..., description="Tokens totales")
+    cost_usd: float = Field(..., description="Costo estimado en USD")
+    avg_latency_sec: Optional[float] = Field(None, description="Latencia media")
+    max_latency_sec: Optional[float] = Field(None, description="Latencia máxima")
+
+
+class UsageResponse(BaseModel):
+    bucket: str = Field(..., description="Tamaño del intervalo: minute, hour o day")
+    rows: List[UsageBucket] = Field(..., description="Totales por intervalo (y proveedor/modelo)")
+    total_requests: int = Field(..., description="Pedidos en el rango consultado")
+    total_cost_usd: float = Field(..., description="Costo estimado total en USD")
+    prices: List[Dict[str, Any]] = Field(default=[], description="Precios por proveedor y modelo (USD por 1M tokens)")
 
 # Modelos para el endpoint /upload_pdf
 class UploadResponse(BaseModel):
@@ -23,6 +64,20 @@ class UploadResponse(BaseModel):
     location: str = Field(..., description="Ruta donde se guardó")
     chunks_generated: Optional[int] = Field(None, description="Número de chunks generados")
 
+# Modelos para los trabajos de ingesta en segundo plano (/upload_pdf, /rebuild_index, /jobs)
+class JobResponse(BaseModel):
+    job_id: str = Field(..., description="ID del trabajo")
+    kind: str = Field(..., description="Tipo de trabajo: upload_pdf o rebuild_index")
+    status: str = Field(..., description="queued, running, completed o failed")
+    created_at: float = Field(..., description="Timestamp de creación")
+    started_at: Optional[float] = Field(None, description="Timestamp de inicio")
+    finished_at: Optional[float] = Field(None, description="Timestamp de fin")
+    progress: Dict[str, Any] = Field(default={}, description="Archivos y páginas parseados, chunks embebidos")
+    eta_sec: Optional[float] = Field(None, description="Tiempo restante estimado")
+    result: Optional[Any] = Field(None, description="Resultado del trabajo al terminar")
+    error: Optional[str] = Field(None, description="Error si el trabajo falló")
+    status_url: Optional[str] = Field(None, description="URL para consultar el progreso")
+
 # Modelos para información de chunks (opcional, para debugging)
 class ChunkInfo(BaseModel):
     content: str = Field(..., description="Contenido del chunk")
@@ -39,3 +94,10 @@ class HealthResponse(BaseModel):
     status: str = Field(..., description="Estado del servicio")
     rag_initialized: bool = Field(..., description="Si RAG está inicializado")
     total_documents: Optional[int] = Field(None, description="Total de documentos procesados")
+    warmup_stage: Optional[str] = Field(None, description="Etapa del arranque: pending, loading, waiting_for_builder, ready o failed")
+    warmup_progress: Optional[Dict[str, Any]] = Field(None, description="Archivos, páginas y chunks procesados al indexar")
+    warmup_sec: Optional[float] = Field(None, description="Segundos desde que empezó la carga del índice")
+    error: Optional[str] = Field(None, description="Error de la carga inicial (si falló)")
+    index_role: Optional[str] = Field(None, description="Rol del proceso frente al índice: standalone, builder o reader")
+    index_generation: Optional[int] = Field(None, description="Generación del índice compartido publicada o en uso")
+    providers: Optional[Dict[str, Any]] = Field(None, description="Estado de los proveedores LLM y sus circuitos")
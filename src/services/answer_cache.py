@@ -0,0 +1,140 @@
+import copy
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+class AnswerCache:
+    """
+    Caché semántica de respuestas de answer_question.
+
+    Cada entrada guarda el embedding (normalizado) de la pregunta y la respuesta.
+    Una pregunta nueva reutiliza la respuesta si coincide en (mode, provider, top_k)
+    y su similitud coseno con la pregunta cacheada supera `similarity_threshold`.
+
+    Las entradas caducan tras `ttl_sec`, se desalojan por LRU al superar `max_items`
+    y se descartan todas cuando cambia la versión del índice (nuevos documentos).
+    Una respuesta armada con una versión anterior a la vigente no se guarda.
+    """
+
+    def __init__(self, max_items: int = 512, ttl_sec: float = 3600, similarity_threshold: float = 0.95):
+        self.max_items = max_items
+        self.ttl_sec = ttl_sec
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        # Por bucket (mode, provider, top_k): ids y matriz de embeddings (se reconstruye si cambia)
+        self._buckets: dict = {}
+        self._ids = itertools.count()
+        self._index_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, index_version):
+        if index_version != self._index_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._buckets.clear()
+            self._index_version = index_version
+
+    def _bucket_matrix(self, bucket_key):
+        bucket = self._buckets.get(bucket_key)
+        if not bucket or not bucket["ids"]:
+            return None, None
+        if bucket["matrix"] is None:
+            bucket["matrix"] = np.stack([self._entries[i]["vector"] for i in bucket["ids"]])
+        return bucket["ids"], bucket["matrix"]
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        bucket = self._buckets.get(entry["bucket"])
+        if bucket:
+            bucket["ids"].remove(entry_id)
+            bucket["matrix"] = None
+
+    def get(self, embedding, mode: str, provider: str, top_k: int, index_version) -> Optional[dict]:
+        """Devuelve (copia de) la respuesta cacheada más similar o None"""
+        bucket_key = (mode, provider, top_k)
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._check_version(index_version)
+            ids, matrix = self._bucket_matrix(bucket_key)
+            if ids is None:
+                self.misses += 1
+                return None
+
+            similarities = matrix @ vector
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.similarity_threshold:
+                    break
+                entry_id = ids[position]
+                entry = self._entries[entry_id]
+                if now - entry["created_at"] > self.ttl_sec:
+                    continue
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                result = copy.deepcopy(entry["response"])
+                result["similarity"] = float(similarities[position])
+                return result
+
+            # Limpiar entradas caducadas del bucket
+            for entry_id in [i for i in ids if now - self._entries[i]["created_at"] > self.ttl_sec]:
+                self._remove(entry_id)
+            self.misses += 1
+            return None
+
+    def put(self, embedding, mode: str, provider: str, top_k: int, index_version, response: dict):
+        bucket_key = (mode, provider, top_k)
+        with self._lock:
+            # El índice cambió mientras se generaba: la respuesta ya no es vigente (y volver a la
+            # versión anterior descartaría las entradas nuevas)
+            if self._index_version is not None and index_version < self._index_version:
+                return
+            self._check_version(index_version)
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "vector": self._normalize(embedding),
+                "bucket": bucket_key,
+                "created_at": time.time(),
+                "response": copy.deepcopy(response),
+            }
+            bucket = self._buckets.setdefault(bucket_key, {"ids": [], "matrix": None})
+            bucket["ids"].append(entry_id)
+            bucket["matrix"] = None
+            while len(self._entries) > self.max_items:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "items": len(self._entries),
+                "max_items": self.max_items,
+                "invalidations": self.invalidations,
+                "index_version": self._index_version,
+            }
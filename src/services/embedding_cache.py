@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza la consulta: Unicode NFC, minúsculas y espacios colapsados"""
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings de consultas en dos niveles:
+    - LRU en memoria acotado a `max_items`
+    - SQLite opcional en disco (sobrevive reinicios)
+
+    La clave es el texto normalizado + el modelo de embeddings.
+    aget/aput son para el event loop: ahí solo se toca la LRU y SQLite va en un hilo.
+    """
+
+    def __init__(self, max_items: int = 2048, persist_path: Optional[Path] = None):
+        self.max_items = max_items
+        self._lru: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        # SQLite tiene su propio lock: una lectura en disco no frena las consultas a la LRU
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if persist_path is not None:
+            try:
+                self._db = sqlite3.connect(str(persist_path), check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Caché de embeddings en disco deshabilitada: {e}")
+                self._db = None
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str, model: str):
+        key = self.make_key(text, model)
+        embedding = self._get_memory(key)
+        if embedding is None and self._db is not None:
+            embedding = self._get_disk(key)
+        return embedding
+
+    async def aget(self, text: str, model: str):
+        """Como get, pero la lectura de SQLite no bloquea el event loop"""
+        key = self.make_key(text, model)
+        embedding = self._get_memory(key)
+        if embedding is None and self._db is not None:
+            embedding = await asyncio.to_thread(self._get_disk, key)
+        return embedding
+
+    def put(self, text: str, model: str, embedding):
+        rows = self._remember_all([(text, model, embedding)])
+        if self._db is not None:
+            self._persist(rows)
+
+    async def aput(self, items: list):
+        """Como put para varios (texto, modelo, embedding): la escritura en SQLite va en un hilo"""
+        rows = self._remember_all(items)
+        if self._db is not None and rows:
+            await asyncio.to_thread(self._persist, rows)
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            embedding = self._lru.get(key)
+            if embedding is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+            elif self._db is None:
+                self.misses += 1
+            return embedding
+
+    def _get_disk(self, key: str):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+            self._remember(key, embedding)
+            self.hits += 1
+            self.disk_hits += 1
+            return embedding
+
+    def _remember_all(self, items: list) -> list:
+        """Guarda en la LRU; devuelve las filas (key, model, embedding) para SQLite"""
+        rows = []
+        for text, model, embedding in items:
+            if not isinstance(embedding, list):
+                embedding = np.asarray(embedding, dtype=np.float32).tolist()
+            rows.append((self.make_key(text, model), model, embedding))
+        with self._lock:
+            for key, _, embedding in rows:
+                self._remember(key, embedding)
+        return rows
+
+    def _persist(self, rows: list):
+        with self._db_lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO query_embeddings (key, model, vector) VALUES (?, ?, ?)",
+                    [(key, model, np.asarray(embedding, dtype=np.float32).tobytes()) for key, model, embedding in rows],
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ No se pudo persistir embedding en caché: {e}")
+
+    def _remember(self, key: str, embedding: list):
+        self._lru[key] = embedding
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "memory_items": len(self._lru),
+                "max_items": self.max_items,
+                "persistent": self._db is not None,
+            }
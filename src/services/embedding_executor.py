@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from src.services.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "100000"))
+EMBED_MAX_BATCH_ITEMS = int(os.getenv("EMBED_MAX_BATCH_ITEMS", "2048"))  # límite de inputs de la API
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_LOCAL_BATCH_SIZE = int(os.getenv("EMBED_LOCAL_BATCH_SIZE", "64"))
+
+CHECKPOINT_FILENAME = "chunks.sqlite"
+# Claves por consulta al buscar checkpoints (límite de variables de SQLite)
+CHECKPOINT_LOOKUP_SIZE = 500
+
+
+def retryable_errors() -> tuple:
+    """Errores transitorios que vale la pena reintentar (el SDK se importa recién al usarlo)"""
+    import openai
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+def token_batches(texts: list, max_tokens: int = EMBED_MAX_BATCH_TOKENS,
+                  max_items: int = EMBED_MAX_BATCH_ITEMS) -> list:
+    """Agrupa índices de `texts` en lotes que no superan max_tokens ni max_items"""
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingExecutor:
+    """
+    Genera embeddings de documentos:
+    - OpenAI: lotes por número de tokens, varias peticiones concurrentes, reintentos con
+      backoff exponencial + jitter ante rate limits, y checkpoint en disco (SQLite) de cada
+      chunk de un lote terminado. La clave es el hash del modelo + texto, no el lote: si la
+      ingesta falla, al reintentar se buscan los chunks ya embebidos antes de armar los
+      lotes, así que no se vuelven a pagar aunque cambie cómo se agrupan
+    - sentence-transformers: encode por lotes reales
+    """
+
+    def __init__(self, openai_client=None, embedder=None, model: str = "text-embedding-3-small",
+                 checkpoint_dir: Optional[Path] = None, max_concurrency: int = EMBED_CONCURRENCY,
+                 max_retries: int = EMBED_MAX_RETRIES, max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+                 max_batch_items: int = EMBED_MAX_BATCH_ITEMS):
+        self.openai_client = openai_client
+        self.embedder = embedder
+        self.model = model
+        self.checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self._checkpoints = None
+        self._checkpoints_lock = threading.Lock()
+        if self.checkpoint_dir:
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                self._checkpoints = sqlite3.connect(str(self.checkpoint_dir / CHECKPOINT_FILENAME),
+                                                    check_same_thread=False)
+                self._checkpoints.execute("PRAGMA journal_mode=WAL")
+                self._checkpoints.execute("PRAGMA synchronous=NORMAL")
+                self._checkpoints.execute(
+                    "CREATE TABLE IF NOT EXISTS chunk_embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+                )
+                self._checkpoints.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Checkpoints de embeddings deshabilitados: {e}")
+                self._checkpoints = None
+
+    def embed(self, texts: list) -> list:
+        if not texts:
+            return []
+        if self.openai_client:
+            return self._embed_openai(texts)
+        if self.embedder:
+            logger.info(f"🔄 Generando embeddings con sentence-transformers ({len(texts)} docs)")
+            vectors = self.embedder.encode(texts, batch_size=EMBED_LOCAL_BATCH_SIZE, convert_to_numpy=True)
+            return [vector.tolist() for vector in vectors]
+        raise Exception("❌ OpenAI no disponible y sentence-transformers está deshabilitado. "
+                        "Configure OPENAI_API_KEY o EMBEDDER_ENABLED=true.")
+
+    def _embed_openai(self, texts: list) -> list:
+        embeddings = [None] * len(texts)
+        for i, embedding in self._load_checkpoints(texts).items():
+            embeddings[i] = embedding
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if len(missing) < len(texts):
+            logger.info(f"♻️ {len(texts) - len(missing)} embeddings recuperados de checkpoints")
+        if not missing:
+            return embeddings
+
+        batches = [[missing[j] for j in batch]
+                   for batch in token_batches([texts[i] for i in missing], self.max_batch_tokens, self.max_batch_items)]
+        logger.info(f"🔄 Generando embeddings con OpenAI para {len(missing)} docs "
+                    f"({len(batches)} lotes, {self.max_concurrency} en paralelo)...")
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            futures = {
+                pool.submit(self._embed_batch, [texts[i] for i in batch]): batch
+                for batch in batches
+            }
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            completed = 0
+            for future in done:
+                # Los lotes terminados ya quedaron en checkpoint; el primer error se propaga
+                batch_embeddings = future.result()
+                for i, embedding in zip(futures[future], batch_embeddings):
+                    embeddings[i] = embedding
+                completed += 1
+            logger.info(f"✅ {completed}/{len(batches)} lotes completados")
+        return embeddings
+
+    def _checkpoint_key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _load_checkpoints(self, texts: list) -> dict:
+        """{posición en texts: embedding} de los textos que ya tienen checkpoint"""
+        if self._checkpoints is None:
+            return {}
+        positions = {}
+        for i, text in enumerate(texts):
+            positions.setdefault(self._checkpoint_key(text), []).append(i)
+        keys = list(positions)
+        found = {}
+        with self._checkpoints_lock:
+            for start in range(0, len(keys), CHECKPOINT_LOOKUP_SIZE):
+                chunk = keys[start:start + CHECKPOINT_LOOKUP_SIZE]
+                rows = self._checkpoints.execute(
+                    f"SELECT key, vector FROM chunk_embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, vector in rows:
+                    embedding = np.frombuffer(vector, dtype=np.float32).tolist()
+                    for i in positions[key]:
+                        found[i] = embedding
+        return found
+
+    def _save_checkpoints(self, batch_texts: list, batch_embeddings: list):
+        if self._checkpoints is None:
+            return
+        rows = [(self._checkpoint_key(text), np.asarray(embedding, dtype=np.float32).tobytes())
+                for text, embedding in zip(batch_texts, batch_embeddings)]
+        with self._checkpoints_lock:
+            try:
+                self._checkpoints.executemany(
+                    "INSERT OR REPLACE INTO chunk_embeddings (key, vector) VALUES (?, ?)", rows
+                )
+                self._checkpoints.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ No se pudo guardar el checkpoint de un lote de embeddings: {e}")
+
+    def _embed_batch(self, batch_texts: list) -> list:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.openai_client.embeddings.create(input=batch_texts, model=self.model)
+                # La API devuelve los embeddings con su índice; se ordenan por si acaso
+                batch_embeddings = [data.embedding for data in sorted(response.data, key=lambda d: d.index)]
+                break
+            except retryable_errors() as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Error con OpenAI tras {attempt + 1} intentos: {e}")
+                    raise
+                delay = self._backoff(attempt, e)
+                logger.warning(f"⚠️ {type(e).__name__} en lote de embeddings, reintento en {delay:.1f}s")
+                time.sleep(delay)
+
+        self._save_checkpoints(batch_texts, batch_embeddings)
+        return batch_embeddings
+
+    @staticmethod
+    def _backoff(attempt: int, error: Exception) -> float:
+        """Backoff exponencial con jitter; respeta Retry-After si la API lo envía"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, 0.5)
+            except ValueError:
+                pass
+        return min(60.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def clear_checkpoints(self):
+        """Borra los checkpoints una vez que los embeddings quedaron en el índice"""
+        if not self.checkpoint_dir:
+            return
+        if self._checkpoints is not None:
+            with self._checkpoints_lock:
+                try:
+                    self._checkpoints.execute("DELETE FROM chunk_embeddings")
+                    self._checkpoints.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"⚠️ No se pudieron borrar los checkpoints de embeddings: {e}")
+        # Checkpoints por lote (.npy) de versiones anteriores
+        for path in self.checkpoint_dir.glob("*.npy"):
+            path.unlink(missing_ok=True)
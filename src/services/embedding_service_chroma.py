@@ -1,10 +1,24 @@
-import chromadb
-import pickle
+import asyncio
+import json
+import threading
+import time
 import numpy as np
 from pathlib import Path
 import os
 import logging
-from openai import OpenAI
+from src.services.embedding_cache import EmbeddingCache
+from src.services.embedding_executor import EmbeddingExecutor
+from src.services import metrics
+from src.services.http_clients import CLIENTS
+from src.services.lexical_index import BM25Index, RRF_K, reciprocal_rank_fusion
+from src.services.shared_index import GENERATION, INDEX_ROLE, INDEX_ROLES, OPEN_ATTEMPTS, SharedIndex
+from src.services.vector_store import create_vector_store
+from src.services.embedding_store import (
+    artifact_exists,
+    load_embedding_artifact,
+    migrate_pickle,
+    save_embedding_artifact,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -12,176 +26,546 @@ logger = logging.getLogger(__name__)
 EMBEDDER_ENABLED = os.getenv("EMBEDDER_ENABLED", "false").lower() == "true"
 IS_PRODUCTION = os.getenv("ENV", "development").lower() == "production"
 USE_OPENAI_EMBEDDINGS = os.getenv("USE_OPENAI_EMBEDDINGS", "true").lower() == "true"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() == "true"
 
-SentenceTransformer = None
-if EMBEDDER_ENABLED and not IS_PRODUCTION:
+# Índice persistente en disco (PersistentClient) en lugar de ChromaDB en memoria
+CHROMA_PERSISTENT = os.getenv("CHROMA_PERSISTENT", "false").lower() == "true"
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_persist")
+
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Embeddings precomputados: float32 por defecto, float16 reduce el archivo a la mitad
+EMBEDDINGS_DTYPE = os.getenv("EMBEDDINGS_DTYPE", "float32")
+EMBEDDINGS_ARTIFACT_DIRNAME = "embeddings"
+LEGACY_PICKLE_FILENAME = "embeddings_precomputed.pkl"
+
+COLLECTION_NAME = "document_chunks"
+CHROMA_BATCH_SIZE = 5000
+MANIFEST_FILENAME = "index_manifest.json"
+MANIFEST_VERSION = 1
+
+# Búsqueda híbrida: BM25 + vectorial fusionados con RRF
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+# Candidatos que aporta cada ranking (denso y léxico) antes de fusionar
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+
+# Backend vectorial: "chroma" (ChromaDB) o "numpy" (matriz en memoria, opcionalmente int8)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+# Con int8: candidatos por resultado que se reordenan con los vectores float32
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+
+
+def load_sentence_transformer():
+    """
+    Clase SentenceTransformer si está habilitada e instalada, si no None. Se importa recién
+    al crear el servicio (torch tarda varios segundos en importarse).
+    """
+    if IS_PRODUCTION:
+        logger.info("⏭️ sentence-transformers deshabilitado (PRODUCCIÓN)")
+        return None
+    if not EMBEDDER_ENABLED:
+        logger.info("⏭️ EMBEDDER_ENABLED=false, sentence-transformers no se cargará")
+        return None
     try:
         from sentence_transformers import SentenceTransformer
         logger.info("✅ sentence-transformers cargado (DESARROLLO)")
+        return SentenceTransformer
     except ImportError as e:
         logger.warning(f"⚠️ sentence-transformers no disponible: {e}")
-        SentenceTransformer = None
-else:
-    if IS_PRODUCTION:
-        logger.info("⏭️ sentence-transformers deshabilitado (PRODUCCIÓN)")
-    else:
-        logger.info("⏭️ EMBEDDER_ENABLED=false, sentence-transformers no se cargará")
+        return None
+
+
+def hybrid_candidates(n_results: int, candidates: int = HYBRID_CANDIDATES) -> int:
+    """Candidatos de cada ranking (denso y BM25) para devolver n_results fusionados"""
+    return max(n_results, candidates)
+
+
+def _head(results: dict, n: int) -> dict:
+    """Los n primeros de un resultado con forma de collection.query (una consulta)"""
+    return {key: [values[0][:n]] for key, values in results.items()}
 
 
 
 class EmbeddingServiceChroma:
-    def __init__(self, persist_dir: str = "./chroma_persist"):
+    def __init__(self, persist_dir: str = CHROMA_PERSIST_DIR, persistent: bool = CHROMA_PERSISTENT,
+                 vector_backend: str = VECTOR_BACKEND, role: str = INDEX_ROLE, shared_index: SharedIndex = None):
         self.persist_dir = Path(persist_dir)
         self.persist_dir.mkdir(exist_ok=True)
+        self.persistent = persistent
+
+        # Índice compartido entre procesos (ver shared_index): el builder publica, el reader lee
+        if role not in INDEX_ROLES:
+            raise ValueError(f"INDEX_ROLE no soportado: {role}")
+        self.role = role
+        self.shared_index = shared_index or (SharedIndex() if role != "standalone" else None)
+        self.shared_generation = None
+        if role == "reader" and vector_backend != "numpy":
+            # El reader usa los vectores del mmap: una colección de ChromaDB los copiaría
+            logger.info(f"⏭️ INDEX_ROLE=reader: backend numpy sobre el índice compartido (no {vector_backend})")
+            vector_backend = "numpy"
         
-        # ChromaDB en memoria (más ligero para Render)
-        self.client = chromadb.Client()
-        self.collection = self.client.get_or_create_collection(name="document_chunks")
+        self.client = None
+        if vector_backend == "chroma":
+            # chromadb tarda ~0,5 s en importarse: solo se carga si es el backend elegido
+            import chromadb
+            if self.persistent:
+                # ChromaDB en disco: al reiniciar se abre el índice existente sin reinsertar nada
+                self.client = chromadb.PersistentClient(path=str(self.persist_dir / "chroma_db"))
+            else:
+                # ChromaDB en memoria (más ligero para Render)
+                self.client = chromadb.Client()
+        # Con el backend numpy el índice en disco es el artefacto de embeddings (mmap)
+        self.vector_store = create_vector_store(
+            vector_backend,
+            client=self.client,
+            collection_name=COLLECTION_NAME,
+            quantization=VECTOR_QUANTIZATION,
+            rescore_factor=VECTOR_RESCORE_FACTOR,
+        )
         
-        # Flag para embeddings precomputados
+        # Versión del índice: cambia cada vez que se modifica la colección
+        # (las cachés de respuestas la usan para invalidarse)
+        self.index_version = 0
+
+        # Flag para embeddings precomputados (EmbeddingArtifact con mmap)
         self.embeddings_loaded = False
-        self.precomputed_data = None
+        self.precomputed = None
+        self._precomputed_row_index = None
+        self.artifact_dir = self.persist_dir / EMBEDDINGS_ARTIFACT_DIRNAME
+
+        # Índice léxico BM25: se mantiene junto a la colección; si la colección ya tenía
+        # documentos (índice persistente) se construye a partir de ella en la primera búsqueda
+        self.lexical_index = BM25Index()
+        self._lexical_ready = False
+        self._lexical_lock = threading.Lock()
         
         # Embedder solo si está habilitado
         self.embedder = None
-        if SentenceTransformer and EMBEDDER_ENABLED:
+        SentenceTransformer = load_sentence_transformer()
+        if SentenceTransformer:
             logger.info("Cargando modelo de embeddings...")
-            self.embedder = SentenceTransformer("all-MiniLM-L6-v2")
+            self.embedder = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
         
-        # Intentar cargar embeddings precomputados al inicializar
-        self._try_load_precomputed()
-    
-        # Inicializar cliente de OpenAI si está configurado
+        # Clientes de OpenAI (pool compartido con la generación) si está configurado
         self.openai_client = None
+        self.async_openai_client = None
+        batch_client = None
         if USE_OPENAI_EMBEDDINGS and os.getenv("OPENAI_API_KEY"):
             try:
-                self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+                self.openai_client = CLIENTS.client("openai", "embed_query")
+                self.async_openai_client = CLIENTS.async_client("openai", "embed_query")
+                batch_client = CLIENTS.client("openai", "embed_batch")
                 logger.info("✅ OpenAI embeddings disponible")
             except Exception as e:
                 logger.warning(f"⚠️ Error inicializando OpenAI: {e}")
 
-    def _try_load_precomputed(self):
-        """Intenta cargar embeddings precomputados al inicio"""
-        embeddings_path = self.persist_dir / "embeddings_precomputed.pkl"
-        if embeddings_path.exists():
+        # Embeddings de documentos: lotes por tokens, concurrencia, reintentos y checkpoints
+        self.embedding_executor = EmbeddingExecutor(
+            openai_client=batch_client,
+            embedder=self.embedder,
+            model=OPENAI_EMBEDDING_MODEL,
+            checkpoint_dir=self.persist_dir / "embedding_checkpoints",
+        )
+
+        # Caché de embeddings de consultas (LRU en memoria + SQLite opcional)
+        self.embedding_cache = EmbeddingCache(
+            max_items=EMBEDDING_CACHE_SIZE,
+            persist_path=self.persist_dir / "query_embedding_cache.sqlite" if EMBEDDING_CACHE_PERSIST else None,
+        )
+
+        # Intentar cargar embeddings precomputados al inicializar
+        # (en modo persistente solo si la colección en disco está vacía;
+        # el reader no: carga la generación publicada con attach_shared_index)
+        if self.role == "reader":
+            pass
+        elif self.persistent and self.vector_store.count() > 0:
+            logger.info(f"✅ Índice persistente abierto con {self.vector_store.count()} documentos")
+            # El artefacto (mmap) solo se abre para reutilizar embeddings en reindexaciones
             try:
-                with open(embeddings_path, 'rb') as f:
-                    self.precomputed_data = pickle.load(f)
-                
-                # Agregar a ChromaDB (SÚPER RÁPIDO)
-                self.collection.add(
-                    documents=self.precomputed_data['texts'],
-                    embeddings=self.precomputed_data['embeddings'].tolist(),
-                    metadatas=self.precomputed_data['metadatas'],
-                    ids=self.precomputed_data['ids']
-                )
-                self.embeddings_loaded = True
-                print(f"✅ Cargados {len(self.precomputed_data['ids'])} embeddings precomputados")
+                self.precomputed = load_embedding_artifact(self.artifact_dir)
             except Exception as e:
-                print(f"⚠️ Error cargando precomputados: {e}")
+                logger.warning(f"⚠️ Artefacto de embeddings ilegible: {e}")
+        else:
+            self._try_load_precomputed()
+
+
+    def _try_load_precomputed(self):
+        """
+        Intenta cargar embeddings precomputados al inicio (artefacto mmap en persist_dir/embeddings).
+        Si solo existe el pickle antiguo, se migra automáticamente al nuevo formato.
+        """
+        legacy_path = self.persist_dir / LEGACY_PICKLE_FILENAME
+        try:
+            if not artifact_exists(self.artifact_dir) and legacy_path.exists():
+                logger.info(f"🔄 Migrando {legacy_path} al formato mmap...")
+                migrate_pickle(legacy_path, self.artifact_dir, EMBEDDINGS_DTYPE)
+
+            artifact = load_embedding_artifact(self.artifact_dir)
+            if artifact is None:
+                return
+
+            # Vectores de otro modelo no sirven para las consultas actuales
+            if self.embedding_model and artifact.embedding_model not in (None, self.embedding_model):
+                logger.warning(f"⚠️ Embeddings precomputados con {artifact.embedding_model}, "
+                               f"pero las consultas usan {self.embedding_model}. Se ignoran.")
+                return
+            self.precomputed = artifact
+
+            # Agregar al backend (SÚPER RÁPIDO): por lotes desde el mmap, o adoptando el mmap (numpy)
+            self.vector_store.load_artifact(artifact, CHROMA_BATCH_SIZE)
+            self.embeddings_loaded = True
+            self.index_version += 1
+            logger.info(f"✅ Cargados {len(artifact)} embeddings precomputados")
+        except Exception as e:
+            logger.warning(f"⚠️ Error cargando precomputados: {e}")
     
-    def add_documents(self, docs_with_metadata: list):
+    @property
+    def embedding_model(self):
+        """Modelo con el que se generan los embeddings del índice"""
+        if self.openai_client:
+            return OPENAI_EMBEDDING_MODEL
+        if self.embedder:
+            return LOCAL_EMBEDDING_MODEL
+        return None
+
+    def reset_collection(self):
+        """Vacía la colección (antes de una reindexación completa)"""
+        self.vector_store.reset()
+        self.lexical_index.clear()
+        self._lexical_ready = True
+        self.index_version += 1
+
+    def read_manifest(self):
+        """Lee el manifiesto del índice (None si no existe o es ilegible)"""
+        manifest_path = self.persist_dir / MANIFEST_FILENAME
+        if not manifest_path.exists():
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Manifiesto ilegible, se ignorará: {e}")
+            return None
+
+    def write_manifest(self, corpus_fingerprint: str, files: dict):
+        """Escribe el manifiesto de forma atómica (archivo temporal + rename)"""
+        previous = self.read_manifest() or {}
+        manifest = {
+            "manifest_version": MANIFEST_VERSION,
+            "generation": previous.get("generation", 0) + 1,
+            "collection": COLLECTION_NAME,
+            "vector_backend": self.vector_store.name,
+            "embedding_model": self.embedding_model,
+            "document_count": self.vector_store.count(),
+            "corpus_fingerprint": corpus_fingerprint,
+            "files": files,
+            "updated_at": time.time(),
+        }
+        manifest_path = self.persist_dir / MANIFEST_FILENAME
+        tmp_path = manifest_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return manifest
+
+    def add_documents(self, docs_with_metadata: list, persist: bool = True):
         """
         docs_with_metadata: lista de dicts con {
             'id': str,
             'text': str,
             'metadata': dict,
         }
-        Primero busca embeddings precomputados para evitar replicar el trabajo.
+        Primero busca embeddings precomputados (por id) para evitar replicar el trabajo;
+        solo se generan los que faltan.
+        persist=False deja para después la exportación del artefacto (ingestas por lotes).
         """
-        embeddings = []
+        if not docs_with_metadata:
+            return
+        embeddings = [None] * len(docs_with_metadata)
         
-        # 🚀 Prioridad 1: Usar embeddings precomputados si existen
-        if self.embeddings_loaded and self.precomputed_data:
-            logger.info("⚡ Usando embeddings precomputados existentes")
-            embeddings = self.precomputed_data['embeddings'].tolist()
-        else:
-            # Prioridad 2: Generar con OpenAI en batches
-            batch_size = 100  # Procesar en lotes de 100
-            
-            if self.openai_client:
-                logger.info(f"🔄 Generando embeddings con OpenAI para {len(docs_with_metadata)} docs (en lotes de {batch_size})...")
-                
-                for i in range(0, len(docs_with_metadata), batch_size):
-                    batch = docs_with_metadata[i:i+batch_size]
-                    batch_texts = [doc['text'] for doc in batch]
-                    
-                    try:
-                        # OpenAI puede procesar múltiples textos en una llamada
-                        response = self.openai_client.embeddings.create(
-                            input=batch_texts,
-                            model="text-embedding-3-small"
-                        )
-                        # Ordenar embeddings según el orden de respuesta
-                        for data in response.data:
-                            embeddings.append(data.embedding)
-                        
-                        logger.info(f"✅ Lote {i//batch_size + 1}/{(len(docs_with_metadata)-1)//batch_size + 1} completado")
-                    except Exception as e:
-                        logger.error(f"Error con OpenAI lote {i//batch_size + 1}: {e}")
-                        raise
-            elif self.embedder:
-                # Fallback: Generar con sentence-transformers si OpenAI no está disponible
-                logger.info("🔄 Generando embeddings con sentence-transformers")
-                embeddings = [self.embedder.encode(doc['text']) for doc in docs_with_metadata]
-            else:
-                raise Exception("❌ OpenAI no disponible y sentence-transformers está deshabilitado. "
-                              "Configure OPENAI_API_KEY o EMBEDDER_ENABLED=true.")
-            
-            # Guardar embeddings para próxima vez (solo si no eran precomputados)
-            self._save_precomputed_embeddings(docs_with_metadata, embeddings)
+        # 🚀 Prioridad 1: Usar embeddings precomputados si existen (los ids dependen del contenido)
+        if self.precomputed is not None:
+            rows = self._precomputed_rows()
+            for i, doc in enumerate(docs_with_metadata):
+                row = rows.get(doc['id'])
+                if row is not None:
+                    embeddings[i] = np.asarray(self.precomputed.embeddings[row], dtype=np.float32).tolist()
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if len(missing) < len(docs_with_metadata):
+            logger.info(f"⚡ Reutilizando {len(docs_with_metadata) - len(missing)} embeddings precomputados")
+        if missing:
+            # Prioridad 2: Generar los que faltan
+            generated = self._embed_documents([docs_with_metadata[i]['text'] for i in missing])
+            for i, embedding in zip(missing, generated):
+                embeddings[i] = embedding
         
-        # Agregar a ChromaDB
-        self.collection.add(
-            documents=[doc['text'] for doc in docs_with_metadata],
-            embeddings=embeddings,
+        # Agregar al índice vectorial
+        self._add_to_collection(
+            ids=[doc['id'] for doc in docs_with_metadata],
+            texts=[doc['text'] for doc in docs_with_metadata],
             metadatas=[doc['metadata'] for doc in docs_with_metadata],
-            ids=[doc['id'] for doc in docs_with_metadata]
+            embeddings=embeddings,
         )
-    
-    def _save_precomputed_embeddings(self, docs_with_metadata: list, embeddings: list):
-        """Guarda embeddings para usar en próximos restarts"""
-        embeddings_path = self.persist_dir / "embeddings_precomputed.pkl"
+        self.index_version += 1
+        metrics.INGEST_CHUNKS.inc(len(docs_with_metadata))
+
+        # Guardar embeddings para próxima vez (solo si hubo que generar alguno)
+        if missing and persist:
+            self.save_precomputed()
+
+    def _embed_documents(self, texts: list) -> list:
+        """Genera embeddings de documentos con OpenAI (en lotes) o sentence-transformers"""
+        return self.embedding_executor.embed(texts)
+
+    def _add_to_collection(self, ids: list, texts: list, metadatas: list, embeddings):
+        # upsert: los IDs dependen del contenido, reintentar una ingesta interrumpida es idempotente
+        self.vector_store.upsert(ids, texts, metadatas, embeddings)
+        with self._lexical_lock:
+            if self._lexical_ready:
+                self.lexical_index.add(ids, texts)
+
+    def delete_documents(self, ids: list, persist: bool = True):
+        """Elimina chunks de la colección (archivos modificados o borrados)"""
+        if not ids:
+            return
+        self.vector_store.delete(ids)
+        with self._lexical_lock:
+            if self._lexical_ready:
+                self.lexical_index.remove(ids)
+        self.index_version += 1
+        metrics.DELETED_CHUNKS.inc(len(ids))
+        if persist:
+            self.save_precomputed()
+
+    def existing_ids(self, ids: list) -> set:
+        """Subconjunto de `ids` que está en la colección"""
+        found = set()
+        for start in range(0, len(ids), CHROMA_BATCH_SIZE):
+            found.update(self.vector_store.get(ids=ids[start:start + CHROMA_BATCH_SIZE], include=[])["ids"])
+        return found
+
+    def all_ids(self) -> list:
+        ids = []
+        offset = 0
+        while True:
+            page = self.vector_store.get(include=[], limit=CHROMA_BATCH_SIZE, offset=offset)["ids"]
+            ids.extend(page)
+            if len(page) < CHROMA_BATCH_SIZE:
+                return ids
+            offset += CHROMA_BATCH_SIZE
+
+    def _precomputed_rows(self) -> dict:
+        if self._precomputed_row_index is None:
+            self._precomputed_row_index = {chunk_id: row for row, chunk_id in enumerate(self.precomputed.ids)}
+        return self._precomputed_row_index
+
+    def _export_collection(self) -> tuple:
+        """(ids, textos, metadatas, embeddings) de toda la colección, leída por páginas"""
+        ids, texts, metadatas, embeddings = [], [], [], []
+        offset = 0
+        while True:
+            page = self.vector_store.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=CHROMA_BATCH_SIZE,
+                offset=offset,
+            )
+            ids.extend(page["ids"])
+            texts.extend(page["documents"])
+            metadatas.extend(page["metadatas"])
+            embeddings.extend(page["embeddings"])
+            if len(page["ids"]) < CHROMA_BATCH_SIZE:
+                return ids, texts, metadatas, embeddings
+            offset += CHROMA_BATCH_SIZE
+
+    def save_precomputed(self):
+        """Exporta la colección completa al artefacto de embeddings precomputados"""
         try:
-            data = {
-                'embeddings': np.array(embeddings),
-                'texts': [doc['text'] for doc in docs_with_metadata],
-                'metadatas': [doc['metadata'] for doc in docs_with_metadata],
-                'ids': [doc['id'] for doc in docs_with_metadata]
-            }
-            with open(embeddings_path, 'wb') as f:
-                pickle.dump(data, f)
-            print(f"💾 Embeddings guardados: {embeddings_path}")
+            ids, texts, metadatas, embeddings = self._export_collection()
+            if not ids:
+                return
+            save_embedding_artifact(
+                self.artifact_dir,
+                ids=ids,
+                texts=texts,
+                metadatas=metadatas,
+                embeddings=embeddings,
+                embedding_model=self.embedding_model,
+                dtype=EMBEDDINGS_DTYPE,
+            )
+            self.precomputed = load_embedding_artifact(self.artifact_dir)
+            self._precomputed_row_index = None
+            logger.info(f"💾 Embeddings guardados: {self.artifact_dir}")
         except Exception as e:
-            print(f"⚠️ No se pudieron guardar embeddings: {e}")
+            logger.warning(f"⚠️ No se pudieron guardar embeddings: {e}")
     
-    def query(self, text: str, n_results: int = 5):
+    def publish_shared_index(self, force: bool = False):
+        """
+        (builder) Publica la colección como generación nueva del índice compartido, salvo
+        que la vigente ya corresponda a este mismo índice (según el manifiesto).
+        Devuelve el puntero publicado o None si no hizo falta.
         """
-        Query usando OpenAI embeddings (muy ligero, sin sentence-transformers).
+        manifest = self.read_manifest()
+        source = {key: (manifest or {}).get(key)
+                  for key in ("generation", "corpus_fingerprint", "document_count", "embedding_model")}
+        current = self.shared_index.current()
+        if not force and manifest and current and current.get("source") == source:
+            self.shared_generation = current["generation"]
+            GENERATION.set(self.shared_generation)
+            logger.info(f"✅ Índice compartido al día (generación {self.shared_generation})")
+            return None
+        ids, texts, metadatas, embeddings = self._export_collection()
+        if not ids:
+            logger.info("⏭️ Índice vacío: no se publica en el índice compartido")
+            return None
+        pointer = self.shared_index.publish(ids, texts, metadatas, embeddings, self.embedding_model, source)
+        self.shared_generation = pointer["generation"]
+        return pointer
+
+    def attach_shared_index(self) -> bool:
+        """
+        (reader) Pasa a la última generación publicada si no es la que está usando: vectores,
+        normas y textos quedan mapeados desde disco (compartidos con los demás workers) y el
+        estado se reemplaza de una vez, así una búsqueda ve una generación o la otra.
+        Devuelve True si cambió de generación.
+        """
+        start = time.time()
+        for attempt in range(1, OPEN_ATTEMPTS + 1):
+            pointer = self.shared_index.current()
+            if pointer is None or pointer["generation"] == self.shared_generation:
+                return False
+            published_model = pointer.get("embedding_model")
+            if self.embedding_model and published_model not in (None, self.embedding_model):
+                raise ValueError(f"El índice compartido usa {published_model} y las consultas {self.embedding_model}")
+            try:
+                # Todo lo que se lee del disco queda mapeado acá; el estado se reemplaza al final
+                artifact, lexical = self.shared_index.open(pointer)
+                if lexical is None:
+                    lexical = BM25Index()
+                    lexical.add(artifact.ids, artifact.column("text"))
+                self.vector_store.load_artifact(artifact, CHROMA_BATCH_SIZE)
+                break
+            except FileNotFoundError as e:
+                # El builder la borró entre leer CURRENT y abrirla: hay una más nueva
+                if attempt == OPEN_ATTEMPTS:
+                    raise
+                logger.info(f"🔁 Generación {pointer['generation']} borrada mientras se abría ({e}), "
+                            f"se relee CURRENT")
+        with self._lexical_lock:
+            self.lexical_index = lexical
+            self._lexical_ready = True
+        self.index_version += 1
+        self.shared_generation = pointer["generation"]
+        GENERATION.set(self.shared_generation)
+        logger.info(f"🔗 Índice compartido: generación {self.shared_generation} "
+                    f"({len(artifact)} documentos) en {time.time() - start:.2f}s")
+        return True
+
+    def embed_query(self, text: str):
+        """
+        Genera el embedding de una consulta usando OpenAI embeddings (muy ligero, sin sentence-transformers).
         Fallback a sentence-transformers si OpenAI no está disponible.
+        Consulta primero la caché de embeddings.
         """
         embedding = None
         
         # Prioridad 1: OpenAI embeddings (0MB local)
         if self.openai_client:
+            embedding = self.embedding_cache.get(text, OPENAI_EMBEDDING_MODEL)
+            if embedding is not None:
+                return embedding
             try:
-                logger.info("Generando embedding con OpenAI...")
-                print("Generando embedding con OpenAI...")
+                logger.debug("Generando embedding con OpenAI...")
                 response = self.openai_client.embeddings.create(
                     input=text,
-                    model="text-embedding-3-small"  # Super ligero y rápido
+                    model=OPENAI_EMBEDDING_MODEL  # Super ligero y rápido
                 )
                 embedding = response.data[0].embedding
+                self.embedding_cache.put(text, OPENAI_EMBEDDING_MODEL, embedding)
             except Exception as e:
                 logger.warning(f"Error con OpenAI embeddings: {e}. Usando fallback...")
                 embedding = None
         
         # Fallback: sentence-transformers si está disponible
         if embedding is None and self.embedder:
-            logger.info("Generando embedding con sentence-transformers...")
-            print("Generando embedding con sentence-transformers...")
+            embedding = self.embedding_cache.get(text, LOCAL_EMBEDDING_MODEL)
+            if embedding is not None:
+                return embedding
+            logger.debug("Generando embedding con sentence-transformers...")
             embedding = self.embedder.encode(text)
+            self.embedding_cache.put(text, LOCAL_EMBEDDING_MODEL, embedding)
         
+        return self._check_embedding(embedding)
+
+    async def aembed_query(self, text: str):
+        """Versión asíncrona de embed_query: no bloquea el event loop"""
+        embedding = None
+
+        if self.async_openai_client:
+            embedding = await self.embedding_cache.aget(text, OPENAI_EMBEDDING_MODEL)
+            if embedding is not None:
+                return embedding
+            try:
+                logger.debug("Generando embedding con OpenAI (async)...")
+                response = await self.async_openai_client.embeddings.create(
+                    input=text,
+                    model=OPENAI_EMBEDDING_MODEL
+                )
+                embedding = response.data[0].embedding
+                await self.embedding_cache.aput([(text, OPENAI_EMBEDDING_MODEL, embedding)])
+            except Exception as e:
+                logger.warning(f"Error con OpenAI embeddings: {e}. Usando fallback...")
+                embedding = None
+
+        # sentence-transformers es CPU-bound: se ejecuta en un hilo aparte
+        if embedding is None and self.embedder:
+            embedding = await self.embedding_cache.aget(text, LOCAL_EMBEDDING_MODEL)
+            if embedding is not None:
+                return embedding
+            logger.debug("Generando embedding con sentence-transformers...")
+            embedding = await asyncio.to_thread(self.embedder.encode, text)
+            await self.embedding_cache.aput([(text, LOCAL_EMBEDDING_MODEL, embedding)])
+
+        return self._check_embedding(embedding)
+
+    async def aembed_queries(self, texts: list) -> list:
+        """
+        Embeddings de varias consultas: las que no están en caché se generan en UNA sola
+        llamada a OpenAI (input=lista) o en un solo encode de sentence-transformers.
+        """
+        embeddings = [None] * len(texts)
+        for model, client in ((OPENAI_EMBEDDING_MODEL, self.async_openai_client), (LOCAL_EMBEDDING_MODEL, self.embedder)):
+            if client is None:
+                continue
+            for i, text in enumerate(texts):
+                if embeddings[i] is None:
+                    embeddings[i] = await self.embedding_cache.aget(text, model)
+            missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+            if not missing:
+                break
+            try:
+                if model == OPENAI_EMBEDDING_MODEL:
+                    logger.debug(f"Generando {len(missing)} embeddings con OpenAI (async, una llamada)...")
+                    response = await self.async_openai_client.embeddings.create(input=missing, model=model)
+                    generated = [data.embedding for data in sorted(response.data, key=lambda d: d.index)]
+                else:
+                    logger.debug(f"Generando {len(missing)} embeddings con sentence-transformers...")
+                    generated = await asyncio.to_thread(self.embedder.encode, missing)
+            except Exception as e:
+                logger.warning(f"Error generando embeddings con {model}: {e}. Usando fallback...")
+                continue
+            by_text = dict(zip(missing, generated))
+            await self.embedding_cache.aput([(text, model, embedding) for text, embedding in by_text.items()])
+            embeddings = [by_text.get(text) if embedding is None else embedding
+                          for text, embedding in zip(texts, embeddings)]
+
+        return [self._check_embedding(embedding) for embedding in embeddings]
+
+    @staticmethod
+    def _check_embedding(embedding):
         # Error si no hay forma de generar embedding
         if embedding is None:
             raise Exception(
@@ -189,12 +573,115 @@ class EmbeddingServiceChroma:
                 "Opción 1: Configure OPENAI_API_KEY. "
                 "Opción 2: Configure EMBEDDER_ENABLED=true para sentence-transformers."
             )
-        
-        results = self.collection.query(
-            query_embeddings=[embedding],
-            n_results=n_results
+        return embedding
+
+    def _ensure_lexical_index(self):
+        """Construye el índice BM25 desde la colección (una vez, p.ej. tras abrir un índice persistente)"""
+        if self._lexical_ready:
+            return
+        with self._lexical_lock:
+            if self._lexical_ready:
+                return
+            start = time.time()
+            total = self.vector_store.count()
+            for offset in range(0, total, CHROMA_BATCH_SIZE):
+                batch = self.vector_store.get(include=["documents"], limit=CHROMA_BATCH_SIZE, offset=offset)
+                self.lexical_index.add(batch["ids"], batch["documents"])
+            self._lexical_ready = True
+        logger.info(f"🔤 Índice BM25 construido con {len(self.lexical_index)} documentos "
+                    f"en {time.time() - start:.2f}s")
+
+    def search(self, embedding, n_results: int = 5, query_text: str = None, include_embeddings: bool = False):
+        """
+        Búsqueda vectorial (backend configurado) a partir de un embedding ya calculado.
+        Con query_text (y HYBRID_SEARCH_ENABLED) se combina con BM25 mediante RRF;
+        el resultado mantiene la forma de collection.query.
+        include_embeddings agrega los embeddings de los resultados (para re-ranking MMR).
+        """
+        if not query_text or not HYBRID_SEARCH_ENABLED:
+            return self.vector_store.query(embedding, n_results, include_embeddings=include_embeddings)
+        return self.hybrid_search(embedding, query_text, n_results, include_embeddings=include_embeddings)
+
+    def search_many(self, embeddings: list, n_results=5, query_texts: list = None,
+                    include_embeddings: bool = False) -> list:
+        """
+        Varias búsquedas con una sola consulta multi-embedding al backend vectorial
+        (y BM25 por pregunta si hay query_texts). Devuelve un resultado por embedding.
+        n_results puede ser uno por embedding: cada búsqueda da lo mismo que search con su
+        n_results (mismos candidatos por ranking), aunque el backend se consulte una vez.
+        """
+        if not embeddings:
+            return []
+        if isinstance(n_results, int):
+            n_results = [n_results] * len(embeddings)
+        if not query_texts or not HYBRID_SEARCH_ENABLED:
+            dense_results = self.vector_store.query_many(embeddings, max(n_results), include_embeddings=include_embeddings)
+            return [_head(dense, n) for dense, n in zip(dense_results, n_results)]
+        self._ensure_lexical_index()
+        n_candidates = [hybrid_candidates(n) for n in n_results]
+        dense_results = self.vector_store.query_many(
+            embeddings, max(n_candidates), include_embeddings=include_embeddings
         )
-        return results
+        return [
+            self._fuse_with_lexical(_head(dense, candidates), query_text, n, candidates, include_embeddings)
+            for dense, query_text, n, candidates in zip(dense_results, query_texts, n_results, n_candidates)
+        ]
+
+    def hybrid_search(self, embedding, query_text: str, n_results: int = 5,
+                      candidates: int = HYBRID_CANDIDATES, include_embeddings: bool = False):
+        """Fusiona (RRF) los rankings vectorial y BM25 y devuelve los n_results mejores"""
+        self._ensure_lexical_index()
+        n_candidates = hybrid_candidates(n_results, candidates)
+        dense = self.vector_store.query(embedding, n_candidates, include_embeddings=include_embeddings)
+        return self._fuse_with_lexical(dense, query_text, n_results, n_candidates, include_embeddings)
+
+    def _fuse_with_lexical(self, dense: dict, query_text: str, n_results: int, n_candidates: int,
+                           include_embeddings: bool) -> dict:
+        """Fusiona (RRF) un resultado vectorial con los n_candidates mejores de BM25"""
+        dense_ids = dense["ids"][0]
+        lexical_ids = [doc_id for doc_id, _ in self.lexical_index.search(query_text, n_candidates)]
+
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], k=RRF_K)[:n_results]
+        dense_embeddings = dense["embeddings"][0] if include_embeddings else [None] * len(dense_ids)
+        rows = {
+            doc_id: (text, meta, distance, vector)
+            for doc_id, text, meta, distance, vector in zip(
+                dense_ids, dense["documents"][0], dense["metadatas"][0], dense["distances"][0], dense_embeddings
+            )
+        }
+        # Los que solo encontró BM25 se leen del índice (sin distancia vectorial)
+        missing = [doc_id for doc_id, _ in fused if doc_id not in rows]
+        if missing:
+            include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+            extra = self.vector_store.get(ids=missing, include=include)
+            extra_embeddings = extra["embeddings"] if include_embeddings else [None] * len(extra["ids"])
+            for doc_id, text, meta, vector in zip(extra["ids"], extra["documents"], extra["metadatas"], extra_embeddings):
+                rows[doc_id] = (text, meta, None, vector)
+
+        fused = [(doc_id, score) for doc_id, score in fused if doc_id in rows]
+        result = {
+            "ids": [[doc_id for doc_id, _ in fused]],
+            "documents": [[rows[doc_id][0] for doc_id, _ in fused]],
+            "metadatas": [[rows[doc_id][1] for doc_id, _ in fused]],
+            "distances": [[rows[doc_id][2] for doc_id, _ in fused]],
+            "fusion_scores": [[score for _, score in fused]],
+        }
+        if include_embeddings:
+            result["embeddings"] = [[rows[doc_id][3] for doc_id, _ in fused]]
+        return result
+
+    def query(self, text: str, n_results: int = 5):
+        """Embedding de la consulta + búsqueda en el índice"""
+        embedding = self.embed_query(text)
+        return self.search(embedding, n_results, query_text=text)
+
+    async def aquery(self, text: str, n_results: int = 5):
+        """
+        Versión asíncrona de query: embedding con AsyncOpenAI y la consulta
+        al índice (síncrona) fuera del event loop.
+        """
+        embedding = await self.aembed_query(text)
+        return await asyncio.to_thread(self.search, embedding, n_results, text)
 
     def generate_precomputed_file(self, docs_with_metadata: list):
         """Método para generar embeddings precomputados (ejecutar UNA VEZ local)"""
@@ -202,18 +689,18 @@ class EmbeddingServiceChroma:
             raise Exception("❌ sentence-transformers no disponible. Configure EMBEDDER_ENABLED=true")
         
         logger.info("🧠 Generando embeddings precomputados...")
-        embeddings = [self.embedder.encode(doc['text']) for doc in docs_with_metadata]
-        
-        data = {
-            'embeddings': np.array(embeddings),
-            'texts': [doc['text'] for doc in docs_with_metadata],
-            'metadatas': [doc['metadata'] for doc in docs_with_metadata],
-            'ids': [doc['id'] for doc in docs_with_metadata]
-        }
+        embeddings = self.embedder.encode([doc['text'] for doc in docs_with_metadata])
         
-        embeddings_path = self.persist_dir / "embeddings_precomputed.pkl"
-        with open(embeddings_path, 'wb') as f:
-            pickle.dump(data, f)
+        save_embedding_artifact(
+            self.artifact_dir,
+            ids=[doc['id'] for doc in docs_with_metadata],
+            texts=[doc['text'] for doc in docs_with_metadata],
+            metadatas=[doc['metadata'] for doc in docs_with_metadata],
+            embeddings=embeddings,
+            embedding_model=LOCAL_EMBEDDING_MODEL,
+            dtype=EMBEDDINGS_DTYPE,
+        )
         
-        logger.info(f"✅ Archivo generado: {embeddings_path} ({data['embeddings'].nbytes/1024/1024:.1f}MB)")
-        return embeddings_path
+        size_mb = (self.artifact_dir / "vectors.npy").stat().st_size / 1024 / 1024
+        logger.info(f"✅ Archivo generado: {self.artifact_dir} ({size_mb:.1f}MB)")
+        return self.artifact_dir
@@ -0,0 +1,223 @@
+"""
+Artefacto en disco de embeddings precomputados (reemplaza embeddings_precomputed.pkl).
+
+Estructura de la carpeta:
+    header.json   -> formato, modelo de embeddings, dimensión, número de vectores y dtype
+    vectors.npy   -> matriz float32 (u opcionalmente float16) N x D, se abre con mmap
+    chunks.jsonl  -> una línea por vector: {"id", "text", "metadata"} en el mismo orden
+    norms.npy     -> ||x||² de cada vector (float32), para no recalcularlas al cargar
+    offsets.npy   -> posición en bytes de cada línea de chunks.jsonl (N + 1 valores)
+
+Los vectores se cargan con np.load(mmap_mode='r'): no se copian a RAM y varios procesos
+comparten las mismas páginas del page cache. El texto y la metadata se leen solo cuando
+se piden; con offsets.npy se leen de a una línea (column), sin cargar chunks.jsonl entero.
+norms.npy y offsets.npy son opcionales (artefactos anteriores no los tienen).
+A diferencia de pickle, cargar el artefacto no ejecuta código.
+"""
+import json
+import logging
+import mmap
+import os
+import pickle
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+HEADER_FILENAME = "header.json"
+VECTORS_FILENAME = "vectors.npy"
+CHUNKS_FILENAME = "chunks.jsonl"
+NORMS_FILENAME = "norms.npy"
+OFFSETS_FILENAME = "offsets.npy"
+
+# Dimensión -> modelo, para etiquetar pickles antiguos que no guardaban el modelo
+KNOWN_DIMENSIONS = {
+    1536: "text-embedding-3-small",
+    384: "all-MiniLM-L6-v2",
+}
+
+
+class ChunkColumn(Sequence):
+    """
+    Un campo ("id", "text" o "metadata") de chunks.jsonl leído bajo demanda: cada acceso
+    decodifica solo esa línea del mmap. Ocupa lo que los offsets, no lo que el texto.
+    """
+
+    def __init__(self, data, offsets: np.ndarray, field: str):
+        self._data = data
+        self._offsets = offsets
+        self.field = field
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        line = self._data[int(self._offsets[index]):int(self._offsets[index + 1])]
+        return json.loads(line)[self.field]
+
+
+class EmbeddingArtifact:
+    """Vista perezosa (mmap) de un artefacto de embeddings"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        with open(self.directory / HEADER_FILENAME, "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        if self.header.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Formato de artefacto no soportado: {self.header.get('format_version')}")
+        self.embeddings = np.load(self.directory / VECTORS_FILENAME, mmap_mode="r")
+        norms_path = self.directory / NORMS_FILENAME
+        self.norms = np.load(norms_path, mmap_mode="r") if norms_path.exists() else None
+        offsets_path = self.directory / OFFSETS_FILENAME
+        self.offsets = np.load(offsets_path, mmap_mode="r") if offsets_path.exists() else None
+        self._chunks = None
+        self._chunk_data = None
+        self._ids = None
+
+    @property
+    def embedding_model(self) -> Optional[str]:
+        return self.header.get("embedding_model")
+
+    @property
+    def dimension(self) -> int:
+        return self.header["dimension"]
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    def _load_chunks(self) -> list:
+        if self._chunks is None:
+            with open(self.directory / CHUNKS_FILENAME, "r", encoding="utf-8") as f:
+                self._chunks = [json.loads(line) for line in f if line.strip()]
+        return self._chunks
+
+    def column(self, field: str) -> Sequence:
+        """Un campo de los chunks: perezoso (ChunkColumn) si hay offsets, si no una lista"""
+        if self.offsets is None:
+            return [chunk[field] for chunk in self._load_chunks()]
+        if self._chunk_data is None:
+            with open(self.directory / CHUNKS_FILENAME, "rb") as f:
+                # El mmap sigue válido aunque después se reemplace o borre el archivo
+                self._chunk_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if len(self) else b""
+        return ChunkColumn(self._chunk_data, self.offsets, field)
+
+    @property
+    def ids(self) -> list:
+        if self._ids is None:
+            self._ids = list(self.column("id"))
+        return self._ids
+
+    @property
+    def texts(self) -> list:
+        return [chunk["text"] for chunk in self._load_chunks()]
+
+    @property
+    def metadatas(self) -> list:
+        return [chunk["metadata"] for chunk in self._load_chunks()]
+
+    def iter_batches(self, batch_size: int = 5000):
+        """(ids, textos, metadatas, embeddings float32) en lotes, sin materializar toda la matriz"""
+        chunks = self._load_chunks()
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            yield (
+                [chunk["id"] for chunk in batch],
+                [chunk["text"] for chunk in batch],
+                [chunk["metadata"] for chunk in batch],
+                np.asarray(self.embeddings[start:start + batch_size], dtype=np.float32),
+            )
+
+
+def artifact_exists(directory: Path) -> bool:
+    return (Path(directory) / HEADER_FILENAME).exists()
+
+
+def save_embedding_artifact(directory: Path, ids: list, texts: list, metadatas: list,
+                            embeddings, embedding_model: Optional[str], dtype: str = "float32") -> Path:
+    """
+    Escribe el artefacto. Cada archivo se escribe como .tmp y se renombra;
+    header.json va al final, así un artefacto a medio escribir nunca se considera válido.
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"dtype no soportado: {dtype}")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    matrix = np.asarray(embeddings, dtype=dtype)
+    if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+        raise ValueError(f"Embeddings con forma {matrix.shape} no coinciden con {len(ids)} ids")
+
+    header_path = directory / HEADER_FILENAME
+    if header_path.exists():
+        header_path.unlink()
+
+    vectors_tmp = directory / (VECTORS_FILENAME + ".tmp")
+    with open(vectors_tmp, "wb") as f:
+        np.save(f, matrix)
+    os.replace(vectors_tmp, directory / VECTORS_FILENAME)
+
+    norms_tmp = directory / (NORMS_FILENAME + ".tmp")
+    vectors = matrix.astype(np.float32, copy=False)
+    with open(norms_tmp, "wb") as f:
+        np.save(f, np.einsum("ij,ij->i", vectors, vectors).astype(np.float32))
+    os.replace(norms_tmp, directory / NORMS_FILENAME)
+
+    chunks_tmp = directory / (CHUNKS_FILENAME + ".tmp")
+    offsets = [0]
+    with open(chunks_tmp, "wb") as f:
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            line = json.dumps({"id": chunk_id, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n"
+            f.write(line.encode("utf-8"))
+            offsets.append(f.tell())
+    os.replace(chunks_tmp, directory / CHUNKS_FILENAME)
+
+    offsets_tmp = directory / (OFFSETS_FILENAME + ".tmp")
+    with open(offsets_tmp, "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.int64))
+    os.replace(offsets_tmp, directory / OFFSETS_FILENAME)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "embedding_model": embedding_model,
+        "dimension": int(matrix.shape[1]),
+        "count": int(matrix.shape[0]),
+        "dtype": dtype,
+    }
+    header_tmp = directory / (HEADER_FILENAME + ".tmp")
+    with open(header_tmp, "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+    os.replace(header_tmp, header_path)
+    return directory
+
+
+def load_embedding_artifact(directory: Path) -> Optional[EmbeddingArtifact]:
+    if not artifact_exists(directory):
+        return None
+    return EmbeddingArtifact(directory)
+
+
+def migrate_pickle(pickle_path: Path, directory: Path, dtype: str = "float32") -> EmbeddingArtifact:
+    """
+    Convierte un embeddings_precomputed.pkl antiguo al nuevo formato y lo renombra a .pkl.bak
+    para no volver a leerlo. Solo debe usarse con pickles generados por este mismo servicio.
+    """
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    embeddings = np.asarray(data["embeddings"])
+    embedding_model = KNOWN_DIMENSIONS.get(embeddings.shape[1]) if embeddings.ndim == 2 else None
+    save_embedding_artifact(
+        directory, data["ids"], data["texts"], data["metadatas"], embeddings, embedding_model, dtype
+    )
+    os.replace(pickle_path, Path(str(pickle_path) + ".bak"))
+    logger.info(f"✅ Pickle migrado a {directory} ({len(data['ids'])} embeddings, modelo {embedding_model})")
+    return EmbeddingArtifact(directory)
@@ -0,0 +1,299 @@
+"""
+Clientes HTTP compartidos para OpenAI y Groq.
+
+Un solo pool de conexiones (httpx) por proveedor, reutilizado por embeddings y generación:
+keep-alive, límites de conexiones, HTTP/2 si está instalado `h2`, y timeouts explícitos
+por operación (conexión corta; lectura según sea un embedding de consulta, un lote de
+ingesta o una generación). Cada operación obtiene una copia liviana del cliente del SDK
+(with_options) que comparte el mismo pool. Los SDK se importan al crear el primer cliente.
+
+El transporte cuenta conexiones nuevas vs reutilizadas (con el trace de httpcore) y los
+pedidos en curso por pool; si llega uno con el pool lleno queda esperando conexión y se
+cuenta como saturación.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import httpx
+
+from src.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# h2 es opcional: sin él se usa HTTP/1.1 con keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY_SEC = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SEC", "60"))
+HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("HTTP_CONNECT_TIMEOUT_SEC", "5"))
+HTTP_WARMUP_ENABLED = os.getenv("HTTP_WARMUP_ENABLED", "true").lower() == "true"
+
+# Timeout de lectura y reintentos del SDK por operación (los defaults del SDK, 600 s y
+# 2 reintentos, dejarían colgado un pedido y demorarían el fallback)
+LLM_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+EMBEDDING_TIMEOUT_SEC = float(os.getenv("EMBEDDING_TIMEOUT_SEC", "10"))
+EMBEDDING_BATCH_TIMEOUT_SEC = float(os.getenv("EMBEDDING_BATCH_TIMEOUT_SEC", "60"))
+
+OPERATIONS = {
+    "chat": (LLM_TIMEOUT_SEC, LLM_MAX_RETRIES),
+    "embed_query": (EMBEDDING_TIMEOUT_SEC, 2),
+    # El executor de ingesta ya reintenta por lote con backoff
+    "embed_batch": (EMBEDDING_BATCH_TIMEOUT_SEC, 0),
+}
+
+CONNECTIONS = metrics.REGISTRY.counter(
+    "rag_http_requests", "Pedidos HTTP a los proveedores según usaron una conexión nueva o reutilizada",
+    ("provider", "pool", "connection"),
+)
+IN_FLIGHT = metrics.REGISTRY.gauge(
+    "rag_http_in_flight", "Pedidos HTTP en curso por pool de conexiones", ("provider", "pool")
+)
+POOL_SATURATED = metrics.REGISTRY.counter(
+    "rag_http_pool_saturated", "Pedidos que llegaron con el pool de conexiones lleno", ("provider", "pool")
+)
+
+
+class _PoolStats:
+    """Pedidos en curso de un pool; se liberan cuando se cierra la respuesta (streams incluidos)"""
+
+    def __init__(self, provider: str, pool: str, max_connections: int):
+        self.labels = {"provider": provider, "pool": pool}
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.in_flight >= self.max_connections:
+                POOL_SATURATED.inc(**self.labels)
+            self.in_flight += 1
+        IN_FLIGHT.inc(**self.labels)
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+        IN_FLIGHT.dec(**self.labels)
+
+    def count(self, new_connection: bool):
+        CONNECTIONS.inc(**self.labels, connection="new" if new_connection else "reused")
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close:
+                self._on_close, on_close = None, self._on_close
+                on_close()
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close:
+                self._on_close, on_close = None, self._on_close
+                on_close()
+
+
+def _is_connect(event_name: str) -> bool:
+    return event_name.startswith("connection.connect_tcp.") or event_name.startswith("connection.connect_unix_socket.")
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    def __init__(self, stats: _PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        new_connection = []
+        previous_trace = request.extensions.get("trace")
+
+        def trace(event_name, info):
+            if _is_connect(event_name):
+                new_connection.append(True)
+            if previous_trace:
+                previous_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        self.stats.start()
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            self.stats.finish()
+            raise
+        self.stats.count(bool(new_connection))
+        response.stream = _TrackedStream(response.stream, self.stats.finish)
+        return response
+
+
+class AsyncInstrumentedTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: _PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        new_connection = []
+        previous_trace = request.extensions.get("trace")
+
+        async def trace(event_name, info):
+            if _is_connect(event_name):
+                new_connection.append(True)
+            if previous_trace:
+                await previous_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        self.stats.start()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self.stats.finish()
+            raise
+        self.stats.count(bool(new_connection))
+        response.stream = _AsyncTrackedStream(response.stream, self.stats.finish)
+        return response
+
+
+class ClientRegistry:
+    """
+    Clientes del SDK por proveedor (openai, groq), síncronos y asíncronos, creados al primer
+    uso sobre un pool httpx compartido. client()/async_client() devuelven None si falta la API key.
+    """
+
+    API_KEYS = {"openai": "OPENAI_API_KEY", "groq": "GROQ_API_KEY"}
+
+    @staticmethod
+    def _sdk_class(provider: str, is_async: bool):
+        # Los SDK tardan ~0,5 s en importarse: no al importar este módulo
+        if provider == "openai":
+            from openai import AsyncOpenAI, OpenAI
+            return AsyncOpenAI if is_async else OpenAI
+        from groq import AsyncGroq, Groq
+        return AsyncGroq if is_async else Groq
+
+    def __init__(self):
+        self.http2 = HTTP2_ENABLED and HTTP2_AVAILABLE
+        if HTTP2_ENABLED and not HTTP2_AVAILABLE:
+            logger.info("⏭️ h2 no instalado, los proveedores se usan con HTTP/1.1 + keep-alive")
+        self._clients = {}
+        self._operation_clients = {}
+        self._http = {}
+        self._lock = threading.Lock()
+
+    def has_key(self, provider: str) -> bool:
+        return bool(os.getenv(self.API_KEYS.get(provider, "")))
+
+    def _transport_options(self) -> dict:
+        return {
+            "http2": self.http2,
+            "limits": httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SEC,
+            ),
+        }
+
+    def _base_client(self, provider: str, is_async: bool):
+        key = (provider, is_async)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        api_key = os.getenv(self.API_KEYS[provider])
+        if not api_key:
+            return None
+        with self._lock:
+            if key not in self._clients:
+                pool = "async" if is_async else "sync"
+                stats = _PoolStats(provider, pool, HTTP_MAX_CONNECTIONS)
+                if is_async:
+                    http_client = httpx.AsyncClient(
+                        transport=AsyncInstrumentedTransport(stats, **self._transport_options()),
+                        follow_redirects=True,
+                    )
+                else:
+                    http_client = httpx.Client(
+                        transport=InstrumentedTransport(stats, **self._transport_options()),
+                        follow_redirects=True,
+                    )
+                self._http[key] = http_client
+                self._clients[key] = self._sdk_class(provider, is_async)(api_key=api_key, http_client=http_client)
+            return self._clients[key]
+
+    def _with_operation(self, provider: str, is_async: bool, operation: str):
+        key = (provider, is_async, operation)
+        client = self._operation_clients.get(key)
+        if client is None:
+            base = self._base_client(provider, is_async)
+            if base is None:
+                return None
+            read_timeout, max_retries = OPERATIONS[operation]
+            client = self._operation_clients[key] = base.with_options(
+                timeout=httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT_SEC), max_retries=max_retries
+            )
+        return client
+
+    def client(self, provider: str, operation: str = "chat"):
+        return self._with_operation(provider, False, operation)
+
+    def async_client(self, provider: str, operation: str = "chat"):
+        return self._with_operation(provider, True, operation)
+
+    async def warm_up(self, providers: tuple = ("openai", "groq"), timeout: float = HTTP_CONNECT_TIMEOUT_SEC):
+        """
+        Abre de antemano una conexión (TCP + TLS) por proveedor en el pool asíncrono, para que
+        la primera pregunta no pague el handshake. La respuesta (404/401) no importa.
+        """
+        async def warm(provider: str):
+            # Crear el cliente importa el SDK (~0,5 s): en un hilo, para no frenar el event loop
+            client = await asyncio.to_thread(self._base_client, provider, True)
+            if client is None:
+                return
+            start = time.perf_counter()
+            try:
+                await self._http[(provider, True)].request("HEAD", str(client.base_url), timeout=timeout)
+                logger.info(f"🔥 Conexión con {provider} lista en {(time.perf_counter() - start) * 1000:.0f} ms")
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo precalentar la conexión con {provider}: {e}")
+
+        await asyncio.gather(*(warm(provider) for provider in providers))
+
+    async def aclose(self):
+        for (provider, is_async), http_client in list(self._http.items()):
+            try:
+                if is_async:
+                    await http_client.aclose()
+                else:
+                    http_client.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Error cerrando el cliente de {provider}: {e}")
+        self._clients, self._operation_clients, self._http = {}, {}, {}
+
+
+CLIENTS = ClientRegistry()
@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Trabajos de ingesta ejecutándose a la vez y cuántos se recuerdan para /jobs
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+
+
+@dataclass
+class IngestionJob:
+    id: str
+    kind: str
+    status: str = "queued"  # queued | running | completed | failed
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: dict = field(default_factory=dict)
+    result: Any = None
+    error: Optional[str] = None
+
+    def update_progress(self, **counters):
+        self.progress.update(counters)
+
+    def eta_sec(self) -> Optional[float]:
+        """
+        Estimación del tiempo restante: los chunks totales se extrapolan a partir de los
+        archivos ya parseados y se comparan con los chunks ya embebidos.
+        """
+        if self.status != "running" or not self.started_at:
+            return None
+        files_total = self.progress.get("files_total") or 0
+        files_parsed = self.progress.get("files_parsed") or 0
+        chunks_parsed = self.progress.get("chunks_parsed") or 0
+        chunks_embedded = self.progress.get("chunks_embedded") or 0
+        if not files_total or not files_parsed or not chunks_embedded:
+            return None
+        estimated_chunks = chunks_parsed / files_parsed * files_total
+        fraction = min(1.0, chunks_embedded / estimated_chunks) if estimated_chunks else 1.0
+        elapsed = time.time() - self.started_at
+        return round(elapsed * (1 - fraction) / fraction, 1) if fraction else None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": dict(self.progress),
+            "eta_sec": self.eta_sec(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class IngestionJobQueue:
+    """
+    Cola de trabajos de ingesta en el mismo proceso, con un pool acotado de hilos.
+    Cada trabajo recibe un callback `progress(**contadores)` para reportar su avance.
+    """
+
+    def __init__(self, max_workers: int = INGEST_JOB_WORKERS, history: int = INGEST_JOB_HISTORY):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingesta")
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.history = history
+
+    def submit(self, kind: str, fn: Callable, *args, **kwargs) -> IngestionJob:
+        job = IngestionJob(id=uuid.uuid4().hex, kind=kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: IngestionJob, fn: Callable, args: tuple, kwargs: dict):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, progress=job.update_progress, **kwargs)
+            job.status = "completed"
+        except Exception as e:
+            logger.exception(f"Trabajo de ingesta {job.id} falló")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _trim(self):
+        # Se olvidan los trabajos terminados más antiguos
+        while len(self._jobs) > self.history:
+            oldest_id = next(
+                (job_id for job_id, job in self._jobs.items() if job.status in ("completed", "failed")),
+                None,
+            )
+            if oldest_id is None:
+                break
+            self._jobs.pop(oldest_id)
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
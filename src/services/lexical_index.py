@@ -0,0 +1,239 @@
+"""
+Índice léxico BM25 en memoria, complementario a la búsqueda vectorial de ChromaDB.
+
+Los embeddings densos fallan con términos exactos (nombres de algoritmos, siglas,
+definiciones puntuales); BM25 los encuentra por coincidencia de palabras. Ambos rankings
+se combinan con Reciprocal Rank Fusion (RRF).
+
+La tokenización está pensada para español: minúsculas, sin tildes (pero conservando la ñ),
+sin stopwords. Así "búsqueda" y "busqueda" coinciden.
+"""
+import json
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Parámetros estándar de BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Constante de RRF (Cormack et al. 2009): amortigua el peso de las primeras posiciones
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9ñ]+")
+
+# Stopwords en español (ya sin tildes) y algunas en inglés frecuentes en material técnico
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bajo bien cada como con
+contra cual cuales cuando de del desde donde dos e el ella ellas ello ellos en entre era eran
+es esa esas ese eso esos esta estan estas este esto estos fue fueron ha han hasta hay la las le
+les lo los mas me mi mientras muy nada ni no nos o otra otras otro otros para pero poco por
+porque que quien se sea segun ser si sido sin sobre solo son su sus tambien tan tanto te tiene
+tienen toda todas todo todos tu un una uno unos y ya yo
+an and are as at be by for from in is it of on or that the this to was with
+""".split())
+
+
+def _strip_accents(text: str) -> str:
+    # NFD separa la tilde de la letra; se protege la ñ para no convertirla en n
+    text = text.replace("ñ", "\x00")
+    text = "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+    return text.replace("\x00", "ñ")
+
+
+def tokenize(text: str) -> list:
+    """Tokens para BM25: minúsculas, sin tildes, sin stopwords ni tokens de 1 carácter"""
+    if not text:
+        return []
+    text = _strip_accents(text.lower())
+    return [token for token in _TOKEN_RE.findall(text) if len(token) > 1 and token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 con altas y bajas incrementales.
+    La consulta solo recorre las listas de los términos de la pregunta, por eso cuesta
+    del orden de milisegundos incluso con decenas de miles de chunks.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}    # término -> {id: frecuencia}
+        self._doc_terms = {}   # id -> Counter de términos (para poder dar de baja)
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def add(self, ids: list, texts: list):
+        """Agrega (o reemplaza) documentos"""
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                self._remove(doc_id)
+                terms = Counter(tokenize(text))
+                self._doc_terms[doc_id] = terms
+                length = sum(terms.values())
+                self._doc_lengths[doc_id] = length
+                self._total_length += length
+                for term, freq in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = freq
+
+    def remove(self, ids: list):
+        with self._lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_lengths.clear()
+            self._total_length = 0
+
+    def search(self, query: str, n_results: int = 20) -> list:
+        """Devuelve [(id, score)] ordenados por score BM25 descendente"""
+        query_terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_terms)
+            if not n_docs or not query_terms:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = {}
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, freq in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:n_results]
+
+
+class FrozenBM25Index:
+    """
+    BM25 de solo lectura con las postings en arrays (formato CSR: por término, un tramo de
+    filas y frecuencias) que se guardan junto al índice y se abren con mmap. Lo usan los
+    workers del índice compartido: BM25Index guarda dicts por documento y término que ocupan
+    varias veces el texto, y cada worker tendría su copia. Los scores son los de BM25Index.
+    Las filas son las del artefacto de embeddings; ids traduce fila -> id.
+    """
+
+    VOCABULARY_FILENAME = "bm25_vocabulary.json"
+    ARRAYS = ("offsets", "rows", "freqs", "lengths")
+
+    def __init__(self, ids, vocabulary: list, offsets, rows, freqs, lengths,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.ids = ids
+        self.k1 = k1
+        self.b = b
+        self._terms = {term: index for index, term in enumerate(vocabulary)}
+        self._offsets = offsets
+        self._rows = rows
+        self._freqs = freqs
+        self._lengths = lengths
+        self._avg_length = float(np.sum(lengths, dtype=np.float64)) / len(lengths) if len(lengths) else 0.0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @classmethod
+    def from_texts(cls, ids, texts, k1: float = BM25_K1, b: float = BM25_B) -> "FrozenBM25Index":
+        postings = {}
+        lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            terms = Counter(tokenize(text))
+            lengths[row] = sum(terms.values())
+            for term, freq in terms.items():
+                postings.setdefault(term, []).append((row, freq))
+        vocabulary = sorted(postings)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        for index, term in enumerate(vocabulary):
+            offsets[index + 1] = offsets[index] + len(postings[term])
+        pairs = np.asarray([pair for term in vocabulary for pair in postings[term]], dtype=np.int32).reshape(-1, 2)
+        return cls(ids, vocabulary, offsets, np.ascontiguousarray(pairs[:, 0]),
+                   np.ascontiguousarray(pairs[:, 1]), lengths, k1, b)
+
+    def save(self, directory: Path):
+        """Escribe el índice en directory (una generación todavía sin publicar)"""
+        directory = Path(directory)
+        with open(directory / self.VOCABULARY_FILENAME, "w", encoding="utf-8") as f:
+            json.dump(sorted(self._terms, key=self._terms.get), f, ensure_ascii=False)
+        for name in self.ARRAYS:
+            np.save(directory / f"bm25_{name}.npy", getattr(self, f"_{name}"))
+
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        return (Path(directory) / cls.VOCABULARY_FILENAME).exists()
+
+    @classmethod
+    def load(cls, directory: Path, ids, k1: float = BM25_K1, b: float = BM25_B) -> "FrozenBM25Index":
+        directory = Path(directory)
+        with open(directory / cls.VOCABULARY_FILENAME, "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        arrays = {name: np.load(directory / f"bm25_{name}.npy", mmap_mode="r") for name in cls.ARRAYS}
+        return cls(ids, vocabulary, k1=k1, b=b, **arrays)
+
+    def search(self, query: str, n_results: int = 20) -> list:
+        """Devuelve [(id, score)] ordenados por score BM25 descendente"""
+        n_docs = len(self._lengths)
+        query_terms = set(tokenize(query))
+        if not n_docs or not query_terms:
+            return []
+        matched_rows, matched_scores = [], []
+        for term in query_terms:
+            index = self._terms.get(term)
+            if index is None:
+                continue
+            start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+            rows = np.asarray(self._rows[start:end])
+            freqs = np.asarray(self._freqs[start:end], dtype=np.float64)
+            idf = math.log(1 + (n_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[rows] / self._avg_length)
+            matched_rows.append(rows)
+            matched_scores.append(idf * freqs * (self.k1 + 1) / (freqs + norm))
+        if not matched_rows:
+            return []
+        rows, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+        k = min(n_results, len(rows))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """
+    Combina varias listas de ids ordenadas por relevancia: score(id) = sum 1 / (k + rank).
+    Devuelve [(id, score)] ordenados de mayor a menor.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,230 @@
+"""
+Control de admisión de llamadas al LLM por proveedor.
+
+Groq y OpenAI limitan pedidos por minuto (RPM) y tokens por minuto (TPM). Cada proveedor
+tiene dos token buckets (pedidos y tokens) que se recargan a su límite por segundo; una
+llamada reserva 1 pedido y sus tokens estimados (prompt + max_tokens) antes de salir y,
+al terminar, devuelve lo que no usó según el usage real.
+
+Si el bucket no alcanza, la llamada espera en una cola FIFO acotada (LLM_QUEUE_MAX por
+proveedor) como máximo LLM_QUEUE_MAX_WAIT_SEC. Con la cola llena, o si la espera superaría
+ese plazo, se rechaza enseguida con ProviderOverloaded (la API responde 503 + Retry-After):
+así el proveedor recibe a lo sumo su límite en lugar de una avalancha de 429 y reintentos.
+
+Un 429 del proveedor vacía sus buckets por el Retry-After que informe.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+
+from src.services import metrics
+from src.services.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Límites por proveedor (0 = sin límite); conviene fijarlos algo por debajo de los de la cuenta
+LLM_RATE_LIMITS = {
+    "groq": (int(os.getenv("LLM_RPM_GROQ", "0")), int(os.getenv("LLM_TPM_GROQ", "0"))),
+    "openai": (int(os.getenv("LLM_RPM_OPENAI", "0")), int(os.getenv("LLM_TPM_OPENAI", "0"))),
+}
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "64"))
+LLM_QUEUE_MAX_WAIT_SEC = float(os.getenv("LLM_QUEUE_MAX_WAIT_SEC", "10"))
+
+QUEUE_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    "rag_llm_queue_wait_seconds", "Espera en la cola de admisión antes de llamar al LLM", ("provider",)
+)
+SHED = metrics.REGISTRY.counter(
+    "rag_llm_shed", "Llamadas al LLM rechazadas por sobrecarga (cola llena o espera excesiva)", ("provider", "reason")
+)
+
+
+class ProviderOverloaded(Exception):
+    """El proveedor está al límite: reintentar en retry_after segundos"""
+
+    def __init__(self, provider: str, retry_after: float, reason: str):
+        self.provider = provider
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+        super().__init__(f"{provider} sobrecargado ({reason}), reintentar en {self.retry_after}s")
+
+
+class TokenBucket:
+    """Bucket de capacidad `capacity` que se recarga a `rate` unidades por segundo (rate 0 = sin límite)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Segundos hasta que haya `amount` disponibles (0 si ya hay)"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        # Un pedido mayor que la capacidad se admite con el bucket lleno (quedará en negativo)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float):
+        if self.rate:
+            self.level -= amount
+
+    def give_back(self, amount: float):
+        if self.rate:
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, seconds: float, now: float):
+        """Deja el bucket vacío durante `seconds` (tras un 429 del proveedor)"""
+        if self.rate:
+            self._refill(now)
+            self.level = min(self.level, -seconds * self.rate)
+
+
+class ProviderLane:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm / 60, rpm)
+        self.tokens = TokenBucket(tpm / 60, tpm)
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.requests.rate or self.tokens.rate)
+
+    def try_reserve(self, tokens: int) -> float:
+        """Reserva si hay lugar (devuelve 0) o devuelve los segundos a esperar sin reservar"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait == 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+            return wait
+
+    def estimated_wait(self, tokens: int) -> float:
+        """Espera aproximada de un pedido nuevo con la cola actual"""
+        ahead = self.waiting + 1
+        return max(
+            ahead / self.requests.rate if self.requests.rate else 0.0,
+            ahead * tokens / self.tokens.rate if self.tokens.rate else 0.0,
+        )
+
+
+class LLMScheduler:
+    def __init__(self, limits: dict = None, max_queue: int = LLM_QUEUE_MAX, max_wait: float = LLM_QUEUE_MAX_WAIT_SEC):
+        limits = limits or LLM_RATE_LIMITS
+        self.lanes = {provider: ProviderLane(rpm, tpm) for provider, (rpm, tpm) in limits.items()}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        # Un asyncio.Lock por proveedor mantiene el orden FIFO; pertenece al event loop
+        self._fifo = {}
+        self._fifo_loop = None
+
+    @staticmethod
+    def estimate_tokens(kwargs: dict) -> int:
+        """Tokens que puede consumir la llamada: los del prompt más max_tokens"""
+        prompt = sum(count_tokens(message.get("content") or "") for message in kwargs.get("messages", ()))
+        return prompt + int(kwargs.get("max_tokens") or 0)
+
+    def _fifo_lock(self, provider: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._fifo_loop is not loop:
+            self._fifo = {}
+            self._fifo_loop = loop
+        if provider not in self._fifo:
+            self._fifo[provider] = asyncio.Lock()
+        return self._fifo[provider]
+
+    def _shed(self, provider: str, lane: ProviderLane, tokens: int, reason: str, retry_after: float = None):
+        SHED.inc(provider=provider, reason=reason)
+        raise ProviderOverloaded(provider, retry_after if retry_after is not None else lane.estimated_wait(tokens), reason)
+
+    async def acquire(self, provider: str, tokens: int) -> int:
+        """Espera su turno y reserva capacidad; devuelve los tokens reservados (para release)"""
+        lane = self.lanes.get(provider)
+        if lane is None or not lane.limited:
+            return 0
+        # Sin nadie esperando y con lugar en los buckets sale enseguida
+        if lane.waiting == 0 and lane.try_reserve(tokens) == 0:
+            QUEUE_WAIT_SECONDS.observe(0.0, provider=provider)
+            return tokens
+        if lane.waiting >= self.max_queue:
+            self._shed(provider, lane, tokens, "queue_full")
+        # Si con la cola actual no llegaría a tiempo se rechaza ya, sin ocupar un lugar
+        if lane.estimated_wait(tokens) > self.max_wait:
+            self._shed(provider, lane, tokens, "deadline")
+
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        lane.waiting += 1
+        try:
+            try:
+                await asyncio.wait_for(self._fifo_lock(provider).acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self._shed(provider, lane, tokens, "timeout")
+            try:
+                while True:
+                    wait = lane.try_reserve(tokens)
+                    if wait == 0:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        self._shed(provider, lane, tokens, "timeout", wait)
+                    await asyncio.sleep(wait)
+            finally:
+                self._fifo_lock(provider).release()
+        finally:
+            lane.waiting -= 1
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - start, provider=provider)
+        return tokens
+
+    def acquire_sync(self, provider: str, tokens: int) -> int:
+        """acquire para el camino síncrono (sin cola FIFO: solo espera hasta el plazo)"""
+        lane = self.lanes.get(provider)
+        if lane is None or not lane.limited:
+            return 0
+        start = time.monotonic()
+        while True:
+            wait = lane.try_reserve(tokens)
+            if wait == 0:
+                break
+            if time.monotonic() + wait > start + self.max_wait:
+                self._shed(provider, lane, tokens, "timeout", wait)
+            time.sleep(wait)
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - start, provider=provider)
+        return tokens
+
+    def release(self, provider: str, reserved: int, used_tokens: int = None):
+        """Devuelve al bucket los tokens reservados que la llamada no usó"""
+        lane = self.lanes.get(provider)
+        if lane is None or not reserved or used_tokens is None:
+            return
+        with lane._lock:
+            lane.tokens.give_back(max(0, reserved - used_tokens))
+
+    def penalize(self, provider: str, retry_after: float):
+        """El proveedor respondió 429: no admitir más llamadas durante retry_after segundos"""
+        lane = self.lanes.get(provider)
+        if lane is None:
+            return
+        with lane._lock:
+            now = time.monotonic()
+            lane.requests.drain(retry_after, now)
+            lane.tokens.drain(retry_after, now)
+
+    def status(self) -> dict:
+        return {
+            provider: {
+                "rpm": round(lane.requests.rate * 60),
+                "tpm": round(lane.tokens.rate * 60),
+                "queued": lane.waiting,
+            }
+            for provider, lane in self.lanes.items()
+        }
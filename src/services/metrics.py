@@ -0,0 +1,238 @@
+"""
+Instrumentación de baja sobrecarga: contadores e histogramas en memoria expuestos en
+formato de texto de Prometheus (/metrics), spans de tiempo por etapa y un request ID por
+pedido (contextvar) que se agrega a cada línea de log.
+
+No depende de prometheus_client: un histograma es un arreglo de contadores por bucket
+protegido por un lock, así observar un valor cuesta del orden de un microsegundo.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Buckets de latencia (segundos): de milisegundos (búsqueda local) a decenas de segundos (LLM)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Request ID del pedido en curso; asyncio.to_thread y las tareas copian el contexto
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            for key, value in items:
+                lines.extend(self._render_sample(dict(zip(self.labelnames, key)), value))
+        return lines
+
+    def _render_sample(self, labels: dict, value) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_sample(self, labels: dict, value) -> list:
+        return [f"{self.name}_total{_format_labels(labels)} {_format_value(value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_sample(self, labels: dict, value) -> list:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [conteo por bucket (el último es +Inf), suma, cantidad]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _render_sample(self, labels: dict, value) -> list:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            bucket_labels = {**labels, "le": _format_value(bound)}
+            lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus (text/plain; version=0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_http_request_duration_seconds", "Duración de los pedidos HTTP hasta la respuesta",
+    ("method", "route", "status"),
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_duration_seconds",
+    "Duración de cada etapa de una pregunta (embed_query, search, prompt_build, llm_ttft, llm_generation, total)",
+    ("stage", "provider"),
+)
+ANSWER_CACHE_HITS = REGISTRY.counter("rag_answer_cache_hits", "Preguntas respondidas desde la caché de respuestas")
+LLM_ERRORS = REGISTRY.counter("rag_llm_errors", "Llamadas al LLM que fallaron", ("provider",))
+INGEST_PDFS = REGISTRY.counter("rag_ingest_pdfs", "PDFs procesados en la ingesta", ("outcome",))
+INGEST_PAGES = REGISTRY.counter("rag_ingest_pages", "Páginas de PDF procesadas en la ingesta")
+INGEST_CHUNKS = REGISTRY.counter("rag_ingest_chunks", "Chunks agregados al índice")
+DELETED_CHUNKS = REGISTRY.counter("rag_deleted_chunks", "Chunks eliminados del índice (archivos modificados o borrados)")
+
+
+@contextmanager
+def span(stage: str, provider: str = ""):
+    """Mide una etapa: la observa en rag_stage_duration_seconds y la deja en el log (DEBUG)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage, provider=provider)
+        logger.debug(f"⏱️ {stage}: {elapsed * 1000:.1f} ms")
+
+
+def observe_stage(stage: str, seconds: float, provider: str = ""):
+    """Para etapas medidas a mano (p.ej. el primer token de un stream)"""
+    STAGE_SECONDS.observe(seconds, stage=stage, provider=provider)
+
+
+class RequestIdFilter(logging.Filter):
+    """Agrega record.request_id (el del pedido en curso, o '-') a cada registro"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+def configure_logging(level: str = "INFO"):
+    """Logging a stderr con el request ID en cada línea"""
+    logging.basicConfig(
+        level=getattr(logging, level.upper(), logging.INFO),
+        format="%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s",
+    )
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+    # Una línea por llamada HTTP a OpenAI/Groq sería I/O en el camino crítico
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
@@ -1,32 +1,398 @@
-from openai import OpenAI
+import asyncio
+import logging
 import os
-from groq import Groq
+import threading
+import time
+from collections import deque
+
+from src.services import metrics
+from src.services.http_clients import CLIENTS
+from src.services.llm_scheduler import LLMScheduler, ProviderOverloaded
+
+logger = logging.getLogger(__name__)
+
+# Si el proveedor pedido falla (o su circuito está abierto) se usa el otro
+LLM_FALLBACK_ENABLED = os.getenv("LLM_FALLBACK_ENABLED", "true").lower() == "true"
+# Hedging: si el primario no respondió en su p95 observado se lanza la misma pregunta al otro
+# proveedor y gana el primero que termine (cuesta una llamada extra en ~5% de los pedidos)
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Circuit breaker: se abre tras N fallos seguidos y deja pasar una prueba cada CIRCUIT_RESET_SEC
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SEC = float(os.getenv("CIRCUIT_RESET_SEC", "30"))
+
+PROVIDERS = ("groq", "openai")
+
+FALLBACKS = metrics.REGISTRY.counter(
+    "rag_llm_fallbacks", "Respuestas generadas por el otro proveedor tras un fallo", ("from_provider", "to_provider")
+)
+HEDGES = metrics.REGISTRY.counter(
+    "rag_llm_hedges", "Pedidos duplicados al otro proveedor por superar el p95 y quién ganó", ("provider", "winner")
+)
+CIRCUIT_OPENED = metrics.REGISTRY.counter("rag_circuit_opened", "Aperturas del circuit breaker", ("provider",))
+
+
+class CircuitOpenError(Exception):
+    """El circuito del proveedor está abierto: no se le envían pedidos por ahora"""
+
+
+class CircuitBreaker:
+    """
+    closed: pasan todos los pedidos. Tras failure_threshold fallos seguidos pasa a open y
+    rechaza pedidos durante reset_sec; luego half_open deja pasar un único pedido de prueba:
+    si sale bien vuelve a closed, si falla vuelve a open.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_sec: float = CIRCUIT_RESET_SEC):
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_sec:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Registra un fallo; True si el circuito se acaba de abrir"""
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def release(self):
+        """Un pedido cancelado (p.ej. el perdedor de un hedge) no cuenta como éxito ni fallo"""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class ProviderHealth:
+    """Circuit breaker y latencias recientes (por tipo de pedido) de un proveedor"""
 
-class ModelClientFactory:
     def __init__(self):
-        self.groq_api_key = os.getenv("GROQ_API_KEY")
-        self.openai_api_key = os.getenv("OPENAI_API_KEY")
+        self.breaker = CircuitBreaker()
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+        self._latencies = {}
+        self._lock = threading.Lock()
 
-        if self.groq_api_key:
-            self.groq_client = Groq(api_key=self.groq_api_key)
-        else:
-            self.groq_client = None
+    def observe(self, key: str, seconds: float):
+        with self._lock:
+            self.successes += 1
+            self._latencies.setdefault(key, deque(maxlen=LLM_LATENCY_WINDOW)).append(seconds)
 
-        if self.openai_api_key:
-            self.openai_client = OpenAI(api_key=self.openai_api_key)
-        else:
-            self.openai_client = None
+    def quantile(self, key: str, q: float, min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        """Cuantil q de las latencias recientes; None si hay menos de min_samples"""
+        with self._lock:
+            window = sorted(self._latencies.get(key, ()))
+        if len(window) < min_samples:
+            return None
+        return window[min(len(window) - 1, int(q * len(window)))]
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class ModelClientFactory:
+    def __init__(self, clients=CLIENTS):
+        # Clientes con el timeout de generación sobre los pools compartidos con los embeddings;
+        # se crean al primer uso (crear la factory no importa los SDK)
+        self.clients = clients
+
+        self.fallback_enabled = LLM_FALLBACK_ENABLED
+        self.hedging_enabled = LLM_HEDGING_ENABLED
+        self.health = {provider: ProviderHealth() for provider in PROVIDERS}
+        # Admisión por proveedor (RPM/TPM) delante de cada llamada
+        self.scheduler = LLMScheduler()
 
     def get_client(self, provider: str):
         if provider == "groq":
-            if not self.groq_client:
+            client = self.clients.client("groq", "chat")
+            if not client:
                 raise Exception("Groq API key no configurada")
-            return self.groq_client
+            return client
 
         elif provider == "openai":
-            if not self.openai_client:
+            client = self.clients.client("openai", "chat")
+            if not client:
                 raise Exception("OpenAI API key no configurada")
-            return self.openai_client
+            return client
 
         else:
             raise Exception(f"Proveedor no soportado: {provider}")
+
+    def get_async_client(self, provider: str):
+        """Versión asíncrona de get_client (AsyncGroq / AsyncOpenAI)"""
+        if provider == "groq":
+            client = self.clients.async_client("groq", "chat")
+            if not client:
+                raise Exception("Groq API key no configurada")
+            return client
+
+        elif provider == "openai":
+            client = self.clients.async_client("openai", "chat")
+            if not client:
+                raise Exception("OpenAI API key no configurada")
+            return client
+
+        else:
+            raise Exception(f"Proveedor no soportado: {provider}")
+
+    def is_configured(self, provider: str) -> bool:
+        return self.clients.has_key(provider)
+
+    def route(self, provider: str) -> list:
+        """Proveedores a intentar en orden: el pedido y, con fallback, el otro (solo los configurados)"""
+        provider = "openai" if provider == "openai" else "groq"
+        candidates = [provider]
+        if self.fallback_enabled:
+            candidates += [other for other in PROVIDERS if other != provider]
+        return [candidate for candidate in candidates if self.is_configured(candidate)]
+
+    def status(self) -> dict:
+        """Estado de cada proveedor: configurado, circuito, contadores y cola de admisión"""
+        scheduler = self.scheduler.status()
+        return {
+            provider: {"configured": self.is_configured(provider), **health.to_dict(), **scheduler.get(provider, {})}
+            for provider, health in self.health.items()
+        }
+
+    def _record_success(self, provider: str, latency_key: str, seconds: float):
+        health = self.health[provider]
+        health.breaker.record_success()
+        health.observe(latency_key, seconds)
+
+    def _record_failure(self, provider: str, error: Exception):
+        health = self.health[provider]
+        health.failures += 1
+        health.last_error = str(error)[:200]
+        if getattr(error, "status_code", None) == 429:
+            # Límite de la cuenta, no una caída: se frenan las admisiones en vez de abrir el circuito
+            headers = getattr(getattr(error, "response", None), "headers", None) or {}
+            try:
+                retry_after = float(headers.get("retry-after", 1))
+            except ValueError:
+                retry_after = 1.0
+            self.scheduler.penalize(provider, retry_after)
+            health.breaker.release()
+            return
+        if health.breaker.record_failure():
+            CIRCUIT_OPENED.inc(provider=provider)
+            logger.warning(f"🔌 Circuito de {provider} abierto por {CIRCUIT_RESET_SEC:.0f}s: {error}")
+
+    def _record_fallback(self, requested: str, used: str):
+        if used != requested:
+            FALLBACKS.inc(from_provider=requested, to_provider=used)
+            logger.warning(f"↪️ Respuesta generada con {used} en lugar de {requested}")
+
+    def complete(self, provider: str, kwargs_for, latency_key: str = ""):
+        """
+        chat.completions.create con fallback entre proveedores (cliente síncrono).
+        kwargs_for(proveedor) arma los argumentos (el modelo depende del proveedor).
+        Devuelve (chat_completion, proveedor_usado).
+        Si todos los candidatos están al límite de su cuota lanza ProviderOverloaded.
+        """
+        last_error = overloaded = None
+        for candidate in self.route(provider):
+            if not self.health[candidate].breaker.allow():
+                last_error = last_error or CircuitOpenError(f"Circuito de {candidate} abierto")
+                continue
+            kwargs = kwargs_for(candidate)
+            try:
+                reserved = self.scheduler.acquire_sync(candidate, self.scheduler.estimate_tokens(kwargs))
+            except ProviderOverloaded as e:
+                self.health[candidate].breaker.release()
+                overloaded = e
+                continue
+            start = time.perf_counter()
+            try:
+                completion = self.get_client(candidate).chat.completions.create(**kwargs)
+            except Exception as e:
+                self._record_failure(candidate, e)
+                last_error = e
+                continue
+            self._record_success(candidate, latency_key, time.perf_counter() - start)
+            self.scheduler.release(candidate, reserved, getattr(getattr(completion, "usage", None), "total_tokens", None))
+            self._record_fallback(provider, candidate)
+            return completion, candidate
+        raise overloaded or last_error or Exception(f"Proveedor no configurado: {provider}")
+
+    async def _acall(self, provider: str, kwargs_for, latency_key: str):
+        kwargs = kwargs_for(provider)
+        try:
+            reserved = await self.scheduler.acquire(provider, self.scheduler.estimate_tokens(kwargs))
+        except BaseException:
+            # ProviderOverloaded o cancelación mientras esperaba turno: no cuenta para el circuito
+            self.health[provider].breaker.release()
+            raise
+        start = time.perf_counter()
+        try:
+            completion = await self.get_async_client(provider).chat.completions.create(**kwargs)
+        except asyncio.CancelledError:
+            self.health[provider].breaker.release()
+            raise
+        except Exception as e:
+            self._record_failure(provider, e)
+            raise
+        self._record_success(provider, latency_key, time.perf_counter() - start)
+        self.scheduler.release(provider, reserved, getattr(getattr(completion, "usage", None), "total_tokens", None))
+        return completion
+
+    async def _acomplete_sequential(self, requested: str, candidates: list, kwargs_for, latency_key: str,
+                                    last_error: Exception = None):
+        overloaded = last_error if isinstance(last_error, ProviderOverloaded) else None
+        for candidate in candidates:
+            if not self.health[candidate].breaker.allow():
+                last_error = last_error or CircuitOpenError(f"Circuito de {candidate} abierto")
+                continue
+            try:
+                completion = await self._acall(candidate, kwargs_for, latency_key)
+            except ProviderOverloaded as e:
+                overloaded = e
+                continue
+            except Exception as e:
+                last_error = e
+                continue
+            self._record_fallback(requested, candidate)
+            return completion, candidate
+        raise overloaded or last_error or Exception(f"Proveedor no configurado: {requested}")
+
+    async def acomplete(self, provider: str, kwargs_for, latency_key: str = ""):
+        """
+        Versión asíncrona de complete. Con hedging, si el proveedor pedido no respondió
+        en su p95 observado (para latency_key) se lanza la misma llamada al otro y se usa
+        la primera que termine bien; la otra se cancela.
+        """
+        candidates = self.route(provider)
+        if not candidates:
+            raise Exception(f"Proveedor no configurado: {provider}")
+        primary = candidates[0]
+        delay = self.health[primary].quantile(latency_key, LLM_HEDGE_QUANTILE) if self.hedging_enabled else None
+        if len(candidates) < 2 or delay is None or primary != provider:
+            return await self._acomplete_sequential(provider, candidates, kwargs_for, latency_key)
+
+        if not self.health[primary].breaker.allow():
+            return await self._acomplete_sequential(
+                provider, candidates[1:], kwargs_for, latency_key, CircuitOpenError(f"Circuito de {primary} abierto")
+            )
+        primary_task = asyncio.create_task(self._acall(primary, kwargs_for, latency_key))
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        except asyncio.CancelledError:
+            # asyncio.wait no cancela lo que espera: sin esto la llamada al proveedor seguiría sola
+            primary_task.cancel()
+            raise
+        if done:
+            if primary_task.exception() is None:
+                return primary_task.result(), primary
+            return await self._acomplete_sequential(
+                provider, candidates[1:], kwargs_for, latency_key, primary_task.exception()
+            )
+
+        backup = candidates[1]
+        # El hedge no espera en cola: solo se lanza si el otro proveedor tiene cuota libre ya
+        if not self.health[backup].breaker.allow():
+            return await primary_task, primary
+        if self.scheduler.lanes[backup].waiting:
+            self.health[backup].breaker.release()
+            return await primary_task, primary
+        backup_task = asyncio.create_task(self._acall(backup, kwargs_for, latency_key))
+        tasks = {primary_task: primary, backup_task: backup}
+        pending = set(tasks)
+        last_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        HEDGES.inc(provider=primary, winner="primary" if winner == primary else "backup")
+                        return task.result(), winner
+                    # Si el backup quedó sin cuota se sigue esperando al primario
+                    if last_error is None or not isinstance(task.exception(), ProviderOverloaded):
+                        last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, provider: str, kwargs_for):
+        """
+        Abre un stream (stream=True) con fallback: solo se cambia de proveedor si falla antes
+        del primer chunk; un stream ya iniciado no se puede continuar con otro modelo.
+        Devuelve (stream, proveedor_usado).
+        """
+        last_error = overloaded = None
+        for candidate in self.route(provider):
+            if not self.health[candidate].breaker.allow():
+                last_error = last_error or CircuitOpenError(f"Circuito de {candidate} abierto")
+                continue
+            kwargs = kwargs_for(candidate)
+            try:
+                reserved = await self.scheduler.acquire(candidate, self.scheduler.estimate_tokens(kwargs))
+            except BaseException as e:
+                self.health[candidate].breaker.release()
+                if not isinstance(e, ProviderOverloaded):
+                    raise
+                overloaded = e
+                continue
+            try:
+                stream = await self.get_async_client(candidate).chat.completions.create(stream=True, **kwargs)
+            except asyncio.CancelledError:
+                # El cliente se desconectó: no cuenta para el circuito (y libera la prueba de half_open)
+                self.health[candidate].breaker.release()
+                raise
+            except Exception as e:
+                self._record_failure(candidate, e)
+                last_error = e
+                continue
+            self.health[candidate].breaker.record_success()
+            self._record_fallback(provider, candidate)
+            return self._metered(candidate, stream, reserved), candidate
+        raise overloaded or last_error or Exception(f"Proveedor no configurado: {provider}")
+
+    async def _metered(self, provider: str, stream, reserved: int):
+        """
+        Itera el stream y, al terminar, devuelve al scheduler los tokens reservados sin usar.
+        Un error a mitad del stream cuenta como fallo del proveedor (una cancelación no).
+        """
+        usage = None
+        try:
+            async for chunk in stream:
+                # OpenAI envía el uso en el último chunk; Groq en chunk.x_groq.usage
+                usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                yield chunk
+        except Exception as e:
+            self._record_failure(provider, e)
+            raise
+        finally:
+            self.scheduler.release(provider, reserved, getattr(usage, "total_tokens", None))
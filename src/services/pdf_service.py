@@ -1,9 +1,20 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+# Procesos que parsean y dividen PDFs en paralelo durante la ingesta
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
 
 def process_pdf_with_langchain(pdf_path: Path, chunk_size: int = 500, chunk_overlap: int = 100):
     """Carga un PDF y lo divide en chunks"""
+    # LangChain tarda ~0,5 s en importarse: solo se carga al ingerir (no al arrancar la API)
+    from langchain_community.document_loaders import PyMuPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     loader = PyMuPDFLoader(str(pdf_path))
     documents = loader.load()
     
@@ -25,18 +36,111 @@ def process_all_pdfs(folder_path: Path):
         all_chunks.extend(chunks)
     return all_chunks
 
-def prepare_docs_for_chroma(chunks):
+def file_hash(path: Path) -> str:
+    """Hash MD5 del contenido del archivo (leído por bloques)"""
+    hasher = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _source_hash(source: str) -> str:
+    path = Path(source)
+    if path.is_file():
+        return file_hash(path)
+    return hashlib.md5(source.encode("utf-8")).hexdigest()
+
+def prepare_docs_for_chroma(chunks, source_hash: str = None):
+    """
+    Convierte chunks de LangChain en docs para ChromaDB.
+    El ID de cada chunk se deriva del nombre del archivo + su hash + página + contenido,
+    así es estable entre ejecuciones y no colisiona entre archivos ni entre subidas.
+    El nombre (la ruta relativa a la carpeta de datos, que es plana) evita que dos PDFs
+    idénticos con nombres distintos compartan IDs: si no, uno pisaría los chunks del otro
+    y borrar uno dejaría al otro sin chunks.
+    """
     docs = []
-    for i, chunk in enumerate(chunks):
+    hashes = {}
+    seen = {}
+    for chunk in chunks:
+        source = chunk.metadata.get('source','unknown')
+        page = chunk.metadata.get('page', -1)
+        doc_hash = source_hash or hashes.setdefault(source, _source_hash(source))
+        name = Path(source).name
+        base_id = hashlib.sha1(f"{name}\x00{doc_hash}\x00{page}\x00{chunk.page_content}".encode("utf-8")).hexdigest()
+        # Mismo texto repetido en la misma página: se numera la repetición
+        occurrence = seen.get(base_id, 0)
+        seen[base_id] = occurrence + 1
+        chunk_id = base_id if occurrence == 0 else f"{base_id}-{occurrence}"
         docs.append({
-            'id': f"chunk_{i}",
+            'id': chunk_id,
             'text': chunk.page_content,
             'metadata': {
-                'source': chunk.metadata.get('source','unknown'),
-                'page': chunk.metadata.get('page', -1),
-                'chunk_id': f"chunk_{i}"
+                'source': source,
+                'page': page,
+                'chunk_id': chunk_id,
+                'file_hash': doc_hash
             }
         })
     return docs
 
-    
+def load_pdf_docs(pdf_path: Path, source_hash: str = None, chunk_size: int = 500, chunk_overlap: int = 100) -> dict:
+    """
+    Carga, divide y prepara un PDF para ChromaDB (se ejecuta dentro del pool de procesos).
+    Devuelve {"path", "hash", "pages", "docs"}.
+    """
+    source_hash = source_hash or file_hash(pdf_path)
+    chunks = process_pdf_with_langchain(pdf_path, chunk_size, chunk_overlap)
+    pages = chunks[0].metadata.get('total_pages') if chunks else 0
+    if not pages:
+        pages = len({chunk.metadata.get('page') for chunk in chunks})
+    return {
+        "path": str(pdf_path),
+        "hash": source_hash,
+        "pages": pages,
+        "docs": prepare_docs_for_chroma(chunks, source_hash),
+    }
+
+def iter_pdf_docs(pdf_paths, workers: int = INGEST_WORKERS, hashes: dict = None,
+                  chunk_size: int = 500, chunk_overlap: int = 100):
+    """
+    Genera el resultado de load_pdf_docs de cada PDF a medida que termina.
+    Con workers > 1 usa un pool de procesos con como máximo 2*workers PDFs en vuelo,
+    así la memoria no crece con el tamaño del corpus.
+    Un PDF que falla no detiene la ingesta: se devuelve {"path", "error"}.
+    """
+    hashes = hashes or {}
+    pdf_paths = list(pdf_paths)
+
+    if workers <= 1 or len(pdf_paths) <= 1:
+        for pdf_path in pdf_paths:
+            try:
+                yield load_pdf_docs(pdf_path, hashes.get(str(pdf_path)), chunk_size, chunk_overlap)
+            except Exception as e:
+                logger.error(f"Error procesando {pdf_path}: {e}")
+                yield {"path": str(pdf_path), "error": str(e)}
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        remaining = iter(pdf_paths)
+        pending = {}
+
+        def submit_next():
+            pdf_path = next(remaining, None)
+            if pdf_path is not None:
+                future = pool.submit(load_pdf_docs, pdf_path, hashes.get(str(pdf_path)), chunk_size, chunk_overlap)
+                pending[future] = pdf_path
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_path = pending.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    logger.error(f"Error procesando {pdf_path}: {e}")
+                    yield {"path": str(pdf_path), "error": str(e)}
+                submit_next()
@@ -0,0 +1,60 @@
+"""
+Precios de los modelos LLM (USD por millón de tokens) y cálculo del costo de una respuesta
+a partir de los tokens de prompt y de completion que informa la API.
+"""
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# USD por 1M de tokens: (prompt, completion). Precios públicos de OpenAI y Groq.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+}
+
+# Proveedor de cada modelo (para la tabla de precios de /usage)
+MODEL_PROVIDERS = {
+    "gpt-4o": "openai",
+    "gpt-4o-mini": "openai",
+    "llama-3.1-8b-instant": "groq",
+    "llama-3.3-70b-versatile": "groq",
+}
+
+# Tarifas propias sin tocar el código: MODEL_PRICES_JSON='{"gpt-4o": [2.5, 10.0]}'
+if os.getenv("MODEL_PRICES_JSON"):
+    try:
+        MODEL_PRICES.update({
+            model: (float(prices[0]), float(prices[1]))
+            for model, prices in json.loads(os.getenv("MODEL_PRICES_JSON")).items()
+        })
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        logger.warning(f"⚠️ MODEL_PRICES_JSON inválido, se usan los precios por defecto: {e}")
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int):
+    """Costo en USD de una llamada; None si el modelo no tiene precio o faltan tokens"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        logger.warning(f"⚠️ Modelo sin precio configurado: {model}")
+        return None
+    if prompt_tokens is None or completion_tokens is None:
+        return None
+    prompt_price, completion_price = prices
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def price_table() -> list:
+    """Precios vigentes por proveedor y modelo (USD por 1M de tokens)"""
+    return [
+        {
+            "provider": MODEL_PROVIDERS.get(model),
+            "model": model,
+            "prompt_usd_per_1m": prompt_price,
+            "completion_usd_per_1m": completion_price,
+        }
+        for model, (prompt_price, completion_price) in MODEL_PRICES.items()
+    ]
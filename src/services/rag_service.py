@@ -1,77 +1,719 @@
+import asyncio
 import hashlib
+import json
+import logging
+import re
+import threading
 from pathlib import Path
 import time
-from src.services.pdf_service import prepare_docs_for_chroma, process_all_pdfs
-from groq import Groq
+from src.services.pdf_service import file_hash, iter_pdf_docs, load_pdf_docs
 import os
+from src.services.answer_cache import AnswerCache
 from src.services.embedding_service_chroma import EmbeddingServiceChroma
+from src.services import metrics
+from src.services.metrics import observe_stage, span
+from src.services.llm_scheduler import ProviderOverloaded
 from src.services.modelClientFactory import ModelClientFactory
+from src.services.pricing import estimate_cost
+from src.services.reranking import rerank_results
+from src.services.shared_index import INDEX_POLL_SEC
+from src.services.single_flight import SingleFlight, coalesce_key
+from src.services.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Carpeta del registro de archivos indexados (file_registry.json)
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "./vector_store")
+
+# Chunks por lote de embeddings durante la ingesta (cada lote se escribe al índice al terminar)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+
+# /upload_pdf: el artefacto de embeddings se reescribe una vez por ventana, no en cada subida
+# (las subidas que llegan mientras tanto se guardan juntas; 0 = guardar en cada subida)
+ARTIFACT_SAVE_DELAY_SEC = float(os.getenv("ARTIFACT_SAVE_DELAY_SEC", "30"))
+
+# Máximo de preguntas procesándose a la vez en el camino asíncrono
+MAX_CONCURRENT_QUESTIONS = int(os.getenv("MAX_CONCURRENT_QUESTIONS", "16"))
+
+# /questions/batch: generaciones simultáneas por proveedor
+BATCH_CONCURRENCY_OPENAI = int(os.getenv("BATCH_CONCURRENCY_OPENAI", "8"))
+BATCH_CONCURRENCY_GROQ = int(os.getenv("BATCH_CONCURRENCY_GROQ", "4"))
+
+# Caché semántica de respuestas
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL_SEC = float(os.getenv("ANSWER_CACHE_TTL_SEC", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Re-ranking antes del prompt: MMR sobre top_k * RERANK_FETCH_FACTOR candidatos
+# y fusión de chunks solapados de la misma página
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_FETCH_FACTOR = int(os.getenv("RERANK_FETCH_FACTOR", "3"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# Preguntas idénticas (normalizadas, mismo modo, proveedor y top_k) en curso a la vez
+# comparten un solo embedding, búsqueda y generación
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# Modos de respuesta que entiende build_prompts
+RESPONSE_MODES = ("breve", "detallada")
+
+# Modelo LLM de cada proveedor
+LLM_MODELS = {
+    "openai": "gpt-4o",
+    "groq": "llama-3.1-8b-instant",
+}
+
+# Presupuesto de tokens del contexto por modelo y modo (CONTEXT_TOKEN_BUDGET lo fija para todos)
+CONTEXT_TOKEN_BUDGETS = {
+    "gpt-4o": {"breve": 1500, "detallada": 4000},
+    "llama-3.1-8b-instant": {"breve": 1200, "detallada": 3000},
+}
+CONTEXT_TOKEN_BUDGET = os.getenv("CONTEXT_TOKEN_BUDGET")
+# Un fragmento que no entra completo solo se recorta si quedan al menos estos tokens
+MIN_TRUNCATED_CHUNK_TOKENS = 50
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+
+def build_prompts(context: str, question: str, mode: str) -> tuple[str, str]:
+    """
+    Construye system_prompt y user_prompt según el modo solicitado.
+    """
+
+    if mode == "detallada":
+        system_prompt = (
+            "Eres un asistente experto que responde siempre **usando exclusivamente la información proporcionada en el contexto**."
+            "No utilices conocimientos propios ni fuentes externas. Si la respuesta no está en el contexto, indica explícitamente: 'No hay suficiente información en los documentos proporcionados para responder a esta pregunta.' "
+            "Responde de manera didáctica, detallada y con referencias (Documento origen) sólo si aparecen en el contexto."
+        )
+        user_prompt = (
+            f"Contexto:\n{context}\n"
+            f"Pregunta: {question}\n"
+            "Responde utilizando únicamente información encontrada en el contexto anterior. No inventes ni completes con datos externos. "
+            "Si la información no está en los fragmentos dados, responde: 'No hay suficiente información en los documentos proporcionados para responder a esta pregunta.' "
+            "Incluye referencias (nombre del documento origen) solamente si aparecen explícitamente en el contexto. Divide la respuesta en párrafos si es necesario."
+        )
+
+    elif mode == "breve":
+        system_prompt = (
+            "Eres un asistente que responde siempre de forma breve, clara y concisa. "
+            "Máximo 2-3 oraciones. Usa solo el contexto proporcionado y sé directo."
+        )
+        user_prompt = (
+            f"Contexto:\n{context}\n"
+            f"Pregunta: {question}\n"
+            "Proporciona una respuesta rápida y precisa."
+            "Responde utilizando únicamente información encontrada en el contexto anterior. No inventes ni completes con datos externos. "
+        )
+
+    else:
+        raise ValueError(f"Modo de respuesta no soportado: {mode!r} (usar {' o '.join(RESPONSE_MODES)})")
+
+    return system_prompt, user_prompt
+
+
+def llm_model(provider: str) -> str:
+    return LLM_MODELS["openai" if provider == "openai" else "groq"]
+
+
+def context_token_budget(provider: str, mode: str) -> int:
+    """Tokens máximos de contexto para el modelo del proveedor y el modo de respuesta"""
+    if CONTEXT_TOKEN_BUDGET:
+        return int(CONTEXT_TOKEN_BUDGET)
+    budgets = CONTEXT_TOKEN_BUDGETS.get(llm_model(provider), {})
+    return budgets.get(mode, budgets.get("detallada", 3000))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta el texto en un final de oración (o de palabra, si ninguna oración entra)"""
+    for pieces, joiner in ((_SENTENCE_END.split(text), " "), (text.split(), " ")):
+        kept, used = [], 0
+        for piece in pieces:
+            tokens = count_tokens(piece + joiner)
+            if used + tokens > max_tokens:
+                break
+            kept.append(piece)
+            used += tokens
+        if kept:
+            return joiner.join(kept)
+    return ""
+
+
+def build_context(matched_texts: list, matched_metadatas: list, max_tokens: int = None) -> tuple[str, int, int]:
+    """
+    Concatena los fragmentos recuperados (ya ordenados por relevancia) para el prompt del LLM
+    sin superar max_tokens: el primero que no entra completo se recorta en un final de
+    oración y los siguientes se omiten.
+    Devuelve (contexto, tokens del contexto, fragmentos incluidos).
+    """
+    context = ""
+    used = 0
+    included = 0
+    for i, (text, meta) in enumerate(zip(matched_texts, matched_metadatas)):
+        src = meta.get('source', 'desconocido')
+        page = meta.get('page', 'desconocida')
+        header = f"[Fragmento {i+1} - Fuente: {src}, Página: {page}]:\n"
+        block = f"{header}{text}\n\n"
+        tokens = count_tokens(block)
+        if max_tokens is not None and used + tokens > max_tokens:
+            remaining = max_tokens - used - count_tokens(header)
+            truncated = truncate_to_tokens(text, remaining) if remaining >= MIN_TRUNCATED_CHUNK_TOKENS else ""
+            if truncated:
+                block = f"{header}{truncated}\n\n"
+                context += block
+                used += count_tokens(block)
+                included += 1
+            break
+        context += block
+        used += tokens
+        included += 1
+    return context, used, included
+
+
+def completion_kwargs(provider: str, system_prompt: str, user_prompt: str, mode: str) -> dict:
+    """Parámetros de chat.completions.create según el proveedor"""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    if provider == "openai":
+        return {
+            "model": llm_model(provider),
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 500 if mode == "breve" else 1500,
+        }
+    # por defecto usa Groq
+    return {
+        "model": llm_model(provider),
+        "messages": messages,
+        "temperature": 0.3,
+        "max_tokens": 500 if mode == "breve" else 1500,
+    }
 
 
 class RAGService:
-    def __init__(self, index_path: Path = Path("/vector_store")):
-        self.embedding_service = EmbeddingServiceChroma()
+    def __init__(self, index_path: Path = Path(VECTOR_STORE_DIR), embedding_service=None, client_factory=None):
+        # El servicio de embeddings (Chroma + artefacto) se crea al primer uso, normalmente
+        # en warm_up, para que importar la API no abra el índice
+        self._embedding_service = embedding_service
+        self._embedding_service_lock = threading.Lock()
         self.initialized = False
         self.index_path = index_path
         self.indexed_files = {}
-        self.client_factory = ModelClientFactory()
+        # indexed_files se lee de disco una vez (al adoptar un índice existente o en la primera ingesta)
+        self._registry_loaded = False
+        self.client_factory = client_factory or ModelClientFactory()
         # Inicializar cliente de Groq
 
-    
+        # Límite de concurrencia del camino asíncrono (se crea por event loop)
+        self.max_concurrent_questions = MAX_CONCURRENT_QUESTIONS
+        self._semaphore = None
+        self._semaphore_loop = None
+        # Límite de generaciones simultáneas por proveedor en /questions/batch
+        self.provider_concurrency = {"openai": BATCH_CONCURRENCY_OPENAI, "groq": BATCH_CONCURRENCY_GROQ}
+        self._provider_semaphores = {}
+        self._provider_semaphores_loop = None
+        self.single_flight = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+
+        # Serializa las ingestas (registro + colección); las preguntas no lo toman
+        self._index_lock = threading.RLock()
+        # Exportación del artefacto pendiente tras /upload_pdf (ver _schedule_artifact_save)
+        self._artifact_dirty = False
+        self._artifact_timer = None
+
+        self.answer_cache = AnswerCache(
+            max_items=ANSWER_CACHE_SIZE,
+            ttl_sec=ANSWER_CACHE_TTL_SEC,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY,
+        ) if ANSWER_CACHE_ENABLED else None
+
+        # Avance del arranque para GET /ready: pending -> loading -> ready | failed
+        # (con INDEX_ROLE=reader: pending -> waiting_for_builder -> ready)
+        self.warmup = {"stage": "pending", "started_at": None, "finished_at": None, "error": None, "progress": {}}
+        # Hilo que sigue las generaciones del índice compartido (solo reader)
+        self._follower = None
+        self._stop_following = threading.Event()
+
+    @property
+    def embedding_service(self):
+        if self._embedding_service is None:
+            with self._embedding_service_lock:
+                if self._embedding_service is None:
+                    self._embedding_service = EmbeddingServiceChroma()
+        return self._embedding_service
+
+    @embedding_service.setter
+    def embedding_service(self, service):
+        self._embedding_service = service
+
+    def warm_up(self, data_folder: Path):
+        """
+        Abre el índice existente o indexa data_folder, dejando el avance en self.warmup.
+        La API lo corre en un hilo después de empezar a escuchar: /health responde enseguida
+        y /ready pasa a 200 cuando termina. Con INDEX_ROLE=reader no indexa: queda siguiendo
+        las generaciones que publique el builder.
+        """
+        self.warmup.update(stage="loading", started_at=time.time(), finished_at=None, error=None, progress={})
+        try:
+            if self.embedding_service.role == "reader":
+                self.warmup["stage"] = "waiting_for_builder"
+                self._follower = threading.Thread(target=self._follow_shared_index, name="indice-compartido",
+                                                  daemon=True)
+                self._follower.start()
+                return
+            self.initialize_from_pdfs(data_folder, progress=lambda **counters: self.warmup["progress"].update(counters))
+        except Exception as e:
+            logger.exception("Falló la carga inicial del índice")
+            self.warmup.update(stage="failed", error=str(e), finished_at=time.time())
+            return
+        self.warmup.update(stage="ready", finished_at=time.time())
+        logger.info(f"✅ Listo en {self.warmup['finished_at'] - self.warmup['started_at']:.1f}s")
+
+    def _follow_shared_index(self):
+        """(reader) Adopta cada generación nueva del índice compartido hasta close()"""
+        while not self._stop_following.is_set():
+            try:
+                if self.embedding_service.attach_shared_index():
+                    self.initialized = True
+                    self.warmup["progress"] = {"generation": self.embedding_service.shared_generation}
+                    if self.warmup["stage"] != "ready":
+                        self.warmup.update(stage="ready", finished_at=time.time(), error=None)
+                        logger.info(f"✅ Listo en {self.warmup['finished_at'] - self.warmup['started_at']:.1f}s")
+            except Exception as e:
+                # Se reintenta en el próximo sondeo; mientras tanto sigue la generación anterior
+                if self.warmup["error"] != str(e):
+                    logger.warning(f"⚠️ No se pudo abrir el índice compartido: {e}")
+                self.warmup["error"] = str(e)
+            self._stop_following.wait(INDEX_POLL_SEC)
+
+    def close(self):
+        """Detiene el seguimiento del índice compartido y guarda el artefacto pendiente (al apagar la API)"""
+        self._stop_following.set()
+        if self._follower is not None:
+            self._follower.join(timeout=5)
+        self.flush_artifact()
+
+    def _schedule_artifact_save(self):
+        """
+        Marca el artefacto como desactualizado y programa una sola exportación para dentro de
+        ARTIFACT_SAVE_DELAY_SEC. Exportar reescribe el artefacto completo (vectores, textos y
+        normas): hacerlo en cada subida competía con las preguntas; así las subidas de la
+        ventana se guardan juntas. Los checkpoints de embeddings se conservan hasta entonces,
+        así que si el proceso cae antes los chunks subidos no se vuelven a pagar.
+        """
+        self._artifact_dirty = True
+        if ARTIFACT_SAVE_DELAY_SEC <= 0:
+            self.flush_artifact()
+            return
+        if self._artifact_timer is None:
+            self._artifact_timer = threading.Timer(ARTIFACT_SAVE_DELAY_SEC, self.flush_artifact)
+            self._artifact_timer.daemon = True
+            self._artifact_timer.start()
+
+    def flush_artifact(self):
+        """Exporta el artefacto si quedaron subidas sin guardar y borra los checkpoints"""
+        with self._index_lock:
+            timer, self._artifact_timer = self._artifact_timer, None
+            if timer is not None:
+                timer.cancel()
+            if not self._artifact_dirty:
+                return
+            self.embedding_service.save_precomputed()
+            self.embedding_service.embedding_executor.clear_checkpoints()
+            self._artifact_dirty = False
+
+    def index_generation(self):
+        """Generación del índice compartido publicada o en uso (None en standalone o antes de cargar)"""
+        if self._embedding_service is None:
+            return None
+        return self._embedding_service.shared_generation
+
+    def _check_writable(self):
+        if self.embedding_service.role == "reader":
+            raise RuntimeError("INDEX_ROLE=reader: el índice compartido es de solo lectura, la ingesta la hace el builder")
+
+    def _publish_shared_index(self):
+        """(builder) Publica el índice para los workers reader si cambió desde la última vez"""
+        if self.embedding_service.role == "builder":
+            self.embedding_service.publish_shared_index()
+
+    def document_count(self) -> int:
+        """Chunks en el índice (0 si todavía no se abrió)"""
+        if self._embedding_service is None:
+            return 0
+        return self._embedding_service.vector_store.count()
+
+
     def _get_file_hash(self, filepath: Path) -> str:
         """Calcula hash MD5 del archivo"""
-        hasher = hashlib.md5()
-        with open(filepath, 'rb') as f:
-            hasher.update(f.read())
-        return hasher.hexdigest()
-    
-    
+        return file_hash(filepath)
+
+
     def _load_file_registry(self):
-        """Carga registro de archivos indexados"""
-        import json
+        """
+        Carga registro de archivos indexados: {nombre: {"hash", "chunk_ids", "indexed_at"}}.
+        Entradas del formato antiguo ({ruta: hash}) se descartan: esos archivos se reindexan.
+        """
         registry_path = self.index_path / "file_registry.json"
+        self.indexed_files = {}
+        self._registry_loaded = True
         if registry_path.exists():
             with open(registry_path, "r") as f:
-                self.indexed_files = json.load(f)
-    
-    def try_load_existing_index(self) -> bool:
+                registry = json.load(f)
+            self.indexed_files = {
+                name: entry for name, entry in registry.items() if isinstance(entry, dict)
+            }
+
+    def _save_file_registry(self):
+        """Guarda el registro de forma atómica"""
+        self.index_path.mkdir(parents=True, exist_ok=True)
+        registry_path = self.index_path / "file_registry.json"
+        tmp_path = registry_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.indexed_files, f, indent=2)
+        os.replace(tmp_path, registry_path)
+
+    @staticmethod
+    def _corpus_snapshot(data_folder: Path) -> tuple[str, dict]:
+        """
+        Huella del corpus a partir de nombre, tamaño y fecha de cada PDF
+        (solo stat, no lee el contenido). Devuelve (fingerprint, files).
+        """
+        files = {}
+        for pdf_file in sorted(data_folder.glob("*.pdf")):
+            stat = pdf_file.stat()
+            files[pdf_file.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        fingerprint = hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()
+        return fingerprint, files
+
+    def try_load_existing_index(self, data_folder: Path = None) -> bool:
         try:
-            collection = self.embedding_service.client.get_collection("document_chunks")
-            if collection.count() > 0:
-                print(f"Índice encontrado con {collection.count()} documentos.")
-                self.initialized = True
-                print("RAG Service inicializado con ChromaDB. v2")
-                return True
-            return False
+            count = self.embedding_service.vector_store.count()
+            if count == 0:
+                return False
+
+            # Con manifiesto: el índice solo vale si corresponde al corpus y modelo actuales
+            manifest = self.embedding_service.read_manifest()
+            if manifest and data_folder is not None:
+                fingerprint, files = self._corpus_snapshot(data_folder)
+                if manifest.get("corpus_fingerprint") != fingerprint:
+                    logger.info("El corpus cambió desde la última indexación.")
+                    return False
+                if manifest.get("embedding_model") != self.embedding_service.embedding_model:
+                    logger.info("El modelo de embeddings cambió desde la última indexación.")
+                    return False
+                if manifest.get("document_count") != count:
+                    logger.info("El índice no coincide con el manifiesto.")
+                    return False
+            elif data_folder is not None and self.embedding_service.persistent:
+                # Índice anterior al manifiesto: se adopta tal cual
+                fingerprint, files = self._corpus_snapshot(data_folder)
+                self.embedding_service.write_manifest(fingerprint, files)
+
+            logger.info(f"Índice encontrado con {count} documentos.")
+            # Sin el registro, una subida que reemplaza un PDF no borraría sus chunks anteriores
+            with self._index_lock:
+                self._load_file_registry()
+            self.initialized = True
+            logger.info("RAG Service inicializado con ChromaDB. v2")
+            return True
         except Exception as e:
-            print(f"Error intentando cargar índice: {e}")
+            logger.warning(f"Error intentando cargar índice: {e}")
             return False
-    
+
     def needs_reindex(self, data_folder: Path) -> bool:
         """Verifica si hay nuevos archivos o cambios que requieran reindexación"""
         self._load_file_registry()
+        current_files = {pdf_file.name for pdf_file in data_folder.glob("*.pdf")}
+        if set(self.indexed_files) - current_files:
+            return True
         for pdf_file in data_folder.glob("*.pdf"):
             current_hash = self._get_file_hash(pdf_file)
-            recorded_hash = self.indexed_files.get(str(pdf_file))
+            recorded_hash = self.indexed_files.get(pdf_file.name, {}).get("hash")
             if recorded_hash != current_hash:
-                print(f"Cambio detectado en {pdf_file.name}")
+                logger.info(f"Cambio detectado en {pdf_file.name}")
                 return True
-        # Implementa si quieres detectar cambios, o simplemente fuerza reindexación según lógica propia
-        return False  # Por simplicidad aquí siempre reindexa para evitar problemas
-    
-    def initialize_from_pdfs(self, data_folder: Path, force: bool = False):
-        if not force and self.try_load_existing_index():
+        return False
+
+    def _file_is_indexed(self, name: str, current_hash: str) -> bool:
+        entry = self.indexed_files.get(name)
+        if not entry or entry.get("hash") != current_hash:
+            return False
+        # El registro solo vale si sus chunks siguen en la colección (p.ej. ChromaDB en memoria)
+        chunk_ids = entry.get("chunk_ids", [])
+        return len(self.embedding_service.existing_ids(chunk_ids)) == len(chunk_ids)
+
+    def _remove_file(self, name: str, persist: bool = True):
+        """Elimina del índice los chunks de un archivo y su entrada del registro"""
+        entry = self.indexed_files.pop(name, None)
+        if entry and entry.get("chunk_ids"):
+            self.embedding_service.delete_documents(entry["chunk_ids"], persist=persist)
+
+    def index_pdf(self, pdf_path: Path, persist: bool = True, progress=None) -> int:
+        """
+        Indexa un PDF nuevo o modificado: borra sus chunks anteriores, genera los nuevos
+        y actualiza el registro. Devuelve el número de chunks indexados,
+        o None si el archivo no cambió (no se hace nada).
+        progress: callback opcional progress(**contadores) para reportar avance.
+        """
+        progress = progress or (lambda **counters: None)
+        self._check_writable()
+        with self._index_lock:
+            if not self._registry_loaded:
+                self._load_file_registry()
+            progress(files_total=1, files_parsed=0, pages_parsed=0, chunks_parsed=0, chunks_embedded=0)
+            current_hash = self._get_file_hash(pdf_path)
+            if self._file_is_indexed(pdf_path.name, current_hash):
+                progress(files_parsed=1)
+                return None
+
+            result = load_pdf_docs(pdf_path, current_hash)
+            docs = result["docs"]
+            progress(files_parsed=1, pages_parsed=result["pages"], chunks_parsed=len(docs))
+            metrics.INGEST_PDFS.inc(outcome="indexed")
+            metrics.INGEST_PAGES.inc(result["pages"])
+
+            self._remove_file(pdf_path.name, persist=False)
+            self.embedding_service.add_documents(docs, persist=False)
+            progress(chunks_embedded=len(docs))
+
+            self.indexed_files[pdf_path.name] = {
+                "hash": current_hash,
+                "chunk_ids": [doc['id'] for doc in docs],
+                "indexed_at": time.time(),
+            }
+            if persist:
+                self._save_file_registry()
+                self.embedding_service.write_manifest(*self._corpus_snapshot(pdf_path.parent))
+                self._schedule_artifact_save()
+                self._publish_shared_index()
+            self.initialized = True
+            return len(docs)
+
+    def _remove_orphans(self):
+        """Borra chunks que no pertenecen a ningún archivo registrado (IDs antiguos chunk_N)"""
+        registered = {chunk_id for entry in self.indexed_files.values() for chunk_id in entry.get("chunk_ids", [])}
+        if self.embedding_service.vector_store.count() == len(registered):
             return
+        orphans = [chunk_id for chunk_id in self.embedding_service.all_ids() if chunk_id not in registered]
+        if orphans:
+            logger.info(f"Eliminando {len(orphans)} chunks huérfanos...")
+            self.embedding_service.delete_documents(orphans, persist=False)
+
+    def _write_ingest_batch(self, batch: list, stats: dict, written: dict):
+        """
+        Embebe y escribe un lote de (archivo, doc) de sync_folder. Si el lote falla se
+        reintenta archivo por archivo: el que vuelve a fallar se descarta (sin sus chunks
+        ya escritos ni su entrada del registro, así la próxima sincronización lo reintenta)
+        y los demás siguen. written lleva los chunks escritos por archivo en la corrida.
+        """
+        # Restos de un archivo descartado en un lote anterior
+        batch = [(name, doc) for name, doc in batch if name in self.indexed_files]
+        by_file = {}
+        for name, doc in batch:
+            by_file.setdefault(name, []).append(doc)
+        try:
+            self.embedding_service.add_documents([doc for _, doc in batch], persist=False)
+            pending = by_file.items()
+        except Exception as e:
+            logger.warning(f"⚠️ Falló un lote de {len(batch)} chunks ({e}): se reintenta por archivo")
+            pending = []
+            for name, docs in by_file.items():
+                try:
+                    self.embedding_service.add_documents(docs, persist=False)
+                    pending.append((name, docs))
+                except Exception as e:
+                    logger.error(f"❌ No se pudo indexar {name}: {e}")
+                    self._remove_file(name, persist=False)
+                    stats["chunks_indexed"] -= written.pop(name, 0)
+                    stats["indexed_files"] -= 1
+                    stats["failed_files"] += 1
+                    metrics.INGEST_PDFS.inc(outcome="failed")
+        for name, docs in pending:
+            written[name] = written.get(name, 0) + len(docs)
+            stats["chunks_indexed"] += len(docs)
+
+    def sync_folder(self, data_folder: Path, force: bool = False, progress=None) -> dict:
+        """
+        Indexación incremental de una carpeta: solo se procesan (y embeben) los PDFs nuevos
+        o modificados, y se eliminan los chunks de los PDFs borrados.
+        force=True reprocesa todos los PDFs (los embeddings ya calculados se reutilizan por ID).
+
+        Los PDFs se parsean en paralelo (pool de procesos) y sus chunks fluyen en lotes de
+        INGEST_BATCH_SIZE que se embeben y escriben al índice apenas están listos.
+        progress: callback opcional progress(**contadores) para reportar avance.
+        """
+        progress = progress or (lambda **counters: None)
+        self._check_writable()
+        with self._index_lock:
+            self._load_file_registry()
+            current = {pdf_file.name: pdf_file for pdf_file in sorted(data_folder.glob("*.pdf"))}
+            stats = {"indexed_files": 0, "removed_files": 0, "unchanged_files": 0, "failed_files": 0,
+                     "pages_parsed": 0, "chunks_indexed": 0}
+
+            for name in list(self.indexed_files):
+                if name not in current:
+                    logger.info(f"Archivo eliminado: {name}")
+                    self._remove_file(name, persist=False)
+                    stats["removed_files"] += 1
+
+            # Solo los archivos nuevos o modificados (o todos con force) pasan al pipeline
+            hashes = {}
+            for name, pdf_file in current.items():
+                current_hash = self._get_file_hash(pdf_file)
+                if not force and self._file_is_indexed(name, current_hash):
+                    stats["unchanged_files"] += 1
+                    continue
+                if self.indexed_files.get(name, {}).get("hash") != current_hash:
+                    # Archivo modificado: sus chunks anteriores ya no valen
+                    self._remove_file(name, persist=False)
+                hashes[str(pdf_file)] = current_hash
+            progress(files_total=len(hashes), files_parsed=0, pages_parsed=0,
+                     chunks_parsed=0, chunks_embedded=0)
+
+            # Con force los chunks existentes se sobrescriben (upsert): el índice sigue respondiendo.
+            # El lote es de (archivo, doc) para poder atribuir un error al archivo que lo causó
+            batch = []
+            queued = set()
+            written = {}
+            for result in iter_pdf_docs([Path(path) for path in hashes], hashes=hashes):
+                name = Path(result["path"]).name
+                if "error" in result:
+                    stats["failed_files"] += 1
+                    metrics.INGEST_PDFS.inc(outcome="failed")
+                    continue
+                # Un ID ya encolado en esta corrida (en este lote o en uno ya escrito) no se repite:
+                # el upsert de un lote con IDs duplicados falla entero
+                docs = [doc for doc in result["docs"] if doc['id'] not in queued]
+                if len(docs) < len(result["docs"]):
+                    logger.warning(f"⚠️ {name}: {len(result['docs']) - len(docs)} chunks con IDs repetidos omitidos")
+                queued.update(doc['id'] for doc in docs)
+                self.indexed_files[name] = {
+                    "hash": result["hash"],
+                    "chunk_ids": [doc['id'] for doc in docs],
+                    "indexed_at": time.time(),
+                }
+                logger.info(f"Procesado {name}: {result['pages']} páginas, {len(docs)} chunks")
+                metrics.INGEST_PAGES.inc(result["pages"])
+                stats["indexed_files"] += 1
+                stats["pages_parsed"] += result["pages"]
+                progress(files_parsed=stats["indexed_files"] + stats["failed_files"],
+                         pages_parsed=stats["pages_parsed"],
+                         chunks_parsed=stats["chunks_indexed"] + len(batch) + len(docs))
+
+                for doc in docs:
+                    batch.append((name, doc))
+                    if len(batch) >= INGEST_BATCH_SIZE:
+                        self._write_ingest_batch(batch, stats, written)
+                        progress(chunks_embedded=stats["chunks_indexed"])
+                        batch = []
+            if batch:
+                self._write_ingest_batch(batch, stats, written)
+                progress(chunks_embedded=stats["chunks_indexed"])
+            metrics.INGEST_PDFS.inc(stats["indexed_files"], outcome="indexed")
+
+            self._remove_orphans()
+            if stats["indexed_files"] or stats["removed_files"] or self._artifact_dirty:
+                self.embedding_service.save_precomputed()
+                self._artifact_dirty = False
+            self._save_file_registry()
+            fingerprint, files = self._corpus_snapshot(data_folder)
+            self.embedding_service.write_manifest(fingerprint, files)
+            # Los embeddings ya están en el índice: los checkpoints de lotes sobran
+            self.embedding_service.embedding_executor.clear_checkpoints()
+            return stats
+
+    def initialize_from_pdfs(self, data_folder: Path, force: bool = False, progress=None):
+        self._check_writable()
+        if not force and self.try_load_existing_index(data_folder):
+            self._publish_shared_index()
+            return {"loaded_existing_index": True}
+
+        # Si cambió el modelo de embeddings los vectores anteriores no son comparables
+        manifest = self.embedding_service.read_manifest()
+        if manifest and manifest.get("embedding_model") not in (None, self.embedding_service.embedding_model):
+            logger.warning("Modelo de embeddings distinto al del índice: se vacía la colección.")
+            self.embedding_service.reset_collection()
+            self.indexed_files = {}
+            self._save_file_registry()
+
+        logger.info(f"Procesando PDFs en {data_folder}...")
+        stats = self.sync_folder(data_folder, force=force, progress=progress)
+        logger.info(f"Indexación: {stats}")
+        self._publish_shared_index()
 
-        print(f"Procesando PDFs en {data_folder}...")
-        chunks = process_all_pdfs(data_folder)
-        docs = prepare_docs_for_chroma(chunks)
-        
-        print(f"Insertando {len(docs)} chunks en ChromaDB...")
-        self.embedding_service.add_documents(docs)
-        
         self.initialized = True
-        print("RAG Service inicializado con ChromaDB.")
+        logger.info("RAG Service inicializado con ChromaDB.")
+        return stats
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Semáforo que limita las preguntas concurrentes en el event loop actual"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_questions)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def _get_provider_semaphore(self, provider: str) -> asyncio.Semaphore:
+        """Semáforo por proveedor (en el event loop actual) para las generaciones en lote"""
+        provider = "openai" if provider == "openai" else "groq"
+        loop = asyncio.get_running_loop()
+        if self._provider_semaphores_loop is not loop:
+            self._provider_semaphores = {}
+            self._provider_semaphores_loop = loop
+        if provider not in self._provider_semaphores:
+            self._provider_semaphores[provider] = asyncio.Semaphore(self.provider_concurrency[provider])
+        return self._provider_semaphores[provider]
+
+    def _check_llm_clients(self, provider: str, matched_texts: list, matched_metadatas: list):
+        """
+        Devuelve una respuesta de error si ningún proveedor puede atender el pedido (ni el
+        pedido ni, con fallback, el otro), None si todo está bien
+        """
+        if self.client_factory.route(provider):
+            return None
+        api_key = "OPENAI_API_KEY" if provider == "openai" else "GROQ_API_KEY"
+        return {
+            "answer": f"Error: No se pudo conectar al servicio LLM. Verifica {api_key}.",
+            "sources": [meta.get("source", "desconocido") for meta in matched_metadatas],
+            "context": matched_texts
+        }
+
+    def _get_cached_answer(self, embedding, provider: str, top_k: int, mode: str, start_time: float):
+        """Busca una respuesta para una pregunta semánticamente equivalente"""
+        if self.answer_cache is None:
+            return None
+        cached = self.answer_cache.get(
+            embedding, mode, provider, top_k, self.embedding_service.index_version
+        )
+        if cached is None:
+            return None
+        similarity = cached.pop("similarity")
+        metrics.ANSWER_CACHE_HITS.inc()
+        # El proveedor y modelo que generaron la respuesta guardada (con fallback no es el pedido)
+        answered = cached.get("consumption") or {}
+        cached["consumption"] = {
+            "provider": answered.get("provider", provider),
+            "model": answered.get("model", llm_model(provider)),
+            "tokens_used": 0,
+            "cost_estimated": 0.0,
+            "latency_sec": time.time() - start_time,
+            "cache_hit": True,
+            "cache_similarity": round(similarity, 4),
+        }
+        return cached
+
+    def _cache_answer(self, embedding, provider: str, top_k: int, mode: str, response: dict, index_version):
+        """
+        index_version es la del índice del que salieron los chunks (leída antes de buscar), no
+        la actual: si el índice cambió mientras se generaba, la respuesta no queda como vigente
+        """
+        # Solo se cachean respuestas generadas correctamente (las de error no traen consumo)
+        if self.answer_cache is None or "consumption" not in response:
+            return
+        self.answer_cache.put(embedding, mode, provider, top_k, index_version, response)
 
 
     def answer_question(self, question: str, provider: str, top_k: int = 3, mode: str = "breve" ):
@@ -82,134 +724,437 @@ class RAGService:
                 "sources": [],
                 "context": []
             }
-        def build_prompts(context: str, question: str, mode: str) -> tuple[str, str]:
-            """
-            Construye system_prompt y user_prompt según el modo solicitado.
-            """
-
-            if mode == "detallada":
-                system_prompt = (
-                    "Eres un asistente experto que responde siempre **usando exclusivamente la información proporcionada en el contexto**."
-                    "No utilices conocimientos propios ni fuentes externas. Si la respuesta no está en el contexto, indica explícitamente: 'No hay suficiente información en los documentos proporcionados para responder a esta pregunta.' "
-                    "Responde de manera didáctica, detallada y con referencias (Documento origen) sólo si aparecen en el contexto."
-                )
-                user_prompt = (
-                    f"Contexto:\n{context}\n"
-                    f"Pregunta: {question}\n"
-                    "Responde utilizando únicamente información encontrada en el contexto anterior. No inventes ni completes con datos externos. "
-                    "Si la información no está en los fragmentos dados, responde: 'No hay suficiente información en los documentos proporcionados para responder a esta pregunta.' "
-                    "Incluye referencias (nombre del documento origen) solamente si aparecen explícitamente en el contexto. Divide la respuesta en párrafos si es necesario."
-                )
-
-            elif mode == "breve":
-                system_prompt = (
-                    "Eres un asistente que responde siempre de forma breve, clara y concisa. "
-                    "Máximo 2-3 oraciones. Usa solo el contexto proporcionado y sé directo."
-                )
-                user_prompt = (
-                    f"Contexto:\n{context}\n"
-                    f"Pregunta: {question}\n"
-                    "Proporciona una respuesta rápida y precisa."
-                    "Responde utilizando únicamente información encontrada en el contexto anterior. No inventes ni completes con datos externos. "
-                )
-
-            print(mode, "prompts construidos.")
-            return system_prompt, user_prompt
 
         start_time = time.time()
 
-        # 1. Buscar chunks relevantes con ChromaDB
-        print(f"Buscando contexto para: {question}")
-        results = self.embedding_service.query(question, n_results=top_k)
-        
-        # Estructura de Chroma: resultados vienen dentro de listas anidadas por consultas/ids
-        matched_texts = results.get('documents', [[]])[0]  # Lista de textos
-        matched_metadatas = results.get('metadatas', [[]])[0]  # Lista de diccionarios
+        with span("total", provider):
+            # 1. Buscar chunks relevantes (vectorial + BM25) o una respuesta cacheada
+            with span("embed_query"):
+                embedding = self.embedding_service.embed_query(question)
+            index_version = self.embedding_service.index_version
+            cached = self._get_cached_answer(embedding, provider, top_k, mode, start_time)
+            if cached:
+                return cached
+            results = self._retrieve(embedding, question, top_k)
+            response = self._generate_answer(question, provider, mode, results, start_time)
+            self._cache_answer(embedding, provider, top_k, mode, response, index_version)
+            return response
 
-        print(f"Encontrados {len(matched_texts)} fragmentos relevantes.")
-        print("Metadatas:", matched_metadatas)
+    def _retrieve(self, embedding, question: str, top_k: int) -> dict:
+        """
+        Recupera chunks (vectorial + BM25). Con RERANK_ENABLED pide más candidatos, elige
+        top_k con MMR y fusiona los solapados, para no repetir texto en el prompt.
+        """
+        with span("search"):
+            if not RERANK_ENABLED:
+                return self.embedding_service.search(embedding, n_results=top_k, query_text=question)
+            results = self.embedding_service.search(
+                embedding, n_results=top_k * RERANK_FETCH_FACTOR, query_text=question, include_embeddings=True
+            )
+            return rerank_results(results, embedding, top_k, MMR_LAMBDA)
 
+    def _retrieve_many(self, embeddings: list, questions: list, top_ks: list) -> list:
+        """_retrieve para varias preguntas con una sola búsqueda multi-embedding"""
+        fetch_factor = RERANK_FETCH_FACTOR if RERANK_ENABLED else 1
+        with span("search_batch"):
+            # Cada pregunta pide sus top_k * factor: los mismos candidatos que en _retrieve
+            batch_results = self.embedding_service.search_many(
+                embeddings, n_results=[top_k * fetch_factor for top_k in top_ks], query_texts=questions,
+                include_embeddings=RERANK_ENABLED,
+            )
+            retrieved = []
+            for embedding, top_k, results in zip(embeddings, top_ks, batch_results):
+                retrieved.append(rerank_results(results, embedding, top_k, MMR_LAMBDA) if RERANK_ENABLED else results)
+            return retrieved
+
+    def _prepare_generation(self, question: str, provider: str, mode: str, results: dict) -> dict:
+        """
+        Paso común a todas las respuestas (answer_question, la versión asíncrona, el lote y
+        el streaming) entre la búsqueda y el LLM: contexto dentro del presupuesto de tokens,
+        prompts y argumentos de chat.completions.create por proveedor (con fallback el modelo
+        depende del proveedor que termine respondiendo).
+        Devuelve texts, metadatas y sources (solo los fragmentos que entraron al contexto),
+        context_tokens, los prompts, kwargs (proveedor -> argumentos) y prompt_build_sec; y
+        además "error" (la respuesta a devolver) si no hay chunks o ningún proveedor puede
+        responder.
+        """
+        # Estructura de Chroma: resultados vienen dentro de listas anidadas por consultas/ids
+        matched_texts = results.get('documents', [[]])[0]
+        matched_metadatas = results.get('metadatas', [[]])[0]
+        logger.debug(f"Encontrados {len(matched_texts)} fragmentos relevantes.")
         if not matched_texts or not matched_metadatas:
             return {
-                "answer": "No se encontró información relevante en los documentos.",
                 "sources": [],
-                "context": []
+                "error": {
+                    "answer": "No se encontró información relevante en los documentos.",
+                    "sources": [],
+                    "context": []
+                },
             }
 
-        # 2. Construir el contexto concatenado para el prompt del LLM
-        context = ""
-        for i, (text, meta) in enumerate(zip(matched_texts, matched_metadatas)):
-            src = meta.get('source', 'desconocido')
-            page = meta.get('page', 'desconocida')
-            context += f"[Fragmento {i+1} - Fuente: {src}, Página: {page}]:\n{text}\n\n"
+        # 2-3. Contexto (dentro del presupuesto de tokens) y prompts
+        stage_start = time.time()
+        with span("prompt_build"):
+            context, context_tokens, included = build_context(
+                matched_texts, matched_metadatas, context_token_budget(provider, mode)
+            )
+            matched_texts, matched_metadatas = matched_texts[:included], matched_metadatas[:included]
+            system_prompt, user_prompt = build_prompts(context, question, mode)
+        prepared = {
+            "texts": matched_texts,
+            "metadatas": matched_metadatas,
+            "sources": [meta.get("source", "desconocido") for meta in matched_metadatas],
+            "context_tokens": context_tokens,
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "kwargs": lambda p: completion_kwargs(p, system_prompt, user_prompt, mode),
+            "prompt_build_sec": time.time() - stage_start,
+        }
+        error_response = self._check_llm_clients(provider, matched_texts, matched_metadatas)
+        if error_response:
+            prepared["error"] = error_response
+        return prepared
 
-        # 3. Crear el prompt para el LLM
-        system_prompt, user_prompt = build_prompts(context, question, mode)
+    def _generate_answer(self, question: str, provider: str, mode: str, results: dict, start_time: float):
+        prepared = self._prepare_generation(question, provider, mode, results)
+        if "error" in prepared:
+            return prepared["error"]
 
-        # 4. Llamar al LLM (Groq)
-        if not self.client_factory.get_client("groq"):
-            return {
-                "answer": "Error: No se pudo conectar al servicio LLM. Verifica GROQ_API_KEY.",
-                "sources": [meta.get("source", "desconocido") for meta in matched_metadatas],
-                "context": matched_texts
-            }
-        elif not self.client_factory.get_client("openai"):
+        # 4. Llamar al LLM
+        try:
+            with span("llm_generation", provider):
+                chat_completion, used_provider = self.client_factory.complete(
+                    provider, prepared["kwargs"], latency_key=mode
+                )
+            return self._build_response(chat_completion, prepared, start_time, used_provider)
+
+        except ProviderOverloaded:
+            # Sin cuota en ningún proveedor: la API responde 503 + Retry-After
+            raise
+        except Exception as e:
+            return self._generation_error(provider, prepared, e)
+
+    @staticmethod
+    def _generation_error(provider: str, prepared: dict, error: Exception) -> dict:
+        metrics.LLM_ERRORS.inc(provider=provider)
+        logger.error(f"Error al llamar a {provider}: {error}")
+        return {
+            "answer": f"Error al generar respuesta: {str(error)}",
+            "sources": prepared["sources"],
+            "context": prepared["texts"],
+            "error": str(error),
+        }
+
+    def _build_response(self, chat_completion, prepared: dict, start_time: float, provider: str) -> dict:
+        answer = chat_completion.choices[0].message.content
+        return {
+            "answer": answer,
+            "sources": prepared["sources"],
+            "context": prepared["texts"],
+            "consumption": self._consumption(chat_completion.usage, provider, prepared, answer, start_time),
+        }
+
+    @staticmethod
+    def _consumption(usage, provider: str, prepared: dict, answer: str, start_time: float) -> dict:
+        """
+        Consumo medido: tokens de prompt y completion que informa la API y su costo, con el
+        proveedor que efectivamente respondió (puede no ser el pedido si hubo fallback).
+        Si la API no informa el uso (p.ej. un stream de Groq sin x_groq) se cuentan los tokens
+        de los prompts y de la respuesta, y se marca tokens_estimated.
+        """
+        model = llm_model(provider)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) if usage else None
+        completion_tokens = getattr(usage, "completion_tokens", None) if usage else None
+        tokens_used = getattr(usage, "total_tokens", None) if usage else None
+        tokens_estimated = prompt_tokens is None or completion_tokens is None
+        if tokens_estimated:
+            prompt_tokens = count_tokens(prepared["system_prompt"]) + count_tokens(prepared["user_prompt"])
+            completion_tokens = count_tokens(answer)
+            tokens_used = prompt_tokens + completion_tokens
+        consumption = {
+            "provider": provider,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_used": tokens_used,
+            "context_tokens": prepared["context_tokens"],
+            "cost_estimated": estimate_cost(model, prompt_tokens, completion_tokens),
+            "latency_sec": time.time() - start_time,
+            "cache_hit": False,
+        }
+        if tokens_estimated:
+            consumption["tokens_estimated"] = True
+        return consumption
+
+    @staticmethod
+    def _coalesced_consumption(consumption: dict, start_time: float) -> dict:
+        """
+        Consumo de un pedido que recibió el resultado de otro idéntico en curso: no gastó
+        tokens propios (el costo ya lo registra el pedido que generó la respuesta)
+        """
+        return {
+            **consumption,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "tokens_used": 0,
+            "cost_estimated": 0.0,
+            "latency_sec": time.time() - start_time,
+            "coalesced": True,
+        }
+
+    async def answer_question_async(self, question: str, provider: str, top_k: int = 3, mode: str = "breve"):
+        """
+        Versión asíncrona de answer_question: embedding, búsqueda y generación
+        no bloquean el event loop. Como máximo MAX_CONCURRENT_QUESTIONS preguntas
+        se procesan a la vez; el resto espera su turno. Una pregunta idéntica a otra
+        en curso espera el resultado de esa en lugar de repetir el trabajo.
+        """
+        if not self.initialized:
             return {
-                "answer": "Error: No se pudo conectar al servicio LLM. Verifica OPENAI_API_KEY.",
-                "sources": [meta.get("source", "desconocido") for meta in matched_metadatas],
-                "context": matched_texts
+                "answer": "El sistema RAG no está inicializado. Por favor, sube documentos PDF primero.",
+                "sources": [],
+                "context": []
             }
+        if self.single_flight is None:
+            return await self._answer_question_async(question, provider, top_k, mode)
+
+        start_time = time.time()
+        response, shared = await self.single_flight.run(
+            coalesce_key(question, mode, provider, top_k),
+            lambda: self._answer_question_async(question, provider, top_k, mode),
+        )
+        if not shared:
+            return response
+        response = dict(response)
+        if response.get("consumption"):
+            response["consumption"] = self._coalesced_consumption(response["consumption"], start_time)
+        return response
 
+    async def _answer_question_async(self, question: str, provider: str, top_k: int, mode: str):
+        async with self._get_semaphore():
+            start_time = time.time()
+
+            with span("total", provider):
+                # 1. Embedding async; si hay respuesta cacheada no se busca ni se genera
+                with span("embed_query"):
+                    embedding = await self.embedding_service.aembed_query(question)
+                index_version = self.embedding_service.index_version
+                cached = self._get_cached_answer(embedding, provider, top_k, mode, start_time)
+                if cached:
+                    return cached
+
+                return await self._agenerate_answer(question, provider, top_k, mode, embedding, start_time,
+                                                    index_version)
+
+    async def _aprepare_generation(self, question: str, provider: str, top_k: int, mode: str,
+                                   embedding, results: dict = None) -> dict:
+        """
+        Búsqueda (si no viene hecha, como en el lote) + _prepare_generation, para las rutas
+        asíncronas. Agrega retrieval_sec si buscó.
+        """
+        if results is None:
+            # ChromaDB es síncrono: la búsqueda (vectorial + BM25) va en un hilo
+            stage_start = time.time()
+            results = await asyncio.to_thread(self._retrieve, embedding, question, top_k)
+            retrieval_sec = time.time() - stage_start
+            return {**self._prepare_generation(question, provider, mode, results), "retrieval_sec": retrieval_sec}
+        return self._prepare_generation(question, provider, mode, results)
+
+    async def _agenerate_answer(self, question: str, provider: str, top_k: int, mode: str,
+                                embedding, start_time: float, index_version, results: dict = None) -> dict:
+        """Búsqueda, contexto, prompts y generación con el cliente asíncrono"""
+        prepared = await self._aprepare_generation(question, provider, top_k, mode, embedding, results)
+        if "error" in prepared:
+            return prepared["error"]
+
+        # 4. Llamar al LLM con el cliente asíncrono
         try:
-            print(f"Generando respuesta con {provider} ...")
-            if provider == "openai":
-                chat_completion = self.client_factory.get_client("openai").chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    temperature=0.7,
-                    max_tokens=500 if mode == "breve" else 1500,
+            with span("llm_generation", provider):
+                chat_completion, used_provider = await self.client_factory.acomplete(
+                    provider, prepared["kwargs"], latency_key=mode
                 )
-                answer = chat_completion.choices[0].message.content
-                tokens_used = chat_completion.usage.total_tokens
-
-            else:  # por defecto usa Groq
-                chat_completion = self.client_factory.get_client("groq").chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    model="llama-3.1-8b-instant",  # Modelo actualizado
-                    temperature=0.3,
-                    max_tokens=500 if mode == "breve" else 1500,
-                )
-                answer = chat_completion.choices[0].message.content
-                tokens_used = getattr(chat_completion.usage, "total_tokens",None)
-
-            end_time = time.time()
-            latency = end_time - start_time
-            # Calcular costo estimado
-            cost_per_token = 0.00003  # ejemplo en dólares
-            cost_estimated = tokens_used * cost_per_token if tokens_used else None
-            
-            return {
-                "answer": answer,
-                "sources": [meta.get("source", "desconocido") for meta in matched_metadatas],
-                "context": matched_texts,
-                "consumption": {
-                    "tokens_used": tokens_used,
-                    "cost_estimated": cost_estimated,
-                    "latency_sec": latency,
-                },
-            }
+            response = self._build_response(chat_completion, prepared, start_time, used_provider)
+            self._cache_answer(embedding, provider, top_k, mode, response, index_version)
+            return response
 
+        except ProviderOverloaded:
+            raise
         except Exception as e:
-            print(f"Error al llamar a Groq: {e}")
-            return {
-                "answer": f"Error al generar respuesta: {str(e)}",
-                "sources": [meta.get("source", "desconocido") for meta in matched_metadatas],
-                "context": matched_texts
-            }
+            return self._generation_error(provider, prepared, e)
+
+    async def answer_questions_batch(self, questions: list) -> list:
+        """
+        Responde varias preguntas a la vez. questions: lista de dicts con
+        question, provider, top_k y mode. Todas las preguntas se embeben en una sola llamada
+        y se buscan con una sola consulta multi-embedding; las generaciones corren en
+        paralelo con un límite por proveedor. Devuelve los resultados en el mismo orden;
+        el fallo de una pregunta no afecta a las demás (queda con la clave "error").
+        """
+        if not self.initialized:
+            return [{
+                "answer": "El sistema RAG no está inicializado. Por favor, sube documentos PDF primero.",
+                "sources": [],
+                "context": [],
+                "error": "not_initialized",
+            } for _ in questions]
+        if not questions:
+            return []
+
+        start_time = time.time()
+        texts = [item["question"] for item in questions]
+        try:
+            with span("embed_batch"):
+                embeddings = await self.embedding_service.aembed_queries(texts)
+        except Exception as e:
+            return [{"answer": f"Error al generar embeddings: {e}", "sources": [], "context": [], "error": str(e)}
+                    for _ in questions]
 
+        responses = [None] * len(questions)
+        pending = []
+        index_version = self.embedding_service.index_version
+        for i, (item, embedding) in enumerate(zip(questions, embeddings)):
+            cached = self._get_cached_answer(embedding, item["provider"], item["top_k"], item["mode"], start_time)
+            if cached:
+                responses[i] = cached
+            else:
+                pending.append(i)
+
+        if pending:
+            results = await asyncio.to_thread(
+                self._retrieve_many,
+                [embeddings[i] for i in pending],
+                [texts[i] for i in pending],
+                [questions[i]["top_k"] for i in pending],
+            )
+
+            async def generate(i, result):
+                item = questions[i]
+                async with self._get_provider_semaphore(item["provider"]):
+                    return await self._agenerate_answer(
+                        item["question"], item["provider"], item["top_k"], item["mode"],
+                        embeddings[i], start_time, index_version, result,
+                    )
+
+            generated = await asyncio.gather(
+                *(generate(i, result) for i, result in zip(pending, results)), return_exceptions=True
+            )
+            for i, response in zip(pending, generated):
+                if isinstance(response, Exception):
+                    logger.error(f"Error en la pregunta {i} del lote: {response}")
+                    error = response
+                    response = {
+                        "answer": f"Error al generar respuesta: {error}",
+                        "sources": [],
+                        "context": [],
+                        "error": str(error),
+                    }
+                    if isinstance(error, ProviderOverloaded):
+                        response["retry_after"] = error.retry_after
+                responses[i] = response
+        return responses
+
+    async def stream_answer(self, question: str, provider: str, top_k: int = 3, mode: str = "breve"):
+        """
+        Variante en streaming de answer_question_async. Genera eventos (nombre, datos):
+        - "sources": fuentes recuperadas, antes de llamar al LLM
+        - "token": fragmentos de texto a medida que llegan de Groq/OpenAI
+        - "done": tokens usados, costo y latencia por etapa
+        - "error": si algo falla (el stream termina después)
+        """
+        if not self.initialized:
+            yield "error", {"detail": "El sistema RAG no está inicializado. Por favor, sube documentos PDF primero."}
+            return
+        if mode not in RESPONSE_MODES:
+            yield "error", {"detail": f"Modo de respuesta no soportado: {mode!r}"}
+            return
+        if self.single_flight is None:
+            async for event in self._stream_answer(question, provider, top_k, mode):
+                yield event
+            return
+
+        # Un stream idéntico en curso se comparte: se reciben sus eventos ya emitidos y los siguientes
+        start_time = time.time()
+        async for (name, data), shared in self.single_flight.stream(
+            coalesce_key(question, mode, provider, top_k),
+            lambda: self._stream_answer(question, provider, top_k, mode),
+        ):
+            if shared and name == "done":
+                data = self._coalesced_consumption(data, start_time)
+            yield name, data
+
+    async def _stream_answer(self, question: str, provider: str, top_k: int, mode: str):
+        async with self._get_semaphore():
+            start_time = time.time()
+            timings = {}
+
+            # 1. Embedding de la pregunta (o respuesta cacheada)
+            embedding = await self.embedding_service.aembed_query(question)
+            timings["embedding_sec"] = time.time() - start_time
+            observe_stage("embed_query", timings["embedding_sec"])
+            index_version = self.embedding_service.index_version
+            cached = self._get_cached_answer(embedding, provider, top_k, mode, start_time)
+            if cached:
+                yield "sources", {"sources": cached["sources"], "cache_hit": True}
+                yield "token", {"text": cached["answer"]}
+                yield "done", {**cached["consumption"], "timings": timings}
+                return
+
+            # 2-3. Búsqueda (vectorial + BM25), contexto y prompts: los mismos que en /question
+            prepared = await self._aprepare_generation(question, provider, top_k, mode, embedding)
+            if "retrieval_sec" in prepared:
+                timings["retrieval_sec"] = prepared["retrieval_sec"]
+            if "prompt_build_sec" in prepared:
+                timings["prompt_build_sec"] = prepared["prompt_build_sec"]
+
+            # Solo las fuentes que entraron al contexto
+            yield "sources", {"sources": prepared["sources"], "cache_hit": False}
+            if "error" in prepared:
+                yield "error", {"detail": prepared["error"]["answer"]}
+                return
+
+            # 4. Generación en streaming
+            stage_start = time.time()
+            answer_parts = []
+            usage = None
+            try:
+                def stream_kwargs(p: str) -> dict:
+                    kwargs = prepared["kwargs"](p)
+                    if p == "openai":
+                        kwargs["stream_options"] = {"include_usage": True}
+                    return kwargs
+
+                # El fallback solo aplica si falla la apertura del stream (antes del primer token)
+                stream, used_provider = await self.client_factory.astream(provider, stream_kwargs)
+                async for chunk in stream:
+                    # OpenAI envía el uso en el último chunk; Groq en chunk.x_groq.usage
+                    usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not answer_parts:
+                            timings["time_to_first_token_sec"] = time.time() - stage_start
+                            observe_stage("llm_ttft", timings["time_to_first_token_sec"], provider)
+                        answer_parts.append(delta)
+                        yield "token", {"text": delta}
+            except ProviderOverloaded as e:
+                yield "error", {"detail": str(e), "retry_after": e.retry_after}
+                return
+            except Exception as e:
+                metrics.LLM_ERRORS.inc(provider=provider)
+                logger.error(f"Error al llamar a {provider}: {e}")
+                yield "error", {"detail": f"Error al generar respuesta: {str(e)}"}
+                return
+            timings["generation_sec"] = time.time() - stage_start
+            observe_stage("llm_generation", timings["generation_sec"], provider)
+            observe_stage("total", time.time() - start_time, provider)
+
+            answer = "".join(answer_parts)
+            response = {
+                "answer": answer,
+                "sources": prepared["sources"],
+                "context": prepared["texts"],
+                "consumption": self._consumption(usage, used_provider, prepared, answer, start_time),
+            }
+            self._cache_answer(embedding, provider, top_k, mode, response, index_version)
+            yield "done", {**response["consumption"], "timings": timings}
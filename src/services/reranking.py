@@ -0,0 +1,142 @@
+"""
+Re-ranking entre la recuperación y el prompt:
+1. MMR (maximal marginal relevance) vectorizado sobre los embeddings de los candidatos:
+   elige chunks relevantes para la pregunta pero poco parecidos entre sí.
+2. Deduplicación por solape: los chunks de la misma fuente y página que se solapan
+   (chunk_overlap del splitter) o están contenidos en otro se fusionan o descartan.
+Así el contexto trae la misma evidencia con menos tokens repetidos.
+"""
+import numpy as np
+
+# Peso de la relevancia frente a la diversidad (1.0 = solo relevancia)
+MMR_LAMBDA = 0.7
+# Solape mínimo (caracteres) para considerar que dos chunks son contiguos
+MIN_MERGE_OVERLAP = 20
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select(query_embedding, candidate_embeddings, k: int, lambda_mult: float = MMR_LAMBDA,
+               relevance=None) -> list:
+    """
+    Devuelve los índices (en orden de selección) de los k candidatos elegidos por MMR:
+    argmax  lambda * relevancia(d) - (1 - lambda) * max_{s elegido} sim(d, s)
+    relevance: relevancia ya calculada (p.ej. scores de fusión RRF); por defecto coseno con la consulta.
+    """
+    candidates = _normalize(np.asarray(candidate_embeddings, dtype=np.float32))
+    n = len(candidates)
+    if n == 0 or k <= 0:
+        return []
+    if relevance is None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        relevance = candidates @ (query / (np.linalg.norm(query) or 1.0))
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread else np.ones(n, dtype=np.float32)
+
+    similarity = candidates @ candidates.T
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(k, n) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def _overlap(first: str, second: str, min_overlap: int) -> int:
+    """Largo del sufijo de `first` que es prefijo de `second` (0 si es menor que min_overlap)"""
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    probe = second[:min_overlap]
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(probe, start + 1)
+    return 0
+
+
+def merge_overlapping_chunks(texts: list, metadatas: list, ids: list = None,
+                             min_overlap: int = MIN_MERGE_OVERLAP) -> tuple:
+    """
+    Fusiona chunks de la misma fuente y página que se solapan y descarta los contenidos en
+    otro. El resultado conserva el orden de relevancia (cada fusión ocupa la posición del
+    chunk mejor rankeado). Devuelve (texts, metadatas, ids).
+    """
+    items = [
+        {"text": text, "metadata": metadata, "ids": [ids[i]] if ids else []}
+        for i, (text, metadata) in enumerate(zip(texts, metadatas))
+    ]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(items)):
+            for j in range(i + 1, len(items)):
+                a, b = items[i], items[j]
+                if (a["metadata"].get("source"), a["metadata"].get("page")) != \
+                        (b["metadata"].get("source"), b["metadata"].get("page")):
+                    continue
+                if b["text"] in a["text"]:
+                    text = a["text"]
+                elif a["text"] in b["text"]:
+                    text = b["text"]
+                elif overlap := _overlap(a["text"], b["text"], min_overlap):
+                    text = a["text"] + b["text"][overlap:]
+                elif overlap := _overlap(b["text"], a["text"], min_overlap):
+                    text = b["text"] + a["text"][overlap:]
+                else:
+                    continue
+                a["text"] = text
+                a["ids"] = a["ids"] + b["ids"]
+                del items[j]
+                merged = True
+                break
+            if merged:
+                break
+    return (
+        [item["text"] for item in items],
+        [item["metadata"] for item in items],
+        [chunk_id for item in items for chunk_id in item["ids"][:1]],
+    )
+
+
+def rerank_results(results: dict, query_embedding, k: int, lambda_mult: float = MMR_LAMBDA,
+                   min_overlap: int = MIN_MERGE_OVERLAP) -> dict:
+    """
+    Aplica MMR + deduplicación a un resultado con forma de collection.query que incluya
+    "embeddings". Devuelve la misma forma con como mucho k chunks (sin embeddings).
+    """
+    ids = results.get("ids", [[]])[0]
+    embeddings = results.get("embeddings", [[]])[0]
+    if not ids or embeddings is None or len(embeddings) == 0:
+        # Sin embeddings no hay MMR: los k mejores de los candidatos pedidos de más
+        return {
+            "ids": [ids[:k]],
+            "documents": [results.get("documents", [[]])[0][:k]],
+            "metadatas": [results.get("metadatas", [[]])[0][:k]],
+            "candidates": len(ids),
+        }
+    fusion_scores = results.get("fusion_scores", [None])[0]
+    order = mmr_select(query_embedding, embeddings, k, lambda_mult, relevance=fusion_scores)
+
+    texts = [results["documents"][0][i] for i in order]
+    metadatas = [results["metadatas"][0][i] for i in order]
+    selected_ids = [ids[i] for i in order]
+    texts, metadatas, selected_ids = merge_overlapping_chunks(texts, metadatas, selected_ids, min_overlap)
+    return {
+        "ids": [selected_ids],
+        "documents": [texts],
+        "metadatas": [metadatas],
+        "candidates": len(ids),
+    }
@@ -0,0 +1,128 @@
+"""
+Índice compartido entre procesos: un builder lo publica y los workers lo leen con mmap.
+
+Con varios workers de uvicorn cada uno armaba su propia colección en memoria (N copias de
+cada vector) y, si faltaba el artefacto, N reindexaciones completas con OpenAI al arrancar.
+INDEX_ROLE define qué hace cada proceso:
+- standalone (default): como siempre, un proceso que indexa y responde.
+- builder: el único proceso que ingesta (arranque, /upload_pdf, /rebuild_index). Cada vez
+  que el índice cambia exporta una generación nueva a SHARED_INDEX_DIR/gen-NNNNNN (artefacto
+  float32 con normas y offsets de los chunks, más el BM25 congelado) y la publica
+  reemplazando el puntero CURRENT con un rename atómico.
+- reader: no parsea ni embebe documentos. Espera la primera generación, la abre con mmap
+  (las páginas del page cache son las mismas para todos los workers) y cada INDEX_POLL_SEC
+  relee CURRENT; si cambió, pasa a la generación nueva de una sola vez.
+
+Una generación no se modifica después de publicada. El builder borra las viejas y conserva
+INDEX_KEEP_GENERATIONS, y nunca la vigente ni la anterior (un reader que leyó CURRENT justo
+antes de una publicación puede estar abriéndola). Un worker que todavía usa una borrada la
+sigue leyendo (en Linux el archivo vive mientras esté mapeado); si la borran mientras la
+abre, relee CURRENT y abre la nueva (OPEN_ATTEMPTS intentos).
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from src.services import metrics
+from src.services.embedding_store import EmbeddingArtifact, save_embedding_artifact
+from src.services.lexical_index import FrozenBM25Index
+
+logger = logging.getLogger(__name__)
+
+INDEX_ROLE = os.getenv("INDEX_ROLE", "standalone").lower()
+SHARED_INDEX_DIR = os.getenv("SHARED_INDEX_DIR", "./shared_index")
+# Cada cuánto un reader mira si hay una generación nueva
+INDEX_POLL_SEC = float(os.getenv("INDEX_POLL_SEC", "2"))
+INDEX_KEEP_GENERATIONS = int(os.getenv("INDEX_KEEP_GENERATIONS", "3"))
+
+INDEX_ROLES = ("standalone", "builder", "reader")
+CURRENT_FILENAME = "CURRENT"
+GENERATION_PREFIX = "gen-"
+# Intentos de abrir la generación vigente si desaparece entre leer CURRENT y mapearla
+OPEN_ATTEMPTS = 3
+
+GENERATION = metrics.REGISTRY.gauge(
+    "rag_shared_index_generation", "Generación del índice compartido publicada (builder) o en uso (reader)"
+)
+PUBLISH_SECONDS = metrics.REGISTRY.histogram(
+    "rag_shared_index_publish_seconds", "Tiempo de exportar y publicar una generación del índice compartido"
+)
+
+
+class SharedIndex:
+    """Carpeta con las generaciones publicadas y el puntero CURRENT a la vigente"""
+
+    def __init__(self, root: Path = Path(SHARED_INDEX_DIR), keep: int = INDEX_KEEP_GENERATIONS):
+        self.root = Path(root)
+        self.keep = max(1, keep)
+
+    def current(self) -> Optional[dict]:
+        """Puntero a la generación vigente (None si todavía no se publicó ninguna)"""
+        try:
+            with open(self.root / CURRENT_FILENAME, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Puntero del índice compartido ilegible: {e}")
+            return None
+
+    def publish(self, ids: list, texts: list, metadatas: list, embeddings, embedding_model: Optional[str],
+                source: dict = None) -> dict:
+        """
+        Escribe una generación completa en un directorio temporal, la renombra a gen-NNNNNN y
+        recién entonces apunta CURRENT a ella: un reader nunca ve una generación a medias.
+        Los vectores van siempre en float32 para que los readers los usen sin copiarlos.
+        source identifica el índice del builder que se publicó (para no republicarlo igual).
+        """
+        start = time.perf_counter()
+        self.root.mkdir(parents=True, exist_ok=True)
+        generation = (self.current() or {}).get("generation", 0) + 1
+        name = f"{GENERATION_PREFIX}{generation:06d}"
+        tmp_dir = self.root / f".{name}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        save_embedding_artifact(tmp_dir, ids, texts, metadatas, embeddings, embedding_model, dtype="float32")
+        FrozenBM25Index.from_texts(ids, texts).save(tmp_dir)
+        # Restos de una publicación interrumpida con el mismo número
+        shutil.rmtree(self.root / name, ignore_errors=True)
+        os.replace(tmp_dir, self.root / name)
+
+        pointer = {
+            "generation": generation,
+            "path": name,
+            "document_count": len(ids),
+            "embedding_model": embedding_model,
+            "source": source,
+            "published_at": time.time(),
+        }
+        tmp_pointer = self.root / (CURRENT_FILENAME + ".tmp")
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            json.dump(pointer, f, indent=2)
+        os.replace(tmp_pointer, self.root / CURRENT_FILENAME)
+
+        GENERATION.set(generation)
+        PUBLISH_SECONDS.observe(time.perf_counter() - start)
+        logger.info(f"📢 Índice compartido: generación {generation} publicada con {len(ids)} documentos "
+                    f"en {time.perf_counter() - start:.2f}s")
+        self._prune(generation)
+        return pointer
+
+    def open(self, pointer: dict) -> tuple:
+        """(EmbeddingArtifact, FrozenBM25Index o None) de una generación publicada"""
+        directory = self.root / pointer["path"]
+        artifact = EmbeddingArtifact(directory)
+        lexical = FrozenBM25Index.load(directory, artifact.ids) if FrozenBM25Index.exists(directory) else None
+        return artifact, lexical
+
+    def _prune(self, generation: int):
+        """Borra las generaciones más allá de las últimas `keep`, salvo la vigente y la anterior"""
+        protected = {f"{GENERATION_PREFIX}{number:06d}" for number in (generation, generation - 1)}
+        generations = sorted(path for path in self.root.glob(f"{GENERATION_PREFIX}*") if path.is_dir())
+        for path in generations[:-self.keep]:
+            if path.name not in protected:
+                shutil.rmtree(path, ignore_errors=True)
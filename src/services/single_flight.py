@@ -0,0 +1,119 @@
+"""
+Single-flight: pedidos idénticos que llegan mientras otro igual está en curso no repiten
+embedding, búsqueda ni generación; esperan el resultado del primero.
+
+La clave es la pregunta normalizada (NFC, minúsculas, espacios colapsados) más modo,
+proveedor y top_k. El cálculo corre en una tarea propia, así que si el pedido que lo
+inició se cancela (el cliente cortó) los que esperan igual reciben el resultado.
+
+Para streaming, los eventos se guardan mientras dure el cálculo: quien se suma tarde
+recibe primero los ya emitidos y después los nuevos a medida que llegan.
+"""
+import asyncio
+import logging
+
+from src.services import metrics
+from src.services.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+COALESCED = metrics.REGISTRY.counter(
+    "rag_coalesced_requests", "Pedidos que esperaron el resultado de uno idéntico en curso", ("kind",)
+)
+
+
+def coalesce_key(question: str, mode: str, provider: str, top_k: int) -> tuple:
+    return normalize_text(question), mode, provider, top_k
+
+
+class _StreamFlight:
+    """Eventos emitidos hasta ahora por un stream compartido"""
+
+    def __init__(self):
+        self.events = []
+        self.error = None
+        self.done = False
+        self.changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def produce(self, agen):
+        try:
+            async for event in agen:
+                self.events.append(event)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self):
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self.changed.wait()
+
+
+class SingleFlight:
+    """Cálculos en curso por clave (los futures pertenecen a un event loop: se recrean por loop)"""
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._loop = None
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._calls, self._streams = {}, {}
+            self._loop = loop
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    async def run(self, key, factory):
+        """
+        Devuelve (resultado, compartido): compartido=True si el resultado es de un pedido
+        idéntico que ya estaba en curso. factory() crea la corrutina del cálculo.
+        """
+        self._check_loop()
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            COALESCED.inc(kind="question")
+            logger.debug(f"🔗 Pedido idéntico en curso, se espera su resultado: {key[0][:60]}")
+        else:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: cancelar a un pedido no cancela el cálculo que comparten los demás
+        return await asyncio.shield(task), shared
+
+    async def stream(self, key, factory):
+        """
+        Itera los eventos del stream de factory() (un generador async) compartiéndolo con los
+        pedidos idénticos en curso. Genera (evento, compartido).
+        """
+        self._check_loop()
+        flight = self._streams.get(key)
+        shared = flight is not None
+        if shared:
+            COALESCED.inc(kind="stream")
+            logger.debug(f"🔗 Stream idéntico en curso, se comparte: {key[0][:60]}")
+        else:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            task = asyncio.ensure_future(flight.produce(factory()))
+            task.add_done_callback(lambda _: self._streams.pop(key, None))
+        async for event in flight.subscribe():
+            yield event, shared
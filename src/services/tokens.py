@@ -0,0 +1,26 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Caracteres por token aproximados para texto en español (estimación conservadora)
+CHARS_PER_TOKEN = 3
+
+# tiktoken está en requirements.txt; si falta (o no se pudo descargar el vocabulario) se
+# estima por caracteres, lo que afecta los lotes de embeddings, el presupuesto de contexto
+# y los costos estimados: por eso se avisa como warning
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:  # ImportError o falta de red para descargar el vocabulario
+    logger.warning(f"⚠️ tiktoken no disponible ({e}): los tokens se estimarán como "
+                   f"caracteres // {CHARS_PER_TOKEN} + 1 (conteos aproximados)")
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Cuenta tokens con tiktoken (cl100k_base) o los estima por longitud"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
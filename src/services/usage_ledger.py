@@ -0,0 +1,241 @@
+"""
+Registro de consumo por pedido (tokens, costo, latencia) con escritura por lotes fuera
+del camino de la respuesta.
+
+record() solo encola el registro (queue.Queue.put_nowait, microsegundos); un hilo en
+segundo plano junta hasta USAGE_LEDGER_BATCH_SIZE registros o espera USAGE_LEDGER_FLUSH_SEC
+y los escribe de una vez: un INSERT por lote en SQLite (una transacción) o un solo write
+en JSONL. Si la cola se llena el registro se descarta (y se cuenta) antes que frenar /question.
+
+rollup() agrega por intervalos de tiempo (minuto, hora o día, en UTC) y proveedor/modelo
+para /usage.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from src.services import metrics
+
+logger = logging.getLogger(__name__)
+
+USAGE_LEDGER_ENABLED = os.getenv("USAGE_LEDGER_ENABLED", "true").lower() == "true"
+USAGE_LEDGER_BACKEND = os.getenv("USAGE_LEDGER_BACKEND", "sqlite").lower()  # sqlite | jsonl
+USAGE_LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", "./logs/usage.sqlite")
+USAGE_LEDGER_FLUSH_SEC = float(os.getenv("USAGE_LEDGER_FLUSH_SEC", "1.0"))
+USAGE_LEDGER_BATCH_SIZE = int(os.getenv("USAGE_LEDGER_BATCH_SIZE", "500"))
+USAGE_LEDGER_MAX_QUEUE = int(os.getenv("USAGE_LEDGER_MAX_QUEUE", "10000"))
+
+BUCKET_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# Columnas de cada registro (en este orden en SQLite)
+FIELDS = (
+    "ts", "request_id", "endpoint", "provider", "model", "mode", "top_k",
+    "prompt_tokens", "completion_tokens", "tokens_used", "context_tokens",
+    "cost_usd", "latency_sec", "cache_hit", "error",
+)
+
+RECORDS_DROPPED = metrics.REGISTRY.counter(
+    "rag_usage_records_dropped", "Registros de consumo descartados porque la cola estaba llena"
+)
+
+_FLUSH = object()
+_STOP = object()
+
+
+def usage_record(endpoint: str, provider: str, mode: str, top_k: int, consumption: dict = None,
+                 error: str = None, request_id: str = None) -> dict:
+    """Registro del ledger a partir del dict consumption de una respuesta"""
+    consumption = consumption or {}
+    return {
+        "ts": time.time(),
+        "request_id": request_id or metrics.request_id_var.get(),
+        "endpoint": endpoint,
+        # El proveedor que respondió (con fallback puede no ser el pedido)
+        "provider": consumption.get("provider") or provider,
+        "model": consumption.get("model"),
+        "mode": mode,
+        "top_k": top_k,
+        "prompt_tokens": consumption.get("prompt_tokens"),
+        "completion_tokens": consumption.get("completion_tokens"),
+        "tokens_used": consumption.get("tokens_used"),
+        "context_tokens": consumption.get("context_tokens"),
+        "cost_usd": consumption.get("cost_estimated"),
+        "latency_sec": consumption.get("latency_sec"),
+        "cache_hit": bool(consumption.get("cache_hit")),
+        "error": error,
+    }
+
+
+class UsageLedger:
+    def __init__(self, path: str = USAGE_LEDGER_PATH, backend: str = USAGE_LEDGER_BACKEND,
+                 flush_interval: float = USAGE_LEDGER_FLUSH_SEC, batch_size: int = USAGE_LEDGER_BATCH_SIZE,
+                 max_queue: int = USAGE_LEDGER_MAX_QUEUE):
+        if backend not in ("sqlite", "jsonl"):
+            raise ValueError(f"Backend de consumo no soportado: {backend}")
+        self.path = Path(path)
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._db_lock = threading.Lock()
+        self._db = None
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if backend == "sqlite":
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "ts REAL NOT NULL, request_id TEXT, endpoint TEXT, provider TEXT, model TEXT, mode TEXT, "
+                "top_k INTEGER, prompt_tokens INTEGER, completion_tokens INTEGER, tokens_used INTEGER, "
+                "context_tokens INTEGER, cost_usd REAL, latency_sec REAL, cache_hit INTEGER, error TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+            self._db.commit()
+
+        self._writer = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+        self._writer.start()
+
+    def record(self, entry: dict) -> bool:
+        """Encola un registro sin bloquear; False si se descartó por cola llena"""
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            RECORDS_DROPPED.inc()
+            return False
+
+    def flush(self, timeout: float = 5.0):
+        """Espera a que lo encolado hasta ahora quede escrito"""
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait(timeout)
+
+    def close(self):
+        self._queue.put((_STOP, None))
+        self._writer.join(timeout=10)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+
+    def _run(self):
+        while True:
+            batch, control = [], None
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if isinstance(item, tuple) and item and item[0] in (_FLUSH, _STOP):
+                    control = item
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._write(batch)
+                    self.written += len(batch)
+                except Exception as e:
+                    logger.error(f"⚠️ No se pudieron escribir {len(batch)} registros de consumo: {e}")
+            if control is not None:
+                if control[0] is _STOP:
+                    return
+                control[1].set()
+
+    def _write(self, batch: list):
+        if self.backend == "jsonl":
+            lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            return
+        rows = [tuple(entry.get(name) for name in FIELDS) for entry in batch]
+        with self._db_lock:
+            self._db.executemany(
+                f"INSERT INTO usage ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})", rows
+            )
+            self._db.commit()
+
+    def rollup(self, bucket: str = "hour", since: Optional[float] = None, until: Optional[float] = None,
+               by_model: bool = True) -> list:
+        """
+        Totales por intervalo de `bucket` (minute/hour/day, UTC) y, con by_model, por
+        proveedor y modelo. since/until: timestamps Unix (opcionales).
+        """
+        width = BUCKET_SECONDS[bucket]
+        self.flush()
+        since = since if since is not None else 0.0
+        until = until if until is not None else float("inf")
+
+        if self.backend == "sqlite":
+            group = "bucket, provider, model" if by_model else "bucket"
+            where, params = "ts >= ?", [since]
+            if until != float("inf"):
+                where, params = where + " AND ts < ?", params + [until]
+            with self._db_lock:
+                rows = self._db.execute(
+                    f"SELECT CAST(ts / {width} AS INTEGER) * {width} AS bucket, "
+                    f"{'provider, model' if by_model else 'NULL, NULL'}, COUNT(*), "
+                    "SUM(cache_hit), SUM(error IS NOT NULL), COALESCE(SUM(prompt_tokens), 0), "
+                    "COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(tokens_used), 0), "
+                    "COALESCE(SUM(cost_usd), 0), AVG(latency_sec), MAX(latency_sec) "
+                    f"FROM usage WHERE {where} GROUP BY {group} ORDER BY {group}",
+                    params,
+                ).fetchall()
+            return [self._bucket_row(*row) for row in rows]
+
+        totals = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if not since <= entry["ts"] < until:
+                        continue
+                    key = (int(entry["ts"] // width) * width,
+                           entry.get("provider") if by_model else None, entry.get("model") if by_model else None)
+                    acc = totals.setdefault(key, [0, 0, 0, 0, 0, 0, 0.0, 0.0, 0, None])
+                    acc[0] += 1
+                    acc[1] += bool(entry.get("cache_hit"))
+                    acc[2] += entry.get("error") is not None
+                    acc[3] += entry.get("prompt_tokens") or 0
+                    acc[4] += entry.get("completion_tokens") or 0
+                    acc[5] += entry.get("tokens_used") or 0
+                    acc[6] += entry.get("cost_usd") or 0.0
+                    if entry.get("latency_sec") is not None:
+                        acc[7] += entry["latency_sec"]
+                        acc[8] += 1
+                        acc[9] = max(acc[9] or 0.0, entry["latency_sec"])
+        return [
+            self._bucket_row(bucket_start, provider, model, *acc[:7],
+                             acc[7] / acc[8] if acc[8] else None, acc[9])
+            for (bucket_start, provider, model), acc in sorted(
+                totals.items(), key=lambda item: (item[0][0], item[0][1] or "", item[0][2] or ""))
+        ]
+
+    @staticmethod
+    def _bucket_row(bucket_start, provider, model, requests, cache_hits, errors, prompt_tokens,
+                    completion_tokens, tokens_used, cost_usd, avg_latency, max_latency) -> dict:
+        return {
+            "start": datetime.fromtimestamp(bucket_start, tz=timezone.utc).isoformat(),
+            "provider": provider,
+            "model": model,
+            "requests": requests,
+            "cache_hits": int(cache_hits or 0),
+            "errors": int(errors or 0),
+            "prompt_tokens": int(prompt_tokens),
+            "completion_tokens": int(completion_tokens),
+            "tokens_used": int(tokens_used),
+            "cost_usd": round(float(cost_usd), 6),
+            "avg_latency_sec": round(avg_latency, 4) if avg_latency is not None else None,
+            "max_latency_sec": round(max_latency, 4) if max_latency is not None else None,
+        }
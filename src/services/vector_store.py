@@ -0,0 +1,395 @@
+"""
+Backends de almacenamiento y búsqueda vectorial.
+
+RAGService / EmbeddingServiceChroma hablan con la interfaz VectorStore; hay dos backends:
+- ChromaVectorStore: la colección de ChromaDB (en memoria o PersistentClient)
+- NumpyVectorStore: matriz float32 contigua en el mismo proceso, top-k con un producto
+  matriz-vector. Opcionalmente cuantiza a int8 (1 byte por dimensión) y reordena los
+  mejores candidatos con los vectores float32.
+
+Todas las búsquedas devuelven la misma forma que collection.query de ChromaDB
+({"ids": [[...]], "documents": [[...]], "metadatas": [[...]], "distances": [[...]]}) con
+distancia L2 al cuadrado, la métrica por defecto de ChromaDB.
+"""
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHROMA_BATCH_SIZE = 5000
+# Filas por bloque al recorrer la matriz int8 (acota la memoria temporal de la conversión)
+INT8_SCAN_BLOCK = 4096
+
+
+class VectorStore:
+    """Interfaz común de los backends vectoriales"""
+
+    name = "base"
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def upsert(self, ids: list, texts: list, metadatas: list, embeddings):
+        raise NotImplementedError
+
+    def delete(self, ids: list):
+        raise NotImplementedError
+
+    def get(self, ids: list = None, include=("documents", "metadatas"), limit: int = None, offset: int = 0) -> dict:
+        """Documentos por id o paginados; include admite documents, metadatas y embeddings"""
+        raise NotImplementedError
+
+    def query(self, embedding, n_results: int = 5, include_embeddings: bool = False) -> dict:
+        """Top-k con forma de collection.query; include_embeddings agrega la clave embeddings"""
+        raise NotImplementedError
+
+    def query_many(self, embeddings, n_results: int = 5, include_embeddings: bool = False) -> list:
+        """Varias consultas a la vez; devuelve un resultado (forma de query) por consulta"""
+        return [self.query(embedding, n_results, include_embeddings) for embedding in embeddings]
+
+    def reset(self):
+        raise NotImplementedError
+
+    def load_artifact(self, artifact, batch_size: int = CHROMA_BATCH_SIZE):
+        """Carga un EmbeddingArtifact (embeddings precomputados) en el backend"""
+        for ids, texts, metadatas, embeddings in artifact.iter_batches(batch_size):
+            self.upsert(ids, texts, metadatas, embeddings)
+
+    def memory_bytes(self) -> int:
+        """Memoria de los vectores en RAM (None si el backend no lo sabe)"""
+        return None
+
+
+class ChromaVectorStore(VectorStore):
+    name = "chroma"
+
+    def __init__(self, client, collection_name: str):
+        self.client = client
+        self.collection_name = collection_name
+        self.collection = client.get_or_create_collection(name=collection_name)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def upsert(self, ids: list, texts: list, metadatas: list, embeddings):
+        for start in range(0, len(ids), CHROMA_BATCH_SIZE):
+            end = start + CHROMA_BATCH_SIZE
+            self.collection.upsert(
+                documents=texts[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
+
+    def delete(self, ids: list):
+        for start in range(0, len(ids), CHROMA_BATCH_SIZE):
+            self.collection.delete(ids=ids[start:start + CHROMA_BATCH_SIZE])
+
+    def get(self, ids: list = None, include=("documents", "metadatas"), limit: int = None, offset: int = 0) -> dict:
+        if ids is not None:
+            return self.collection.get(ids=ids, include=list(include))
+        return self.collection.get(include=list(include), limit=limit, offset=offset)
+
+    def query(self, embedding, n_results: int = 5, include_embeddings: bool = False) -> dict:
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+        return self.collection.query(query_embeddings=[embedding], n_results=n_results, include=include)
+
+    def query_many(self, embeddings, n_results: int = 5, include_embeddings: bool = False) -> list:
+        # Una sola llamada a collection.query con todas las consultas
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+        response = self.collection.query(query_embeddings=list(embeddings), n_results=n_results, include=include)
+        keys = ["ids"] + include
+        return [{key: [response[key][i]] for key in keys} for i in range(len(embeddings))]
+
+    def reset(self):
+        self.client.delete_collection(self.collection_name)
+        self.collection = self.client.get_or_create_collection(name=self.collection_name)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vectores en una matriz float32 contigua (filas = chunks) con capacidad que se duplica
+    al crecer. La búsqueda calcula ||x||² - 2·x·q + ||q||² para todas las filas con un solo
+    producto matriz-vector (BLAS) y selecciona el top-k con argpartition.
+
+    quantization="int8": cada fila se guarda además como int8 con su escala (max|x| / 127).
+    La búsqueda recorre la matriz int8 (4x menos memoria que float32) y reordena los
+    n_results * rescore_factor mejores candidatos con los vectores float32 exactos.
+    Si los float32 vienen de un artefacto mmap, solo se leen del disco esas filas.
+
+    Las búsquedas no toman el lock: leen una instantánea del estado y las escrituras
+    publican el estado nuevo al final.
+    """
+
+    name = "numpy"
+
+    def __init__(self, quantization: str = "none", rescore_factor: int = 4):
+        if quantization not in ("none", "int8"):
+            raise ValueError(f"Cuantización no soportada: {quantization}")
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._lock = threading.Lock()
+        self._state = self._empty_state()
+
+    @staticmethod
+    def _empty_state(dimension: int = 0, capacity: int = 0) -> dict:
+        return {
+            "size": 0,
+            "ids": [],
+            "rows": {},
+            "texts": [],
+            "metadatas": [],
+            "matrix": np.zeros((capacity, dimension), dtype=np.float32),
+            "norms": np.zeros(capacity, dtype=np.float32),
+            "codes": None,
+            "scales": None,
+        }
+
+    def count(self) -> int:
+        return self._state["size"]
+
+    @property
+    def dimension(self) -> int:
+        return self._state["matrix"].shape[1]
+
+    def _quantize(self, vectors: np.ndarray) -> tuple:
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _grow(self, state: dict, needed: int, dimension: int, copy: bool = False) -> dict:
+        """
+        Copia el estado a arrays propios (escribibles) con capacidad para `needed` filas.
+        copy=True copia aunque la capacidad alcance (para sobrescribir filas existentes).
+        """
+        matrix = state["matrix"]
+        writeable = matrix.flags.writeable and state["norms"].flags.writeable and matrix.shape[1] == dimension
+        capacity = matrix.shape[0] if writeable else 0
+        if needed <= capacity and not copy:
+            return state
+        new_capacity = capacity if needed <= capacity else max(needed, 2 * capacity, 1024)
+        size = state["size"]
+        grown = dict(state)
+        grown["matrix"] = np.zeros((new_capacity, dimension), dtype=np.float32)
+        grown["norms"] = np.zeros(new_capacity, dtype=np.float32)
+        if self.quantization == "int8":
+            grown["codes"] = np.zeros((new_capacity, dimension), dtype=np.int8)
+            grown["scales"] = np.zeros(new_capacity, dtype=np.float32)
+        if size:
+            grown["matrix"][:size] = matrix[:size]
+            grown["norms"][:size] = state["norms"][:size]
+            if self.quantization == "int8":
+                grown["codes"][:size] = state["codes"][:size]
+                grown["scales"][:size] = state["scales"][:size]
+        return grown
+
+    def upsert(self, ids: list, texts: list, metadatas: list, embeddings):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            state = self._state
+            if state["size"] and vectors.shape[1] != self.dimension:
+                raise ValueError(f"Dimensión {vectors.shape[1]} distinta a la del índice ({self.dimension})")
+            size = state["size"]
+            # Las listas se copian: las búsquedas en curso siguen viendo la instantánea anterior
+            state = dict(state, ids=list(state["ids"]), rows=dict(state["rows"]),
+                         texts=list(state["texts"]), metadatas=list(state["metadatas"]))
+
+            rows = []
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                row = state["rows"].get(doc_id)
+                if row is None:
+                    row = len(state["ids"])
+                    state["rows"][doc_id] = row
+                    state["ids"].append(doc_id)
+                    state["texts"].append(text)
+                    state["metadatas"].append(metadata)
+                else:
+                    state["texts"][row] = text
+                    state["metadatas"][row] = metadata
+                rows.append(row)
+
+            # Las filas nuevas van a la capacidad libre, que ninguna instantánea publicada ve.
+            # Una fila existente cuyo vector cambió se escribe sobre una copia (como en _grow):
+            # una búsqueda en curso puede estar leyendo la matriz, y las normas pueden ser el
+            # mmap del artefacto. Las que no cambiaron (reindexaciones que reutilizan los
+            # embeddings) no se tocan, así un upsert de IDs existentes no copia la matriz
+            rows = np.asarray(rows, dtype=np.int64)
+            existing = rows < size
+            changed = np.zeros(len(rows), dtype=bool)
+            if existing.any():
+                current = np.asarray(state["matrix"][rows[existing]], dtype=np.float32)
+                changed[existing] = np.any(current != vectors[existing], axis=1)
+            write = ~existing | changed
+            state = self._grow(state, len(state["ids"]), vectors.shape[1], copy=bool(changed.any()))
+            rows, vectors = rows[write], vectors[write]
+            if len(rows):
+                state["matrix"][rows] = vectors
+                state["norms"][rows] = np.einsum("ij,ij->i", vectors, vectors)
+                if self.quantization == "int8":
+                    state["codes"][rows], state["scales"][rows] = self._quantize(vectors)
+            state["size"] = len(state["ids"])
+            self._state = state
+
+    def delete(self, ids: list):
+        with self._lock:
+            state = self._state
+            drop = {state["rows"][doc_id] for doc_id in ids if doc_id in state["rows"]}
+            if not drop:
+                return
+            keep = np.asarray([row for row in range(state["size"]) if row not in drop], dtype=np.int64)
+            # Compactación: las filas restantes quedan contiguas en arrays nuevos
+            new_ids = [state["ids"][row] for row in keep]
+            new_state = {
+                "size": len(keep),
+                "ids": new_ids,
+                "rows": {doc_id: row for row, doc_id in enumerate(new_ids)},
+                "texts": [state["texts"][row] for row in keep],
+                "metadatas": [state["metadatas"][row] for row in keep],
+                "matrix": np.ascontiguousarray(state["matrix"][keep], dtype=np.float32),
+                "norms": state["norms"][keep].copy(),
+                "codes": state["codes"][keep].copy() if self.quantization == "int8" else None,
+                "scales": state["scales"][keep].copy() if self.quantization == "int8" else None,
+            }
+            self._state = new_state
+
+    def reset(self):
+        with self._lock:
+            self._state = self._empty_state()
+
+    def load_artifact(self, artifact, batch_size: int = CHROMA_BATCH_SIZE):
+        """
+        Adopta el artefacto sin copiar los vectores: la matriz float32 es el mmap del
+        artefacto (solo lectura), igual que las normas, los textos y la metadata si el
+        artefacto los trae (norms.npy, offsets.npy). La primera escritura posterior los
+        copia a memoria.
+        """
+        matrix = artifact.embeddings
+        if matrix.dtype != np.float32:
+            matrix = np.asarray(matrix, dtype=np.float32)
+        ids = artifact.ids
+        norms = artifact.norms
+        state = {
+            "size": len(ids),
+            "ids": ids,
+            "rows": {doc_id: row for row, doc_id in enumerate(ids)},
+            "texts": artifact.column("text"),
+            "metadatas": artifact.column("metadata"),
+            "matrix": matrix,
+            "norms": norms if norms is not None else np.zeros(len(ids), dtype=np.float32),
+            "codes": None,
+            "scales": None,
+        }
+        if self.quantization == "int8":
+            state["codes"] = np.zeros(matrix.shape, dtype=np.int8)
+            state["scales"] = np.zeros(len(ids), dtype=np.float32)
+        # Solo se recorre la matriz si falta algo derivado de ella (normas o códigos int8)
+        if norms is None or self.quantization == "int8":
+            for start in range(0, len(ids), batch_size):
+                block = np.asarray(matrix[start:start + batch_size], dtype=np.float32)
+                if norms is None:
+                    state["norms"][start:start + batch_size] = np.einsum("ij,ij->i", block, block)
+                if self.quantization == "int8":
+                    codes, scales = self._quantize(block)
+                    state["codes"][start:start + batch_size] = codes
+                    state["scales"][start:start + batch_size] = scales
+        with self._lock:
+            self._state = state
+
+    def get(self, ids: list = None, include=("documents", "metadatas"), limit: int = None, offset: int = 0) -> dict:
+        state = self._state
+        if ids is not None:
+            rows = [state["rows"][doc_id] for doc_id in ids if doc_id in state["rows"]]
+        else:
+            end = state["size"] if limit is None else min(state["size"], offset + limit)
+            rows = list(range(offset, end))
+        return self._rows_result(state, rows, include)
+
+    @staticmethod
+    def _rows_result(state: dict, rows: list, include) -> dict:
+        result = {"ids": [state["ids"][row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [state["texts"][row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [state["metadatas"][row] for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(state["matrix"][rows], dtype=np.float32)
+        return result
+
+    def query(self, embedding, n_results: int = 5, include_embeddings: bool = False) -> dict:
+        return self.query_many([embedding], n_results, include_embeddings)[0]
+
+    def query_many(self, embeddings, n_results: int = 5, include_embeddings: bool = False) -> list:
+        """Todas las consultas con un solo producto matriz-matriz (la matriz se recorre una vez)"""
+        state = self._state
+        size = state["size"]
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        if not size or n_results <= 0:
+            empty = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+            if include_embeddings:
+                empty["embeddings"] = [np.zeros((0, self.dimension), dtype=np.float32)]
+            return [dict(empty) for _ in range(len(queries))]
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        k = min(n_results, size)
+
+        if self.quantization == "int8":
+            # Búsqueda aproximada sobre int8 y reordenamiento exacto de los candidatos
+            approx = np.empty((size, len(queries)), dtype=np.float32)
+            for start in range(0, size, INT8_SCAN_BLOCK):
+                end = min(size, start + INT8_SCAN_BLOCK)
+                block = state["codes"][start:end].astype(np.float32) @ queries.T
+                approx[start:end] = block * state["scales"][start:end, None]
+            approx = state["norms"][:size, None] - 2 * approx
+        else:
+            distances = state["norms"][:size, None] - 2 * (state["matrix"][:size] @ queries.T) + query_norms[None, :]
+
+        include = ("documents", "metadatas", "embeddings") if include_embeddings else ("documents", "metadatas")
+        results = []
+        for column, query in enumerate(queries):
+            if self.quantization == "int8":
+                n_candidates = min(size, k * self.rescore_factor)
+                candidates = np.argpartition(approx[:, column], n_candidates - 1)[:n_candidates]
+                candidates.sort()  # lectura secuencial del mmap
+                candidate_distances = (state["norms"][candidates] - 2 * (state["matrix"][candidates] @ query)
+                                       + query_norms[column])
+                order = np.argsort(candidate_distances)[:k]
+                rows, row_distances = candidates[order], candidate_distances[order]
+            else:
+                column_distances = distances[:, column]
+                rows = np.argpartition(column_distances, k - 1)[:k] if k < size else np.arange(size)
+                rows = rows[np.argsort(column_distances[rows])]
+                row_distances = column_distances[rows]
+
+            result = self._rows_result(state, rows.tolist(), include)
+            results.append({
+                **{key: [values] for key, values in result.items()},
+                "distances": [np.maximum(row_distances, 0.0).tolist()],
+            })
+        return results
+
+    def memory_bytes(self) -> int:
+        state = self._state
+        size = state["size"]
+        total = 0
+        matrix = state["matrix"]
+        # Un mmap no cuenta como memoria propia (son páginas del page cache compartidas)
+        if not isinstance(matrix, np.memmap):
+            total += matrix[:size].nbytes
+        if state["codes"] is not None:
+            total += state["codes"][:size].nbytes + state["scales"][:size].nbytes
+        if not isinstance(state["norms"], np.memmap):
+            total += state["norms"][:size].nbytes
+        return total
+
+
+def create_vector_store(backend: str, client=None, collection_name: str = None,
+                        quantization: str = "none", rescore_factor: int = 4) -> VectorStore:
+    if backend == "chroma":
+        return ChromaVectorStore(client, collection_name)
+    if backend == "numpy":
+        return NumpyVectorStore(quantization=quantization, rescore_factor=rescore_factor)
+    raise ValueError(f"Backend vectorial no soportado: {backend}")
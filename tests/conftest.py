@@ -0,0 +1,9 @@
+"""
+Configuración común de pytest: las pruebas importan src.* desde la raíz del repo,
+igual que los scripts (que agregan la raíz al sys.path).
+"""
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
@@ -1,47 +1,398 @@
-import pandas as pd
-import requests
+"""
+Prueba de carga y benchmark de latencia de /question con las preguntas gold.
 
-# Rutas de tus archivos
-INPUT_CSV = "PreguntasGold.csv"
-OUTPUT_CSV = "preguntas_gold_con_respuestas.csv"
-BACKEND_URL = "http://localhost:8000/question" # Cambia si usas otro puerto/ruta
+Reproduce PreguntasGold.csv (más variaciones sintéticas de cada pregunta) contra la API
+con concurrencia fija (lazo cerrado) o con una tasa de llegadas Poisson (lazo abierto), y
+mide latencia p50/p95/p99, tasa de error y tokens por pedido. El reporte JSON incluye el
+commit y la configuración, para comparar corridas entre commits con --compare.
 
-def preguntar_al_chatbot(pregunta, model_provider="groq", mode="detallada", top_k=3):
+Con --offline levanta todo en local sin claves ni red: el stub de proveedores
+(tests/stub_providers.py, con latencias log-normales) y la API apuntada a él con
+OPENAI_BASE_URL / GROQ_BASE_URL, sobre un corpus sintético o el de --data-dir. Ejemplos:
+
+    python tests/preguntasGold.py --offline --concurrency 16 --variations 2 --report carga.json
+    python tests/preguntasGold.py --offline --rate 20 --requests 400 --compare carga.json
+    python tests/preguntasGold.py --url http://localhost:8000 --concurrency 1 --answers-csv respuestas.csv
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+INPUT_CSV = REPO_ROOT / "PreguntasGold.csv"
+BACKEND_URL = "http://localhost:8000"  # Cambia si usas otro puerto
+
+# Plantillas para variaciones sintéticas: misma intención, distinta redacción
+_PREFIXES = ("", "Explica brevemente: ", "En pocas palabras, ", "Según el material del curso, ",
+             "Quisiera saber lo siguiente: ", "Necesito entender esto: ")
+_SUFFIXES = ("", " Da un ejemplo.", " Responde de forma clara.", " ¿Por qué es importante?")
+
+
+def load_questions(path: Path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [row["Pregunta"].strip() for row in csv.DictReader(f) if row.get("Pregunta", "").strip()]
+
+
+def synthetic_variations(question: str, n: int, rng: random.Random) -> list:
+    """n reformulaciones de la pregunta (prefijo, sufijo, minúsculas, sin signos de apertura)"""
+    variations = []
+    for _ in range(n * 4):
+        if len(variations) >= n:
+            break
+        text = question
+        if rng.random() < 0.5:
+            text = text.lstrip("¿¡")
+        if rng.random() < 0.3:
+            text = text[0].lower() + text[1:]
+        text = rng.choice(_PREFIXES) + text + rng.choice(_SUFFIXES)
+        if text != question and text not in variations:
+            variations.append(text)
+    return variations
+
+
+def build_workload(questions: list, variations: int, total: int, seed: int) -> list:
+    rng = random.Random(seed)
+    pool = []
+    for question in questions:
+        pool.append(question)
+        pool.extend(synthetic_variations(question, variations, rng))
+    if not total:
+        return pool
+    # Se recorre el pool en orden aleatorio las veces que haga falta
+    workload = []
+    while len(workload) < total:
+        batch = pool[:]
+        rng.shuffle(batch)
+        workload.extend(batch)
+    return workload[:total]
+
+
+async def send_question(client: httpx.AsyncClient, url: str, question: str, args) -> dict:
     payload = {
-        "question": pregunta,
-        "model_provider": model_provider,
-        "mode": mode,
-        "top_k": top_k,
+        "question": question,
+        "model_provider": args.provider,
+        "mode": args.mode,
+        "top_k": args.top_k,
     }
+    start = time.perf_counter()
+    result = {"question": question, "status": None, "error": None}
     try:
-        r = requests.post(BACKEND_URL, json=payload, timeout=60)
+        r = await client.post(f"{url}/question", json=payload)
+        result["status"] = r.status_code
         if r.status_code == 200:
             data = r.json()
-            # Ajusta según el campo que devuelve tu backend
-            respuesta = data.get("answer") or data.get("respuesta") or ""
-            return respuesta
+            result["answer"] = data.get("answer") or data.get("respuesta") or ""
+            result["consumption"] = data.get("consumption") or {}
         else:
-            return f"ERROR {r.status_code}: {r.text}"
+            result["error"] = f"ERROR {r.status_code}: {r.text[:200]}"
     except Exception as e:
-        return f"ERROR DE CONEXIÓN: {e}"
+        result["error"] = f"ERROR DE CONEXIÓN: {type(e).__name__}: {e}"
+    result["latency_sec"] = time.perf_counter() - start
+    return result
+
+
+async def run_closed_loop(client, url: str, workload: list, concurrency: int, args) -> list:
+    """Lazo cerrado: `concurrency` usuarios que envían la siguiente pregunta al recibir respuesta"""
+    results = [None] * len(workload)
+    next_index = 0
+
+    async def user():
+        nonlocal next_index
+        while next_index < len(workload):
+            index = next_index
+            next_index += 1
+            results[index] = await send_question(client, url, workload[index], args)
+            if args.progress:
+                print(f"Procesando ({index + 1}/{len(workload)}): {workload[index]!r}")
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(client, url: str, workload: list, rate: float, args) -> list:
+    """Lazo abierto: llegadas Poisson a `rate` pedidos/s, sin esperar las respuestas"""
+    rng = random.Random(args.seed)
+    tasks = []
+    next_arrival = time.perf_counter()
+    for question in workload:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send_question(client, url, question, args)))
+        next_arrival += rng.expovariate(rate)
+    return await asyncio.gather(*tasks)
+
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    array = np.asarray(values, dtype=float)
+    return {
+        "mean": float(array.mean()),
+        "p50": float(np.percentile(array, 50)),
+        "p95": float(np.percentile(array, 95)),
+        "p99": float(np.percentile(array, 99)),
+        "max": float(array.max()),
+    }
+
+
+def summarize(results: list, wall_sec: float) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    errors = {}
+    for r in results:
+        if r["status"] != 200:
+            key = str(r["status"] or "conexion")
+            errors[key] = errors.get(key, 0) + 1
+    consumptions = [r.get("consumption") or {} for r in ok]
+    tokens = [c["tokens_used"] for c in consumptions if c.get("tokens_used") is not None]
+    costs = [c["cost_estimated"] for c in consumptions if c.get("cost_estimated") is not None]
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "wall_sec": wall_sec,
+        "throughput_rps": len(ok) / wall_sec if wall_sec else 0.0,
+        "latency_ms": {k: v * 1000 for k, v in _percentiles([r["latency_sec"] for r in ok]).items()},
+        "server_latency_ms": {k: v * 1000 for k, v in _percentiles(
+            [c["latency_sec"] for c in consumptions if c.get("latency_sec") is not None]).items()},
+        "tokens_per_request": _percentiles(tokens),
+        "prompt_tokens_mean": float(np.mean([c.get("prompt_tokens") or 0 for c in consumptions])) if ok else None,
+        "completion_tokens_mean": float(np.mean([c.get("completion_tokens") or 0 for c in consumptions])) if ok else None,
+        "cost_total_usd": float(sum(costs)) if costs else None,
+        "cache_hit_rate": sum(bool(c.get("cache_hit")) for c in consumptions) / len(ok) if ok else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(summary: dict):
+    lat = summary["latency_ms"]
+    tokens = summary["tokens_per_request"]
+    print(f"\n📊 {summary['ok']}/{summary['requests']} OK en {summary['wall_sec']:.1f}s "
+          f"({summary['throughput_rps']:.2f} req/s), tasa de error {summary['error_rate']:.1%} {summary['errors'] or ''}")
+    if lat:
+        print(f"   latencia ms: p50 {lat['p50']:.0f} | p95 {lat['p95']:.0f} | p99 {lat['p99']:.0f} | máx {lat['max']:.0f}")
+    if tokens:
+        print(f"   tokens/pedido: media {tokens['mean']:.0f} | p95 {tokens['p95']:.0f}")
+
+
+def compare_reports(previous_path: Path, summary: dict):
+    """Imprime la diferencia de las métricas principales contra un reporte anterior"""
+    previous = json.loads(previous_path.read_text(encoding="utf-8"))
+    before = previous["summary"]
+    print(f"\n🔍 Comparación contra {previous_path} (commit {previous.get('git_commit')}):")
+    rows = [
+        ("latencia p50 ms", before["latency_ms"].get("p50"), summary["latency_ms"].get("p50")),
+        ("latencia p95 ms", before["latency_ms"].get("p95"), summary["latency_ms"].get("p95")),
+        ("latencia p99 ms", before["latency_ms"].get("p99"), summary["latency_ms"].get("p99")),
+        ("req/s", before["throughput_rps"], summary["throughput_rps"]),
+        ("tasa de error", before["error_rate"], summary["error_rate"]),
+        ("tokens/pedido", before["tokens_per_request"].get("mean"), summary["tokens_per_request"].get("mean")),
+    ]
+    for name, old, new in rows:
+        if old is None or new is None:
+            continue
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        print(f"   {name:<16}{old:>12.3f} -> {new:<12.3f}{change}")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, process: subprocess.Popen, log_path: Path, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El proceso terminó antes de estar listo, ver {log_path}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {timeout:.0f}s, ver {log_path}")
+
+
+def make_corpus(data_dir: Path, questions: list):
+    """Corpus sintético: una página por pregunta gold con texto relacionado"""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for i, question in enumerate(questions):
+        topic = question.strip("¿?")
+        text = (f"Tema {i + 1}. {topic}. " + f"En este apartado se describe {topic.lower()}, con su "
+                "definición, sus características principales y ejemplos de aplicación. " * 6)
+        doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), text)
+    doc.save(data_dir / "corpus_sintetico.pdf")
+
+
+class OfflineStack:
+    """Levanta el stub de proveedores y la API (uvicorn) en un directorio temporal"""
+
+    def __init__(self, args, questions: list):
+        self.args = args
+        self.questions = questions
+        self.workdir = Path(tempfile.mkdtemp(prefix="carga_rag_"))
+        self.processes = []
+
+    def __enter__(self) -> str:
+        args = self.args
+        data_dir = self.workdir / "data"
+        if args.data_dir:
+            shutil.copytree(args.data_dir, data_dir)
+        else:
+            data_dir.mkdir()
+            make_corpus(data_dir, self.questions)
+
+        stub_port, api_port = _free_port(), _free_port()
+        stub_log = self.workdir / "stub.log"
+        stub = subprocess.Popen(
+            [sys.executable, str(REPO_ROOT / "tests" / "stub_providers.py"), "--port", str(stub_port),
+             "--sigma", str(args.stub_sigma), "--error-rate", str(args.stub_error_rate),
+             "--seed", str(args.seed)] + args.stub_args,
+            stdout=open(stub_log, "w"), stderr=subprocess.STDOUT,
+        )
+        self.processes.append(stub)
+        _wait_http(f"http://127.0.0.1:{stub_port}/stats", stub, stub_log, 30)
+
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(REPO_ROOT),
+            "OPENAI_API_KEY": "stub",
+            "GROQ_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{stub_port}",
+            "CHROMA_PERSIST_DIR": str(self.workdir / "chroma_persist"),
+            "VECTOR_STORE_DIR": str(self.workdir / "vector_store"),
+            "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+            "EMBEDDER_ENABLED": "false",
+        }
+        api_log = self.workdir / "api.log"
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(api_port),
+             "--log-level", "warning"],
+            cwd=self.workdir, env=env, stdout=open(api_log, "w"), stderr=subprocess.STDOUT,
+        )
+        self.processes.append(api)
+        # La API escucha enseguida e indexa data/ en segundo plano: /ready da 200 al terminar
+        _wait_http(f"http://127.0.0.1:{api_port}/ready", api, api_log, 300)
+        print(f"🧪 Stub en :{stub_port}, API en :{api_port} (logs en {self.workdir})")
+        return f"http://127.0.0.1:{api_port}"
+
+    def __exit__(self, *exc):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not self.args.keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+async def run_load(url: str, workload: list, args) -> tuple:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        if args.warmup:
+            await asyncio.gather(*(send_question(client, url, q, args) for q in workload[:args.warmup]))
+        start = time.perf_counter()
+        if args.rate:
+            results = await run_open_loop(client, url, workload, args.rate, args)
+        else:
+            results = await run_closed_loop(client, url, workload, args.concurrency, args)
+        return results, time.perf_counter() - start
+
 
 def main():
-    # Lee el archivo, pandas detectará la cabecera
-    df = pd.read_csv(INPUT_CSV, encoding="utf-8")
-    print("Columnas detectadas:", df.columns.tolist())
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=BACKEND_URL, help="API a probar (se ignora con --offline)")
+    parser.add_argument("--csv", type=Path, default=INPUT_CSV)
+    parser.add_argument("--concurrency", type=int, default=4, help="usuarios simultáneos (lazo cerrado)")
+    parser.add_argument("--rate", type=float, default=None, help="llegadas por segundo (lazo abierto, Poisson)")
+    parser.add_argument("--requests", type=int, default=0, help="total de pedidos (0 = una pasada por el pool)")
+    parser.add_argument("--variations", type=int, default=0, help="variaciones sintéticas por pregunta")
+    parser.add_argument("--provider", default="groq", choices=("groq", "openai"))
+    parser.add_argument("--mode", default="detallada", choices=("breve", "detallada"))
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--warmup", type=int, default=0, help="pedidos de calentamiento fuera de la medición")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", type=Path, default=None, help="reporte JSON de la corrida")
+    parser.add_argument("--compare", type=Path, default=None, help="reporte JSON anterior para comparar")
+    parser.add_argument("--answers-csv", type=Path, default=None, help="guarda pregunta/respuesta en CSV")
+    parser.add_argument("--progress", action="store_true", help="imprime cada pregunta procesada")
+    offline = parser.add_argument_group("modo offline")
+    offline.add_argument("--offline", action="store_true", help="levanta stub de proveedores + API local")
+    offline.add_argument("--data-dir", type=Path, default=None, help="PDFs a indexar (por defecto corpus sintético)")
+    offline.add_argument("--answer-cache", action="store_true", help="deja activa la caché de respuestas")
+    offline.add_argument("--stub-sigma", type=float, default=0.4)
+    offline.add_argument("--stub-error-rate", type=float, default=0.0)
+    offline.add_argument("--stub-args", nargs=argparse.REMAINDER, default=[],
+                         help="argumentos extra para tests/stub_providers.py (al final)")
+    offline.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    questions = load_questions(args.csv)
+    workload = build_workload(questions, args.variations, args.requests, args.seed)
+    loop = f"{args.rate} req/s (Poisson)" if args.rate else f"concurrencia {args.concurrency}"
+    print(f"🚀 {len(workload)} pedidos ({len(questions)} preguntas gold, {args.variations} variaciones c/u), {loop}")
+
+    if args.offline:
+        with OfflineStack(args, questions) as url:
+            results, wall_sec = asyncio.run(run_load(url, workload, args))
+    else:
+        results, wall_sec = asyncio.run(run_load(args.url.rstrip("/"), workload, args))
+
+    summary = summarize(results, wall_sec)
+    print_summary(summary)
 
-    respuestas = []
+    if args.report:
+        config = {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()}
+        report = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "config": config,
+            "summary": summary,
+        }
+        args.report.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"💾 Reporte guardado en {args.report}")
 
-    for idx, row in df.iterrows():
-        pregunta = row["Pregunta"]
-        print(f"Procesando ({idx+1}/{len(df)}): {pregunta!r}")
-        resp = preguntar_al_chatbot(pregunta)
-        respuestas.append(resp)
+    if args.compare:
+        compare_reports(args.compare, summary)
 
-    df["respuesta"] = respuestas
+    if args.answers_csv:
+        with open(args.answers_csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Pregunta", "respuesta"])
+            for r in results:
+                writer.writerow([r["question"], r.get("answer") if r["status"] == 200 else r["error"]])
+        print(f"Archivo guardado como: {args.answers_csv}")
 
-    df.to_csv(OUTPUT_CSV, index=False)
-    print(f"Archivo guardado como: {OUTPUT_CSV}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,223 @@
+"""
+Servidor stub de los proveedores externos (OpenAI chat + embeddings y Groq chat) para
+correr la API y las pruebas de carga sin claves ni red.
+
+Imita las rutas y el formato de respuesta de las APIs reales, así que los SDK oficiales
+funcionan sin cambios apuntando las variables de entorno que ya leen:
+
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1   -> /v1/embeddings, /v1/chat/completions
+    GROQ_BASE_URL=http://127.0.0.1:9100        -> /openai/v1/chat/completions
+
+La latencia de cada llamada es log-normal (cola derecha, como una API real):
+chat = tiempo al primer token + tokens generados * tiempo por token; embeddings = mediana
+por llamada + costo por input. Los embeddings son deterministas (hashing de palabras), así
+que textos parecidos quedan cerca y la recuperación tiene sentido. Ejemplo:
+
+    python tests/stub_providers.py --port 9100 --openai-ttft-ms 400 --groq-ttft-ms 150
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_WORD_RE = re.compile(r"\w+")
+
+# Perfil de latencia por proveedor: (mediana del primer token ms, ms por token generado)
+DEFAULT_PROFILES = {
+    "openai": (400.0, 12.0),
+    "groq": (150.0, 2.0),
+}
+
+_FILLER = (
+    "Según el contexto proporcionado, la inteligencia artificial estudia agentes que perciben "
+    "su entorno y actúan para alcanzar objetivos; el aprendizaje automático permite mejorar "
+    "con la experiencia a partir de datos y modelos evaluados con métricas adecuadas."
+).split()
+
+
+def _count_tokens(text: str) -> int:
+    # Aproximación barata: ~1.3 tokens por palabra en español
+    return max(1, int(len(_WORD_RE.findall(text)) * 1.3))
+
+
+def hashed_embedding(text: str, dim: int) -> np.ndarray:
+    """Embedding determinista: cada palabra suma ±1 en una dimensión elegida por hash"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % dim] += 1.0 if value >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+def create_app(embed_ms: float = 60.0, embed_ms_per_input: float = 0.2, profiles: dict = None,
+               sigma: float = 0.4, error_rate: float = 0.0, embedding_dim: int = 1536,
+               seed: int = 0) -> FastAPI:
+    profiles = profiles or DEFAULT_PROFILES
+    rng = random.Random(seed)
+    app = FastAPI(title="Stub de proveedores LLM")
+    stats = {"embeddings": 0, "chat": 0, "errors": 0}
+
+    def lognormal(median_ms: float) -> float:
+        return rng.lognormvariate(0, sigma) * median_ms / 1000
+
+    def injected_error():
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            status = rng.choice((429, 500, 503))
+            return JSONResponse(
+                status_code=status,
+                content={"error": {"message": f"Error simulado {status}", "type": "stub_error"}},
+            )
+        return None
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        await asyncio.sleep(lognormal(embed_ms) + len(inputs) * embed_ms_per_input / 1000)
+        if error := injected_error():
+            return error
+        stats["embeddings"] += 1
+
+        use_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            vector = hashed_embedding(str(text), embedding_dim)
+            embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode() if use_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(_count_tokens(str(text)) for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    async def chat(provider: str, request: Request):
+        body = await request.json()
+        ttft_ms, token_ms = profiles[provider]
+        prompt_tokens = sum(_count_tokens(str(m.get("content", ""))) for m in body.get("messages", []))
+        max_tokens = body.get("max_tokens") or 500
+        completion_tokens = max(8, min(max_tokens, int(rng.lognormvariate(0, sigma) * min(max_tokens, 500) * 0.4)))
+        words = [_FILLER[i % len(_FILLER)] for i in range(int(completion_tokens / 1.3) or 1)]
+        ttft = lognormal(ttft_ms)
+        model = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+        if error := injected_error():
+            await asyncio.sleep(ttft)
+            return error
+        stats["chat"] += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + completion_tokens * token_ms / 1000)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def events():
+            def chunk(delta: dict, finish_reason=None, chunk_usage=None) -> str:
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                }
+                if chunk_usage:
+                    payload["usage"] = chunk_usage
+                return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+            await asyncio.sleep(ttft)
+            yield chunk({"role": "assistant", "content": ""})
+            # De a 8 palabras por chunk para no dormir una vez por token
+            for start in range(0, len(words), 8):
+                group = words[start:start + 8]
+                await asyncio.sleep(len(group) * 1.3 * token_ms / 1000)
+                yield chunk({"content": (" " if start else "") + " ".join(group)})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, chunk_usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        return await chat("openai", request)
+
+    @app.post("/openai/v1/chat/completions")
+    async def groq_chat(request: Request):
+        return await chat("groq", request)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--embed-ms", type=float, default=60.0, help="mediana por llamada de embeddings")
+    parser.add_argument("--openai-ttft-ms", type=float, default=DEFAULT_PROFILES["openai"][0])
+    parser.add_argument("--openai-token-ms", type=float, default=DEFAULT_PROFILES["openai"][1])
+    parser.add_argument("--groq-ttft-ms", type=float, default=DEFAULT_PROFILES["groq"][0])
+    parser.add_argument("--groq-token-ms", type=float, default=DEFAULT_PROFILES["groq"][1])
+    parser.add_argument("--sigma", type=float, default=0.4, help="dispersión de la log-normal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de llamadas que fallan (429/500/503)")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app(
+        embed_ms=args.embed_ms,
+        profiles={
+            "openai": (args.openai_ttft_ms, args.openai_token_ms),
+            "groq": (args.groq_ttft_ms, args.groq_token_ms),
+        },
+        sigma=args.sigma,
+        error_rate=args.error_rate,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
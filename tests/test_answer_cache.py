@@ -0,0 +1,104 @@
+"""AnswerCache: aciertos por similitud, invalidación por index_version y respuestas de un índice viejo"""
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.services.answer_cache import AnswerCache
+from src.services.rag_service import RAGService
+
+RESPONSE = {"answer": "Un grafo es un conjunto de nodos y aristas", "consumption": {"total_tokens": 42}}
+
+
+def vector(*values):
+    return np.asarray(values, dtype=np.float32)
+
+
+def test_similar_question_hits_within_the_same_version():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.put(vector(1, 0, 0), "breve", "groq", 3, 1, RESPONSE)
+
+    cached = cache.get(vector(0.99, 0.05, 0), "breve", "groq", 3, 1)
+
+    assert cached["answer"] == RESPONSE["answer"]
+    assert cached["similarity"] > 0.95
+    assert cache.get(vector(0, 1, 0), "breve", "groq", 3, 1) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_buckets_do_not_mix_mode_provider_or_top_k():
+    cache = AnswerCache()
+    cache.put(vector(1, 0), "breve", "groq", 3, 1, RESPONSE)
+
+    assert cache.get(vector(1, 0), "detallada", "groq", 3, 1) is None
+    assert cache.get(vector(1, 0), "breve", "openai", 3, 1) is None
+    assert cache.get(vector(1, 0), "breve", "groq", 5, 1) is None
+    assert cache.get(vector(1, 0), "breve", "groq", 3, 1) is not None
+
+
+def test_new_index_version_discards_every_entry():
+    cache = AnswerCache()
+    cache.put(vector(1, 0), "breve", "groq", 3, 1, RESPONSE)
+    cache.put(vector(0, 1), "detallada", "openai", 5, 1, RESPONSE)
+
+    assert cache.get(vector(1, 0), "breve", "groq", 3, 2) is None
+
+    stats = cache.stats()
+    assert stats["items"] == 0
+    assert stats["invalidations"] == 1
+    assert stats["index_version"] == 2
+    # Volver a preguntar con la misma versión no cuenta otra invalidación
+    assert cache.get(vector(0, 1), "detallada", "openai", 5, 2) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_answer_from_an_older_index_is_not_stored():
+    cache = AnswerCache()
+    cache.put(vector(0, 1), "breve", "groq", 3, 2, RESPONSE)
+
+    # Se recuperó con la versión 1 y terminó de generarse después de indexar un PDF
+    cache.put(vector(1, 0), "breve", "groq", 3, 1, {"answer": "vieja", "consumption": {}})
+
+    assert cache.get(vector(1, 0), "breve", "groq", 3, 2) is None
+    assert cache.get(vector(0, 1), "breve", "groq", 3, 2)["answer"] == RESPONSE["answer"]
+    stats = cache.stats()
+    assert stats["index_version"] == 2
+    assert stats["invalidations"] == 0
+
+
+def test_expired_entries_miss(monkeypatch):
+    cache = AnswerCache(ttl_sec=10)
+    now = [1000.0]
+    monkeypatch.setattr("src.services.answer_cache.time.time", lambda: now[0])
+    cache.put(vector(1, 0), "breve", "groq", 3, 1, RESPONSE)
+
+    now[0] += 11
+
+    assert cache.get(vector(1, 0), "breve", "groq", 3, 1) is None
+    assert cache.stats()["items"] == 0
+
+
+def test_lru_eviction_keeps_max_items():
+    cache = AnswerCache(max_items=2)
+    cache.put(vector(1, 0, 0), "breve", "groq", 3, 1, {"answer": "a"})
+    cache.put(vector(0, 1, 0), "breve", "groq", 3, 1, {"answer": "b"})
+    cache.get(vector(1, 0, 0), "breve", "groq", 3, 1)
+    cache.put(vector(0, 0, 1), "breve", "groq", 3, 1, {"answer": "c"})
+
+    assert cache.get(vector(0, 1, 0), "breve", "groq", 3, 1) is None
+    assert cache.get(vector(1, 0, 0), "breve", "groq", 3, 1)["answer"] == "a"
+    assert cache.stats()["items"] == 2
+
+
+def test_hit_reports_the_provider_that_generated_the_answer():
+    service = RAGService(embedding_service=SimpleNamespace(index_version=1))
+    service.answer_cache = AnswerCache()
+    # Se pidió groq pero respondió openai por fallback
+    response = {**RESPONSE, "consumption": {"provider": "openai", "model": "gpt-4o-mini", "total_tokens": 42}}
+    service._cache_answer(vector(1, 0), "groq", 3, "breve", response, 1)
+
+    cached = service._get_cached_answer(vector(1, 0), "groq", 3, "breve", start_time=0)
+
+    consumption = cached["consumption"]
+    assert consumption["cache_hit"] is True
+    assert consumption["provider"] == "openai" and consumption["model"] == "gpt-4o-mini"
+    assert consumption["tokens_used"] == 0
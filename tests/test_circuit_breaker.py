@@ -0,0 +1,69 @@
+"""Transiciones del CircuitBreaker de ModelClientFactory"""
+from src.services.modelClientFactory import CircuitBreaker
+
+
+def open_breaker(threshold: int = 3) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=threshold, reset_sec=30)
+    for _ in range(threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def expire(breaker: CircuitBreaker):
+    """Como si hubieran pasado reset_sec desde que se abrió"""
+    breaker.opened_at -= breaker.reset_sec
+
+
+def test_opens_after_threshold_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_sec=30)
+    assert breaker.record_failure() is False
+    assert breaker.record_failure() is False
+    assert breaker.allow() and breaker.state == "closed"
+    assert breaker.record_failure() is True
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_sec=30)
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.record_failure() is False
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_a_single_probe_through():
+    breaker = open_breaker()
+    expire(breaker)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Mientras la prueba está en curso no pasa nadie más
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes_the_circuit():
+    breaker = open_breaker()
+    expire(breaker)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = open_breaker()
+    expire(breaker)
+    assert breaker.allow()
+    assert breaker.record_failure() is True
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_released_probe_lets_another_one_through():
+    # El perdedor de un hedge se cancela: ni éxito ni fallo, pero libera el lugar de la prueba
+    breaker = open_breaker()
+    expire(breaker)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
@@ -0,0 +1,60 @@
+"""EmbeddingCache: LRU + SQLite, y que aget/aput no toquen SQLite desde el event loop"""
+import asyncio
+import threading
+
+from src.services.embedding_cache import EmbeddingCache
+
+MODEL = "text-embedding-3-small"
+
+
+def test_normalized_text_shares_the_entry(tmp_path):
+    cache = EmbeddingCache(persist_path=tmp_path / "cache.sqlite")
+    cache.put("  ¿Qué es un GRAFO? ", MODEL, [1.0, 2.0])
+    assert cache.get("¿qué es un grafo?", MODEL) == [1.0, 2.0]
+    assert cache.get("¿qué es un grafo?", "otro-modelo") is None
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    EmbeddingCache(persist_path=tmp_path / "cache.sqlite").put("grafo", MODEL, [0.5, 0.25])
+
+    cache = EmbeddingCache(persist_path=tmp_path / "cache.sqlite")
+    assert cache.get("grafo", MODEL) == [0.5, 0.25]
+    assert cache.get("grafo", MODEL) == [0.5, 0.25]
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["disk_hits"] == 1 and stats["misses"] == 0
+
+
+def test_lru_keeps_max_items_in_memory():
+    cache = EmbeddingCache(max_items=2)
+    for text in ("a", "b", "c"):
+        cache.put(text, MODEL, [1.0])
+    assert cache.get("a", MODEL) is None
+    assert cache.stats()["memory_items"] == 2
+
+
+def test_async_path_runs_sqlite_off_the_event_loop(tmp_path, monkeypatch):
+    cache = EmbeddingCache(persist_path=tmp_path / "cache.sqlite")
+    threads = []
+    for name in ("_get_disk", "_persist"):
+        original = getattr(cache, name)
+
+        def recording(*args, _original=original, _name=name):
+            threads.append((_name, threading.get_ident()))
+            return _original(*args)
+
+        monkeypatch.setattr(cache, name, recording)
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        assert await cache.aget("grafo", MODEL) is None
+        await cache.aput([("grafo", MODEL, [1.0, 2.0]), ("arbol", MODEL, [3.0, 4.0])])
+        # En memoria: no pasa por SQLite
+        assert await cache.aget("grafo", MODEL) == [1.0, 2.0]
+        return loop_thread
+
+    loop_thread = asyncio.run(scenario())
+    assert [name for name, _ in threads] == ["_get_disk", "_persist"]
+    assert all(thread != loop_thread for _, thread in threads)
+
+    restarted = EmbeddingCache(persist_path=tmp_path / "cache.sqlite")
+    assert asyncio.run(restarted.aget("arbol", MODEL)) == [3.0, 4.0]
@@ -0,0 +1,51 @@
+"""Checkpoints por chunk del EmbeddingExecutor (reanudar una ingesta interrumpida)"""
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.embedding_executor import EmbeddingExecutor
+
+
+class FakeEmbeddings:
+    """Cliente con la forma de client.embeddings de OpenAI; falla en la llamada fail_on"""
+
+    def __init__(self, fail_on: int = None):
+        self.calls = []
+        self.fail_on = fail_on
+
+    def create(self, input, model):
+        self.calls.append(list(input))
+        if self.fail_on is not None and len(self.calls) == self.fail_on:
+            raise ValueError("input rechazado")
+        data = [SimpleNamespace(index=i, embedding=[float(len(text)), float(i == 0)]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data)
+
+
+def make_executor(tmp_path, embeddings: FakeEmbeddings, max_batch_items: int) -> EmbeddingExecutor:
+    return EmbeddingExecutor(openai_client=SimpleNamespace(embeddings=embeddings), checkpoint_dir=tmp_path,
+                             max_concurrency=1, max_retries=0, max_batch_items=max_batch_items)
+
+
+def test_resumed_run_with_different_batching_reuses_checkpoints(tmp_path):
+    texts = [f"chunk {i}" * (i + 1) for i in range(6)]
+    first = FakeEmbeddings(fail_on=2)
+    with pytest.raises(ValueError):
+        make_executor(tmp_path, first, max_batch_items=2).embed(texts)
+    embedded = {text for n, call in enumerate(first.calls, start=1) if n != first.fail_on for text in call}
+    assert set(texts[:2]) <= embedded < set(texts)
+
+    # Otro tamaño de lote al reintentar: los chunks del lote terminado no se vuelven a pedir
+    second = FakeEmbeddings()
+    embeddings = make_executor(tmp_path, second, max_batch_items=3).embed(texts)
+    requested = [text for call in second.calls for text in call]
+    assert sorted(requested) == sorted(set(texts) - embedded)
+    assert [embedding[0] for embedding in embeddings] == [float(len(text)) for text in texts]
+
+
+def test_clear_checkpoints_forgets_embedded_chunks(tmp_path):
+    texts = ["uno", "dos"]
+    make_executor(tmp_path, FakeEmbeddings(), max_batch_items=8).embed(texts)
+    executor = make_executor(tmp_path, FakeEmbeddings(), max_batch_items=8)
+    executor.clear_checkpoints()
+    executor.embed(texts)
+    assert executor.openai_client.embeddings.calls == [texts]
@@ -0,0 +1,190 @@
+"""Ingesta de PDFs (RAGService.sync_folder e index_pdf) con contenido repetido, errores y subidas seguidas"""
+import hashlib
+import shutil
+
+import fitz
+import numpy as np
+import pytest
+
+from src.services import rag_service
+from src.services.embedding_service_chroma import EmbeddingServiceChroma
+from src.services.embedding_store import load_embedding_artifact
+from src.services.rag_service import RAGService
+
+DIM = 32
+
+
+def fake_embeddings(texts: list) -> list:
+    """Vectores deterministas por texto (sin proveedor)"""
+    vectors = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+        vectors.append(np.random.default_rng(seed).standard_normal(DIM).astype(np.float32).tolist())
+    return vectors
+
+
+def write_pdf(path, paragraphs: list):
+    doc = fitz.open()
+    for paragraph in paragraphs:
+        doc.new_page().insert_text((72, 72), paragraph)
+    doc.save(str(path))
+    doc.close()
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    embedding_service = EmbeddingServiceChroma(persist_dir=str(tmp_path / "persist"), persistent=False,
+                                               vector_backend="numpy", role="standalone")
+    monkeypatch.setattr(embedding_service, "_embed_documents", fake_embeddings)
+    return RAGService(index_path=tmp_path / "registry", embedding_service=embedding_service)
+
+
+@pytest.fixture
+def data(tmp_path):
+    folder = tmp_path / "data"
+    folder.mkdir()
+    return folder
+
+
+def registered_ids(service) -> list:
+    return [chunk_id for entry in service.indexed_files.values() for chunk_id in entry["chunk_ids"]]
+
+
+def test_identical_pdfs_under_different_names_keep_their_own_chunks(service, data):
+    write_pdf(data / "a.pdf", ["Busqueda en anchura", "Busqueda en profundidad"])
+    shutil.copy(data / "a.pdf", data / "copia.pdf")
+
+    stats = service.sync_folder(data)
+    assert stats["indexed_files"] == 2 and stats["failed_files"] == 0
+    a_ids = set(service.indexed_files["a.pdf"]["chunk_ids"])
+    copy_ids = set(service.indexed_files["copia.pdf"]["chunk_ids"])
+    assert a_ids and copy_ids and not a_ids & copy_ids
+    assert service.embedding_service.vector_store.count() == len(a_ids) + len(copy_ids)
+
+    # Borrar la copia no se lleva los chunks del original
+    (data / "copia.pdf").unlink()
+    stats = service.sync_folder(data)
+    assert stats["removed_files"] == 1
+    assert service.embedding_service.existing_ids(sorted(a_ids)) == a_ids
+    assert service.embedding_service.vector_store.count() == len(a_ids)
+
+
+def test_force_rebuild_with_duplicate_content_is_idempotent(service, data):
+    write_pdf(data / "a.pdf", ["Grafos dirigidos"])
+    shutil.copy(data / "a.pdf", data / "b.pdf")
+    service.sync_folder(data)
+    count = service.embedding_service.vector_store.count()
+
+    stats = service.sync_folder(data, force=True)
+    assert stats["indexed_files"] == 2 and stats["failed_files"] == 0
+    assert service.embedding_service.vector_store.count() == count
+
+
+def test_repeated_ids_are_written_once_per_run(service, data, monkeypatch):
+    def repeated_docs(paths, hashes=None):
+        for path in paths:
+            docs = [{"id": f"chunk-{i}", "text": f"texto {i}", "metadata": {"source": str(path), "page": 0}}
+                    for i in range(3)]
+            yield {"path": str(path), "hash": hashes[str(path)], "pages": 1, "docs": docs}
+
+    batches = []
+    add_documents = service.embedding_service.add_documents
+
+    def recording_add_documents(docs, persist=True):
+        batches.append([doc["id"] for doc in docs])
+        return add_documents(docs, persist=persist)
+
+    write_pdf(data / "a.pdf", ["uno"])
+    write_pdf(data / "b.pdf", ["dos"])
+    monkeypatch.setattr(rag_service, "iter_pdf_docs", repeated_docs)
+    monkeypatch.setattr(rag_service, "INGEST_BATCH_SIZE", 2)
+    monkeypatch.setattr(service.embedding_service, "add_documents", recording_add_documents)
+
+    stats = service.sync_folder(data)
+    written = [chunk_id for batch in batches for chunk_id in batch]
+    assert sorted(written) == ["chunk-0", "chunk-1", "chunk-2"]
+    assert stats["chunks_indexed"] == 3
+    assert sorted(registered_ids(service)) == sorted(written)
+
+
+def test_a_failing_file_fails_alone(service, data, monkeypatch):
+    def embed_or_fail(texts):
+        if any("ROTO" in text for text in texts):
+            raise RuntimeError("proveedor rechazó el input")
+        return fake_embeddings(texts)
+
+    monkeypatch.setattr(service.embedding_service, "_embed_documents", embed_or_fail)
+    write_pdf(data / "a.pdf", ["Arboles binarios"])
+    write_pdf(data / "b.pdf", ["Texto ROTO"])
+    write_pdf(data / "c.pdf", ["Tablas hash"])
+
+    stats = service.sync_folder(data)
+    assert stats["indexed_files"] == 2 and stats["failed_files"] == 1
+    assert set(service.indexed_files) == {"a.pdf", "c.pdf"}
+    assert stats["chunks_indexed"] == len(registered_ids(service))
+    assert service.embedding_service.vector_store.count() == len(registered_ids(service))
+
+    # Arreglado el problema, la próxima sincronización reintenta solo ese archivo
+    monkeypatch.setattr(service.embedding_service, "_embed_documents", fake_embeddings)
+    stats = service.sync_folder(data)
+    assert stats["indexed_files"] == 1 and stats["unchanged_files"] == 2
+
+
+def test_uploads_coalesce_into_one_artifact_save(service, data, monkeypatch):
+    saves = []
+    save_precomputed = service.embedding_service.save_precomputed
+
+    def recording_save():
+        saves.append(service.embedding_service.vector_store.count())
+        save_precomputed()
+
+    monkeypatch.setattr(rag_service, "ARTIFACT_SAVE_DELAY_SEC", 60)
+    monkeypatch.setattr(service.embedding_service, "save_precomputed", recording_save)
+    for i, text in enumerate(["Colas de prioridad", "Montículos", "Tries"]):
+        write_pdf(data / f"subida{i}.pdf", [text])
+        assert service.index_pdf(data / f"subida{i}.pdf")
+    assert saves == []
+
+    service.flush_artifact()
+    count = service.embedding_service.vector_store.count()
+    assert saves == [count]
+    assert len(load_embedding_artifact(service.embedding_service.artifact_dir)) == count
+    service.flush_artifact()
+    assert saves == [count]
+
+
+def test_close_saves_pending_uploads(service, data, monkeypatch):
+    monkeypatch.setattr(rag_service, "ARTIFACT_SAVE_DELAY_SEC", 60)
+    write_pdf(data / "a.pdf", ["Listas enlazadas"])
+    service.index_pdf(data / "a.pdf")
+    service.close()
+    artifact = load_embedding_artifact(service.embedding_service.artifact_dir)
+    assert artifact is not None and len(artifact) == service.embedding_service.vector_store.count()
+
+
+def test_replacing_a_pdf_after_a_restart_drops_its_old_chunks(service, data, tmp_path, monkeypatch):
+    write_pdf(data / "a.pdf", ["Version vieja del apunte"])
+    write_pdf(data / "b.pdf", ["Otro apunte"])
+    service.sync_folder(data)
+    b_ids = set(service.indexed_files["b.pdf"]["chunk_ids"])
+    service.close()
+
+    # Reinicio: el índice se adopta desde el artefacto sin reindexar
+    embedding_service = EmbeddingServiceChroma(persist_dir=str(tmp_path / "persist"), persistent=False,
+                                               vector_backend="numpy", role="standalone")
+    monkeypatch.setattr(embedding_service, "_embed_documents", fake_embeddings)
+    restarted = RAGService(index_path=tmp_path / "registry", embedding_service=embedding_service)
+    assert restarted.initialize_from_pdfs(data) == {"loaded_existing_index": True}
+
+    write_pdf(data / "a.pdf", ["Version nueva del apunte"])
+    assert restarted.index_pdf(data / "a.pdf")
+
+    store = embedding_service.vector_store
+    assert store.count() == len(registered_ids(restarted))
+    texts = store.get(include=["documents"])["documents"]
+    assert not any("vieja" in text for text in texts)
+    assert any("nueva" in text for text in texts)
+    # El registro en disco conserva los demás archivos
+    restarted._load_file_registry()
+    assert set(restarted.indexed_files) == {"a.pdf", "b.pdf"}
+    assert set(restarted.indexed_files["b.pdf"]["chunk_ids"]) == b_ids
@@ -0,0 +1,83 @@
+"""Token buckets y admisión del LLMScheduler (plazo de espera -> ProviderOverloaded)"""
+import asyncio
+import time
+
+import pytest
+
+from src.services.llm_scheduler import LLMScheduler, ProviderOverloaded, TokenBucket
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(rate=10, capacity=100)
+    now = bucket.updated
+    bucket.take(100)
+    assert bucket.wait_time(50, now) == pytest.approx(5.0)
+    assert bucket.wait_time(50, now + 5) == 0
+    assert bucket.wait_time(1, now + 1000) == 0 and bucket.level == 100
+
+
+def test_bucket_admits_requests_larger_than_capacity_when_full():
+    bucket = TokenBucket(rate=10, capacity=100)
+    assert bucket.wait_time(500, bucket.updated) == 0
+
+
+def test_drained_bucket_stays_empty_for_the_retry_after():
+    bucket = TokenBucket(rate=10, capacity=100)
+    now = bucket.updated
+    bucket.drain(30, now)
+    assert bucket.wait_time(1, now) == pytest.approx(30.1)
+
+
+def test_unlimited_provider_is_admitted_without_reserving():
+    scheduler = LLMScheduler(limits={"groq": (0, 0)})
+    assert asyncio.run(scheduler.acquire("groq", 1000)) == 0
+
+
+def test_acquire_sheds_when_the_queue_would_exceed_the_deadline():
+    # 1 pedido por minuto: el segundo tendría que esperar ~60 s y el plazo es 1 s
+    scheduler = LLMScheduler(limits={"groq": (1, 0)}, max_wait=1)
+
+    async def scenario():
+        assert await scheduler.acquire("groq", 100) == 100
+        start = time.monotonic()
+        with pytest.raises(ProviderOverloaded) as overloaded:
+            await scheduler.acquire("groq", 100)
+        return overloaded.value, time.monotonic() - start
+
+    error, elapsed = asyncio.run(scenario())
+    assert error.reason == "deadline" and error.provider == "groq"
+    assert error.retry_after == 60
+    # Se rechaza enseguida, sin esperar el plazo ni ocupar la cola
+    assert elapsed < 0.5
+    assert scheduler.lanes["groq"].waiting == 0
+
+
+def test_acquire_sheds_when_the_bucket_wait_passes_the_deadline():
+    # La estimación por cola entra en el plazo, pero un 429 dejó el bucket vacío por 100 s
+    scheduler = LLMScheduler(limits={"openai": (0, 600)}, max_wait=20)
+    scheduler.penalize("openai", 100)
+
+    with pytest.raises(ProviderOverloaded) as overloaded:
+        asyncio.run(scheduler.acquire("openai", 100))
+    assert overloaded.value.reason == "timeout"
+    assert overloaded.value.retry_after >= 100
+    assert scheduler.lanes["openai"].waiting == 0
+
+
+def test_acquire_sheds_when_the_queue_is_full():
+    scheduler = LLMScheduler(limits={"groq": (1, 0)}, max_queue=0, max_wait=120)
+
+    async def scenario():
+        await scheduler.acquire("groq", 10)
+        await scheduler.acquire("groq", 10)
+
+    with pytest.raises(ProviderOverloaded) as overloaded:
+        asyncio.run(scenario())
+    assert overloaded.value.reason == "queue_full"
+
+
+def test_release_gives_back_unused_tokens():
+    scheduler = LLMScheduler(limits={"openai": (0, 600)})
+    reserved = asyncio.run(scheduler.acquire("openai", 500))
+    scheduler.release("openai", reserved, used_tokens=200)
+    assert scheduler.lanes["openai"].tokens.level == pytest.approx(400, abs=1)
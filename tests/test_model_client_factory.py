@@ -0,0 +1,122 @@
+"""ModelClientFactory: cancelaciones y fallos a mitad de stream frente al circuit breaker"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.services.llm_scheduler import LLMScheduler
+from src.services.modelClientFactory import ModelClientFactory
+
+KWARGS = {"messages": [{"role": "user", "content": "¿Qué es un grafo?"}], "max_tokens": 16}
+
+
+class FakeClients:
+    """Reemplazo de http_clients.CLIENTS con un create() distinto por proveedor"""
+
+    def __init__(self, **creates):
+        self.creates = creates
+
+    def has_key(self, provider: str) -> bool:
+        return provider in self.creates
+
+    def async_client(self, provider: str, operation: str):
+        completions = SimpleNamespace(create=self.creates[provider])
+        return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+def make_factory(**creates) -> ModelClientFactory:
+    factory = ModelClientFactory(clients=FakeClients(**creates))
+    factory.fallback_enabled = False
+    factory.scheduler = LLMScheduler(limits={"groq": (0, 0), "openai": (0, 0)})
+    return factory
+
+
+def half_open(factory: ModelClientFactory, provider: str):
+    breaker = factory.health[provider].breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_sec
+    return breaker
+
+
+def test_cancelled_stream_open_releases_the_half_open_probe():
+    started = asyncio.Event()
+
+    async def hanging_create(**kwargs):
+        started.set()
+        await asyncio.Event().wait()
+
+    factory = make_factory(groq=hanging_create)
+    breaker = half_open(factory, "groq")
+
+    async def scenario():
+        task = asyncio.create_task(factory.astream("groq", lambda p: dict(KWARGS)))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert breaker.state == "half_open"
+    # La prueba cancelada no deja el circuito tomado: el siguiente pedido puede probar
+    assert breaker.allow()
+
+
+def test_error_in_the_middle_of_a_stream_counts_as_a_failure():
+    async def broken_stream():
+        yield SimpleNamespace(usage=None)
+        raise ConnectionError("se cortó la conexión")
+
+    async def create(**kwargs):
+        return broken_stream()
+
+    factory = make_factory(groq=create)
+
+    async def scenario():
+        stream, used = await factory.astream("groq", lambda p: dict(KWARGS))
+        with pytest.raises(ConnectionError):
+            async for _ in stream:
+                pass
+
+    asyncio.run(scenario())
+    health = factory.health["groq"]
+    assert health.failures == 1 and health.breaker.failures == 1
+    assert "se cortó" in health.last_error
+
+
+def test_cancelling_a_hedged_request_cancels_the_primary_call():
+    started = asyncio.Event()
+    cancelled = []
+
+    async def hanging_create(**kwargs):
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def backup_create(**kwargs):
+        raise AssertionError("el hedge no debería lanzarse")
+
+    factory = make_factory(groq=hanging_create, openai=backup_create)
+    factory.fallback_enabled = True
+    factory.hedging_enabled = True
+    # p95 observado de 60 s: el caller se cancela mucho antes de lanzar el hedge
+    for _ in range(30):
+        factory.health["groq"].observe("breve", 60)
+
+    async def scenario():
+        task = asyncio.create_task(factory.acomplete("groq", lambda p: dict(KWARGS), latency_key="breve"))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Darle unas vueltas al loop para que la cancelación llegue a la llamada (antes de que
+        # asyncio.run cancele lo que quede pendiente al cerrar)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert cancelled == [True]
+
+    asyncio.run(scenario())
+    assert factory.health["groq"].breaker.allow()
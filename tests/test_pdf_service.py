@@ -0,0 +1,38 @@
+"""IDs de los chunks que arma prepare_docs_for_chroma"""
+from types import SimpleNamespace
+
+from src.services.pdf_service import prepare_docs_for_chroma
+
+
+def make_chunks(source: str, texts: list, page: int = 0) -> list:
+    return [SimpleNamespace(page_content=text, metadata={"source": source, "page": page}) for text in texts]
+
+
+def test_ids_are_stable_between_runs():
+    first = prepare_docs_for_chroma(make_chunks("data/a.pdf", ["uno", "dos"]), source_hash="h1")
+    second = prepare_docs_for_chroma(make_chunks("data/a.pdf", ["uno", "dos"]), source_hash="h1")
+    assert [doc["id"] for doc in first] == [doc["id"] for doc in second]
+
+
+def test_identical_files_with_different_names_do_not_collide():
+    # Mismo contenido (mismo hash) con dos nombres: cada archivo tiene sus propios chunks
+    texts = ["algoritmo de búsqueda", "árbol binario"]
+    a = prepare_docs_for_chroma(make_chunks("data/a.pdf", texts), source_hash="mismo")
+    b = prepare_docs_for_chroma(make_chunks("data/copia de a.pdf", texts), source_hash="mismo")
+    assert not {doc["id"] for doc in a} & {doc["id"] for doc in b}
+    assert {doc["metadata"]["source"] for doc in b} == {"data/copia de a.pdf"}
+
+
+def test_id_does_not_depend_on_the_folder():
+    # La ruta con la que se abrió el PDF cambia según el cwd; el nombre no
+    relative = prepare_docs_for_chroma(make_chunks("data/a.pdf", ["uno"]), source_hash="h1")
+    absolute = prepare_docs_for_chroma(make_chunks("/app/data/a.pdf", ["uno"]), source_hash="h1")
+    assert relative[0]["id"] == absolute[0]["id"]
+
+
+def test_repeated_text_in_the_same_page_gets_numbered_ids():
+    docs = prepare_docs_for_chroma(make_chunks("data/a.pdf", ["igual", "igual", "igual"]), source_hash="h1")
+    ids = [doc["id"] for doc in docs]
+    assert len(set(ids)) == 3
+    assert ids[1] == f"{ids[0]}-1" and ids[2] == f"{ids[0]}-2"
+    assert all(doc["metadata"]["chunk_id"] == doc["id"] for doc in docs)
@@ -0,0 +1,47 @@
+"""Modo de respuesta inválido: 400 antes de responder, también en /question/stream"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.services.rag_service import RESPONSE_MODES, RAGService, build_prompts
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main.rag_service, "initialized", True)
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize("mode", [None, "larguisima"])
+@pytest.mark.parametrize("endpoint", ["/question", "/question/stream"])
+def test_invalid_mode_is_rejected_before_answering(client, endpoint, mode):
+    response = client.post(endpoint, json={"question": "¿Qué es un grafo?", "model_provider": "groq", "mode": mode})
+    assert response.status_code == 400
+    assert "breve" in response.json()["detail"]
+    assert not response.headers["content-type"].startswith("text/event-stream")
+
+
+@pytest.mark.parametrize("mode", RESPONSE_MODES)
+def test_build_prompts_supports_every_mode(mode):
+    system_prompt, user_prompt = build_prompts("contexto", "¿Qué es un grafo?", mode)
+    assert "contexto" in user_prompt and system_prompt
+
+
+@pytest.mark.parametrize("mode", [None, "larguisima"])
+def test_build_prompts_rejects_unknown_modes(mode):
+    with pytest.raises(ValueError):
+        build_prompts("contexto", "¿Qué es un grafo?", mode)
+
+
+def test_stream_answer_reports_an_unknown_mode_as_an_error_event():
+    service = RAGService(embedding_service=SimpleNamespace(index_version=0))
+    service.initialized = True
+
+    async def collect():
+        return [event async for event in service.stream_answer("¿Qué es un grafo?", "groq", 3, "larguisima")]
+
+    events = asyncio.run(collect())
+    assert [name for name, _ in events] == ["error"]
@@ -0,0 +1,30 @@
+"""rerank_results: MMR sobre los candidatos pedidos de más, siempre con como mucho k chunks"""
+import numpy as np
+
+from src.services.reranking import rerank_results
+
+
+def candidates(n: int, with_embeddings: bool = True) -> dict:
+    results = {
+        "ids": [[f"chunk-{i}" for i in range(n)]],
+        "documents": [[f"Fragmento {i} sobre un tema distinto numero {i * 7}" for i in range(n)]],
+        "metadatas": [[{"source": f"doc{i}.pdf", "page": i} for i in range(n)]],
+        "distances": [[0.1 * i for i in range(n)]],
+    }
+    if with_embeddings:
+        results["embeddings"] = [np.eye(n, dtype=np.float32)]
+    return results
+
+
+def test_mmr_returns_k_chunks():
+    results = rerank_results(candidates(9), np.eye(9, dtype=np.float32)[0], k=3)
+    assert len(results["ids"][0]) == 3
+    assert results["ids"][0][0] == "chunk-0"
+    assert results["candidates"] == 9
+
+
+def test_without_embeddings_returns_the_best_k_candidates():
+    results = rerank_results(candidates(9, with_embeddings=False), np.zeros(9, dtype=np.float32), k=3)
+    assert results["ids"] == [["chunk-0", "chunk-1", "chunk-2"]]
+    assert len(results["documents"][0]) == len(results["metadatas"][0]) == 3
+    assert results["candidates"] == 9
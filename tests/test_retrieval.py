@@ -0,0 +1,53 @@
+"""Búsqueda del lote (_retrieve_many) frente a la de una pregunta (_retrieve)"""
+import hashlib
+
+import numpy as np
+import pytest
+
+from src.services import embedding_service_chroma, rag_service
+from src.services.embedding_service_chroma import EmbeddingServiceChroma
+from src.services.rag_service import RAGService
+
+DIM = 16
+TOPICS = ("grafo", "arbol", "pila", "cola", "hash", "heuristica", "gradiente", "matriz")
+
+
+def fake_embeddings(texts: list) -> list:
+    vectors = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+        vectors.append(np.random.default_rng(seed).standard_normal(DIM).astype(np.float32).tolist())
+    return vectors
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_service_chroma, "HYBRID_SEARCH_ENABLED", True)
+    embedding_service = EmbeddingServiceChroma(persist_dir=str(tmp_path / "persist"), persistent=False,
+                                               vector_backend="numpy", role="standalone")
+    monkeypatch.setattr(embedding_service, "_embed_documents", fake_embeddings)
+    docs = [
+        {"id": f"chunk-{i}",
+         "text": f"Apunte {i}: {TOPICS[i % len(TOPICS)]} y {TOPICS[(i * 3) % len(TOPICS)]} en el capitulo {i // 8}",
+         "metadata": {"source": f"doc{i // 10}.pdf", "page": i % 10}}
+        for i in range(80)
+    ]
+    embedding_service.add_documents(docs, persist=False)
+    return RAGService(index_path=tmp_path / "registry", embedding_service=embedding_service)
+
+
+@pytest.mark.parametrize("rerank", [True, False])
+def test_batch_retrieves_the_same_chunks_as_a_single_question(service, monkeypatch, rerank):
+    monkeypatch.setattr(rag_service, "RERANK_ENABLED", rerank)
+    questions = ["¿Qué es un grafo?", "pila y cola", "gradiente de una matriz"]
+    # top_k > 6 pide más candidatos que HYBRID_CANDIDATES (20) con RERANK_FETCH_FACTOR=3
+    top_ks = [2, 9, 4]
+    embeddings = fake_embeddings(questions)
+
+    batch = service._retrieve_many(embeddings, questions, top_ks)
+
+    for embedding, question, top_k, batch_result in zip(embeddings, questions, top_ks, batch):
+        single = service._retrieve(embedding, question, top_k)
+        assert batch_result["ids"] == single["ids"]
+        assert batch_result["documents"] == single["documents"]
+        assert len(batch_result["ids"][0]) <= top_k
@@ -0,0 +1,49 @@
+"""Generaciones del índice compartido: limpieza en el builder y apertura en el reader"""
+import shutil
+
+import numpy as np
+
+from src.services.embedding_service_chroma import EmbeddingServiceChroma
+from src.services.shared_index import SharedIndex
+
+
+def publish(index: SharedIndex, size: int = 4) -> dict:
+    ids = [f"chunk-{i}" for i in range(size)]
+    texts = [f"texto del chunk {i}" for i in range(size)]
+    vectors = np.eye(size, dtype=np.float32)
+    return index.publish(ids, texts, [{"source": "a.pdf"}] * size, vectors, None)
+
+
+def generations(index: SharedIndex) -> list:
+    return sorted(path.name for path in index.root.glob("gen-*"))
+
+
+def test_prune_keeps_the_current_generation_and_the_previous_one(tmp_path):
+    index = SharedIndex(tmp_path, keep=1)
+    for _ in range(4):
+        publish(index)
+    assert generations(index) == ["gen-000003", "gen-000004"]
+    assert index.current()["path"] == "gen-000004"
+
+
+def test_prune_keeps_the_configured_generations(tmp_path):
+    index = SharedIndex(tmp_path, keep=3)
+    for _ in range(5):
+        publish(index)
+    assert generations(index) == ["gen-000003", "gen-000004", "gen-000005"]
+
+
+def test_reader_rereads_current_when_its_generation_disappears(tmp_path, monkeypatch):
+    index = SharedIndex(tmp_path / "shared")
+    stale = publish(index)
+    publish(index)
+    # CURRENT leído justo antes de que el builder borrara esa generación
+    shutil.rmtree(index.root / stale["path"])
+    pointers = iter([stale])
+    current = index.current
+    monkeypatch.setattr(index, "current", lambda: next(pointers, None) or current())
+
+    reader = EmbeddingServiceChroma(persist_dir=str(tmp_path / "reader"), role="reader", shared_index=index)
+    assert reader.attach_shared_index()
+    assert reader.shared_generation == 2
+    assert reader.vector_store.count() == 4
@@ -0,0 +1,98 @@
+"""SingleFlight.run: pedidos idénticos en curso comparten un cálculo, también si se cancelan"""
+import asyncio
+
+import pytest
+
+from src.services.single_flight import SingleFlight, coalesce_key
+
+
+class Computation:
+    """factory() para SingleFlight.run que cuenta las llamadas y termina cuando se la libera"""
+
+    def __init__(self, result="respuesta", error: Exception = None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_key_normalizes_the_question():
+    assert coalesce_key("  ¿Qué es  un GRAFO? ", "breve", "groq", 3) == coalesce_key("¿qué es un grafo?", "breve", "groq", 3)
+    assert coalesce_key("grafo", "breve", "groq", 3) != coalesce_key("grafo", "detallada", "groq", 3)
+
+
+def test_identical_requests_share_one_computation():
+    async def scenario():
+        flight, computation = SingleFlight(), Computation()
+        first = asyncio.ensure_future(flight.run("k", computation))
+        second = asyncio.ensure_future(flight.run("k", computation))
+        await asyncio.sleep(0)
+        computation.release.set()
+        return await first, await second, computation.calls, flight.in_flight
+
+    first, second, calls, in_flight = asyncio.run(scenario())
+    assert first == ("respuesta", False)
+    assert second == ("respuesta", True)
+    assert calls == 1 and in_flight == 0
+
+
+def test_cancelling_the_initiator_does_not_cancel_the_shared_computation():
+    async def scenario():
+        flight, computation = SingleFlight(), Computation()
+        initiator = asyncio.ensure_future(flight.run("k", computation))
+        follower = asyncio.ensure_future(flight.run("k", computation))
+        await asyncio.sleep(0)
+        initiator.cancel()
+        await asyncio.sleep(0)
+        computation.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await initiator
+        return await follower, computation.calls
+
+    result, calls = asyncio.run(scenario())
+    assert result == ("respuesta", True)
+    assert calls == 1
+
+
+def test_computation_finishes_even_if_every_waiter_is_cancelled():
+    async def scenario():
+        flight, computation = SingleFlight(), Computation()
+        waiter = asyncio.ensure_future(flight.run("k", computation))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert flight.in_flight == 1
+        # Un pedido idéntico que llega después se suma al cálculo que siguió en curso
+        late = asyncio.ensure_future(flight.run("k", computation))
+        await asyncio.sleep(0)
+        computation.release.set()
+        return await late, computation.calls, flight.in_flight
+
+    result, calls, in_flight = asyncio.run(scenario())
+    assert result == ("respuesta", True)
+    assert calls == 1 and in_flight == 0
+
+
+def test_errors_reach_every_waiter_and_are_not_remembered():
+    async def scenario():
+        flight, failing = SingleFlight(), Computation(error=RuntimeError("proveedor caído"))
+        waiters = [asyncio.ensure_future(flight.run("k", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        failing.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+
+        retry = Computation()
+        retry.release.set()
+        return results, failing.calls, await flight.run("k", retry)
+
+    results, calls, retried = asyncio.run(scenario())
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == ("respuesta", False)
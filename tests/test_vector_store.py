@@ -0,0 +1,53 @@
+"""Escrituras del NumpyVectorStore frente a las búsquedas en curso (instantáneas del estado)"""
+import numpy as np
+
+from src.services.embedding_store import EmbeddingArtifact, save_embedding_artifact
+from src.services.vector_store import NumpyVectorStore
+
+
+def vectors(*rows) -> np.ndarray:
+    return np.asarray(rows, dtype=np.float32)
+
+
+def test_overwriting_a_row_does_not_touch_the_previous_snapshot():
+    store = NumpyVectorStore()
+    store.upsert(["a", "b"], ["ta", "tb"], [{}, {}], vectors([1, 0], [0, 1]))
+    snapshot = store._state
+
+    store.upsert(["a"], ["ta2"], [{}], vectors([0, 2]))
+    # Una búsqueda que tomó la instantánea anterior sigue viendo el vector y la norma viejos
+    assert snapshot["matrix"][0].tolist() == [1, 0]
+    assert snapshot["norms"][0] == 1
+    assert store.get(ids=["a"], include=["embeddings"])["embeddings"][0].tolist() == [0, 2]
+    assert store.query([0, 3], n_results=1)["ids"][0] == ["a"]
+
+
+def test_appending_uses_spare_capacity_without_copying():
+    store = NumpyVectorStore()
+    store.upsert(["a"], ["ta"], [{}], vectors([1, 0]))
+    matrix = store._state["matrix"]
+    store.upsert(["b"], ["tb"], [{}], vectors([0, 1]))
+    assert store._state["matrix"] is matrix
+    assert store.count() == 2
+
+
+def test_upsert_with_unchanged_vectors_only_updates_texts():
+    store = NumpyVectorStore()
+    store.upsert(["a", "b"], ["ta", "tb"], [{}, {}], vectors([1, 0], [0, 1]))
+    matrix = store._state["matrix"]
+    store.upsert(["a", "b"], ["ta2", "tb2"], [{"page": 1}, {"page": 2}], vectors([1, 0], [0, 1]))
+    assert store._state["matrix"] is matrix
+    assert store.get(ids=["a", "b"])["documents"] == ["ta2", "tb2"]
+
+
+def test_overwriting_rows_of_a_float16_artifact(tmp_path):
+    # float16: la matriz se convierte a memoria (escribible) pero las normas siguen siendo el mmap
+    save_embedding_artifact(tmp_path, ["a", "b"], ["ta", "tb"], [{}, {}], vectors([1, 0], [0, 1]), None,
+                            dtype="float16")
+    store = NumpyVectorStore()
+    store.load_artifact(EmbeddingArtifact(tmp_path))
+    assert not store._state["norms"].flags.writeable
+
+    store.upsert(["b"], ["tb2"], [{}], vectors([3, 4]))
+    assert store._state["norms"][1] == 25
+    assert store.query([3, 4], n_results=2)["ids"][0] == ["b", "a"]